@@ -54,6 +54,7 @@ setup(
     entry_points={
         "console_scripts": [
             "things-cli = things_cli.cli:main",
+            "things-cli-client = things_cli.client:main",
         ]
     },
     install_requires=["things.py>=0.0.15", "argcomplete>=3.0.0"],
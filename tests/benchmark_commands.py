@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""Benchmark every command, output format and `-r` on a large database.
+
+A synthetic database is generated (see tests/generate_database.py) unless
+one is given. Each combination runs in-process with the result cache
+disabled; the best wall time and the peak memory allocated by Python are
+reported. Results are saved as JSON and compared with a previous run.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from tests import generate_database
+from things_cli.cli import ThingsCLI
+
+
+DEFAULT_RESULTS = ".benchmarks/commands.json"
+
+# Commands that need arguments, have side effects or do not query tasks
+SKIPPED_COMMANDS = [
+    "feedback",
+    "search",
+    "cachestats",
+    "serve",
+    "batch",
+    "watch",
+    "index",
+    "snapshot",
+    "export",
+]
+
+FORMATS = {
+    "txt": [],
+    "json": ["-j"],
+    "jsonl": ["--jsonl"],
+    "csv": ["-c"],
+    "opml": ["-o"],
+    "gantt": ["-g"],
+}
+
+# Smaller than the generator defaults as `-r all` runs for every format
+BENCHMARK_COUNTS = {
+    "projects": 100,
+    "headings": 200,
+    "todos": 5000,
+    "checklist_items": 5000,
+}
+
+
+class NullOutput:
+    """Discard the output of a command."""
+
+    def write(self, data):
+        """Discard data."""
+        return len(data)
+
+    def writelines(self, lines):
+        """Discard lines."""
+        for _line in lines:
+            pass
+
+    def flush(self):
+        """Do nothing."""
+
+
+def commands():
+    """Return the names of all benchmarked subcommands."""
+    parser = ThingsCLI.get_parser()
+    # pylint: disable=protected-access
+    subparsers = next(
+        action
+        for action in parser._actions
+        if isinstance(action, argparse._SubParsersAction)
+    )
+    return [name for name in subparsers.choices if name not in SKIPPED_COMMANDS]
+
+
+def run(database, arguments):
+    """Run a command line once."""
+    args = ThingsCLI.get_parser().parse_args(["--no-cache", *arguments])
+    ThingsCLI(database=database, output=NullOutput()).main(args)
+
+
+def measure(database, arguments, repeat):
+    """Return the best wall time and the peak traced memory of a command line."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(database, arguments)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run(database, arguments)
+        _size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def benchmark(database, names, formats, repeat):
+    """Measure all combinations, printing each result as it is available."""
+    results = {}
+    for name in names:
+        for fmt in formats:
+            for recursive in [[], ["-r"]]:
+                arguments = [*FORMATS[fmt], *recursive, name]
+                label = "things-cli " + " ".join(arguments)
+                try:
+                    results[label] = measure(database, arguments, repeat)
+                except Exception as error:  # pylint: disable=broad-except
+                    results[label] = {"error": f"{type(error).__name__}: {error}"}
+                print(format_result(label, results[label]), flush=True)
+    return results
+
+
+def format_result(label, result, previous=None):
+    """Format a result line, with the previous result if given."""
+    if "error" in result:
+        return f"{label:40} {result['error']}"
+    line = (
+        f"{label:40} {result['seconds'] * 1000:10.1f} ms"
+        f" {result['peak_bytes'] / 2**20:8.1f} MiB"
+    )
+    if previous and "error" not in previous:
+        line += (
+            f"  (was {previous['seconds'] * 1000:10.1f} ms"
+            f" {previous['peak_bytes'] / 2**20:8.1f} MiB)"
+        )
+    return line
+
+
+def regressions(results, previous, tolerance):
+    """Return the labels of results slower or larger than before."""
+    failed = []
+    for label, result in results.items():
+        before = previous.get(label)
+        if not before or "error" in before:
+            continue
+        if "error" in result:
+            failed.append(label)
+        elif result["seconds"] > before["seconds"] * tolerance + 0.005:
+            failed.append(label)
+        elif result["peak_bytes"] > before["peak_bytes"] * tolerance + 2**16:
+            failed.append(label)
+    return failed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-d", "--database", help="benchmark an existing database")
+    parser.add_argument(
+        "--commands", help="comma-separated commands (default: all commands)"
+    )
+    parser.add_argument(
+        "--formats",
+        default=",".join(FORMATS),
+        help="comma-separated output formats (default: all formats)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="results file")
+    parser.add_argument(
+        "--save", action="store_true", help="save the results for comparison"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="allowed slowdown and growth factor against the saved results",
+    )
+    generate_database.add_arguments(parser)
+    parser.set_defaults(**BENCHMARK_COUNTS)
+    args = parser.parse_args()
+
+    names = args.commands.split(",") if args.commands else commands()
+    formats = args.formats.split(",")
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if not database:
+            database = os.path.join(directory, "main.sqlite")
+            counts = {
+                name: getattr(args, name) for name in generate_database.DEFAULT_COUNTS
+            }
+            generate_database.generate(database, seed=args.seed, **counts)
+            print(f"generated database: {counts}")
+        results = benchmark(database, names, formats, args.repeat)
+
+    previous = {}
+    if os.path.exists(args.results):
+        with open(args.results, encoding="utf-8") as file:
+            previous = json.load(file)
+
+    failed = regressions(results, previous, args.tolerance)
+    if previous:
+        print("\ncompared with", args.results)
+        for label, result in results.items():
+            line = format_result(label, result, previous.get(label))
+            print(line + ("  REGRESSION" if label in failed else ""))
+
+    if args.save or not previous:
+        os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+        with open(args.results, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""Benchmark the streaming OPML writer against the former minidom path."""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from xml.dom import minidom
+import xml.etree.ElementTree as ETree
+from xml.etree.ElementTree import Element, SubElement
+
+from things_cli import cli
+
+
+def make_tree(count):
+    """Create a synthetic task tree with roughly `count` tasks."""
+    tree = []
+    area = project = None
+    for index in range(count):
+        if index % 500 == 0:
+            area = {"title": f"Area {index} & <Co>", "type": "area", "items": []}
+            tree.append(area)
+        if index % 50 == 0:
+            project = {
+                "title": f'Project "{index}"',
+                "type": "project",
+                "start": "Anytime",
+                "items": [],
+            }
+            area["items"].append(project)  # type: ignore
+            continue
+        todo = {
+            "title": f"To-Do {index}",
+            "type": "to-do",
+            "start": "Anytime",
+            "start_date": "2021-03-28" if index % 3 else None,
+        }
+        if index % 7 == 0:
+            todo["checklist"] = [{"title": "Checklist item", "type": "checklist-item"}]
+        project["items"].append(todo)  # type: ignore
+    return tree
+
+
+def legacy_opml_dumps(tasks):
+    """Convert tasks into OPML the way things-cli 0.2.1 did."""
+    top = Element("opml")
+    head = SubElement(top, "head")
+    SubElement(head, "title").text = "Things 3 Database"
+    body = SubElement(top, "body")
+    legacy_opml_convert(tasks, body)
+    return minidom.parseString(ETree.tostring(top)).toprettyxml(indent="   ")
+
+
+def legacy_opml_convert(tasks, top):
+    """Build the ElementTree of selected tasks."""
+    if tasks is True:
+        return
+    for task in tasks:
+        area = SubElement(top, "outline")
+        text = task["title"]
+        if task.get("start_date"):
+            text = f"{text} (Scheduled: {task['start_date']})"
+        elif task.get("start"):
+            text = f"{text} ({task['start']})"
+        area.set("text", text)
+        legacy_opml_convert(task.get("items", []), area)
+        legacy_opml_convert(task.get("checklist", []), area)
+
+
+class NullOutput:  # pylint: disable=too-few-public-methods
+    """Discard everything written to it."""
+
+    def write(self, data):
+        """Discard data."""
+        return len(data)
+
+    def writelines(self, lines):
+        """Discard lines."""
+        for _ in lines:
+            pass
+
+
+def measure(function):
+    """Return wall time and peak traced memory of a call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=50000, help="number of tasks")
+    args = parser.parse_args()
+
+    tree = make_tree(args.tasks)
+    things3_cli = cli.ThingsCLI(output=NullOutput())
+    things3_cli.print_opml = True
+
+    if legacy_opml_dumps(tree) != things3_cli.opml_dumps(tree):
+        print("streaming OPML output differs from legacy output", file=sys.stderr)
+        sys.exit(1)
+
+    legacy_time, legacy_peak = measure(
+        lambda: print(legacy_opml_dumps(tree), file=NullOutput())  # type: ignore
+    )
+    stream_time, stream_peak = measure(lambda: things3_cli.print_tasks(tree))
+
+    print(f"tasks:     {args.tasks}")
+    print(f"legacy:    {legacy_time:8.3f}s  peak {legacy_peak / 2**20:8.1f} MiB")
+    print(f"streaming: {stream_time:8.3f}s  peak {stream_peak / 2**20:8.1f} MiB")
+    print(f"speedup:   {legacy_time / stream_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
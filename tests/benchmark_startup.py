@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""Benchmark the start-up time of things-cli and fail if it regresses.
+
+Measures the import time of `things_cli.cli` (via `python -X importtime`),
+the wall time of common commands against tests/main.sqlite and of a shell
+completion request. Results are compared against a saved baseline.
+"""
+
+import argparse
+import json
+import os
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+
+
+DATABASE = os.path.join(os.path.dirname(__file__), "main.sqlite")
+DEFAULT_BASELINE = ".benchmarks/startup.json"
+
+# Modules that must only be imported by the commands or formats needing them
+LAZY_MODULES = [
+    "argcomplete",
+    "concurrent.futures",
+    "csv",
+    "json",
+    "sqlite3",
+    "things",
+    "webbrowser",
+    "xml",
+]
+
+COMMANDS = [
+    ["today"],
+    ["inbox"],
+    ["-j", "today"],
+    ["-c", "anytime"],
+    ["-o", "-r", "areas"],
+    ["-r", "all"],
+]
+
+
+def run(arguments, env=None):
+    """Run a Python subprocess and return its wall time and stderr."""
+    start = time.perf_counter()
+    process = subprocess.run(  # nosec
+        [sys.executable, *arguments],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return time.perf_counter() - start, process.stderr
+
+
+def import_time(repeat):
+    """Return the cumulative import time of things_cli.cli in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        _elapsed, stderr = run(["-X", "importtime", "-c", "import things_cli.cli"])
+        for line in stderr.splitlines():
+            if line.endswith("| things_cli.cli"):
+                best = min(best, int(line.split("|")[1]) / 1e6)
+    return best
+
+
+def eager_modules():
+    """Return lazily loaded modules that are imported with things_cli.cli."""
+    process = subprocess.run(  # nosec
+        [
+            sys.executable,
+            "-c",
+            "import sys, things_cli.cli; print('\\n'.join(sys.modules))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    loaded = set(process.stdout.split())
+    return [module for module in LAZY_MODULES if module in loaded]
+
+
+def command_time(command, repeat):
+    """Return the best wall time of a command."""
+    arguments = ["-m", "things_cli.cli", "--no-cache", "-d", DATABASE, *command]
+    return min(run(arguments)[0] for _ in range(repeat))
+
+
+def completion_time(repeat):
+    """Return the best wall time of completing a command name."""
+    with tempfile.NamedTemporaryFile() as output:
+        line = "things-cli to"
+        env = dict(
+            os.environ,
+            _ARGCOMPLETE="1",
+            _ARGCOMPLETE_STDOUT_FILENAME=output.name,
+            COMP_LINE=line,
+            COMP_POINT=str(len(line)),
+        )
+        return min(run(["-m", "things_cli.cli"], env)[0] for _ in range(repeat))
+
+
+def measure(repeat):
+    """Run all measurements."""
+    results = {"import things_cli.cli": import_time(repeat)}
+    for command in COMMANDS:
+        results["things-cli " + " ".join(command)] = command_time(command, repeat)
+    results["completion"] = completion_time(repeat)
+    return results
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as new baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="allowed slowdown factor against the baseline",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    eager = eager_modules()
+    if eager:
+        print(f"imported at start-up: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+
+    results = measure(args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    for name, seconds in results.items():
+        line = f"{name:32} {seconds * 1000:8.1f} ms"
+        if name in baseline:
+            limit = baseline[name] * args.tolerance + 0.005
+            line += f"  (baseline {baseline[name] * 1000:8.1f} ms)"
+            if seconds > limit:
+                line += "  REGRESSION"
+                failed = True
+        print(line)
+
+    if args.save or not baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
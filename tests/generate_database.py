@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""Generate large, schema-compatible Things databases for benchmarks.
+
+The schema and the metadata are copied from tests/main.sqlite, the
+content is random but reproducible for a given seed.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import string
+
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "main.sqlite")
+UUID_ALPHABET = string.ascii_letters + string.digits
+
+DEFAULT_COUNTS = {
+    "areas": 20,
+    "projects": 300,
+    "headings": 600,
+    "todos": 20000,
+    "checklist_items": 20000,
+    "tags": 30,
+}
+
+# Incomplete, canceled, completed
+STATUS_WEIGHTS = ([0, 2, 3], [50, 5, 45])
+
+
+def make_uuid(rng):
+    """Return a random Things-like uuid."""
+    return "".join(rng.choice(UUID_ALPHABET) for _ in range(22))
+
+
+def make_thingsdate(date):
+    """Return a date in the Things binary format YYYYYYYYYYYMMMMDDDDD0000000."""
+    return date.year << 16 | date.month << 12 | date.day << 7
+
+
+def make_title(rng, prefix):
+    """Return a random title."""
+    words = ["Call", "Plan", "Write", "Review", "Buy", "Fix", "Read", "Book"]
+    return f"{prefix} {rng.choice(words)} {rng.randrange(10**6)}"
+
+
+def copy_schema(connection):
+    """Create the tables and indices of the template database."""
+    template = sqlite3.connect(f"file:{TEMPLATE}?mode=ro", uri=True)
+    statements = template.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        ORDER BY type DESC
+        """).fetchall()
+    for (statement,) in statements:
+        connection.execute(statement)
+    for table in ["Meta", "TMSettings"]:
+        rows = template.execute(f"SELECT * FROM {table}").fetchall()  # nosec
+        for row in rows:
+            placeholders = ", ".join("?" for _ in row)
+            connection.execute(
+                f"INSERT INTO {table} VALUES ({placeholders})", row  # nosec
+            )
+    template.close()
+
+
+def insert(connection, table, rows):
+    """Insert dicts with the same keys into a table."""
+    if not rows:
+        return
+    columns = list(rows[0])
+    names = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join(f":{column}" for column in columns)
+    connection.executemany(
+        f"INSERT INTO {table} ({names}) VALUES ({placeholders})", rows  # nosec
+    )
+
+
+def make_task(rng, now, task_type, index, **kwargs):
+    """Return a TMTask row."""
+    created = now - rng.uniform(0, 3 * 365 * 86400)
+    status = rng.choices(*STATUS_WEIGHTS)[0] if task_type != 2 else 0
+    task = {
+        "uuid": make_uuid(rng),
+        "creationDate": created,
+        "userModificationDate": created + rng.uniform(0, 86400),
+        "type": task_type,
+        "status": status,
+        "stopDate": created + rng.uniform(0, 30 * 86400) if status else None,
+        "trashed": int(rng.random() < 0.03),
+        "title": make_title(rng, ["To-Do", "Project", "Heading"][task_type]),
+        "notes": "Some notes\nwith two lines" if rng.random() < 0.3 else "",
+        "start": rng.choice([1, 1, 2]),
+        "startDate": None,
+        "deadline": None,
+        "index": index,
+        "area": None,
+        "project": None,
+        "heading": None,
+    }
+    today = datetime.date.fromtimestamp(now)
+    if task_type != 2 and rng.random() < 0.2:
+        offset = datetime.timedelta(days=rng.randrange(-30, 60))
+        task["startDate"] = make_thingsdate(today + offset)
+    if task_type != 2 and rng.random() < 0.1:
+        offset = datetime.timedelta(days=rng.randrange(-10, 90))
+        task["deadline"] = make_thingsdate(today + offset)
+    task.update(kwargs)
+    return task
+
+
+def make_todos(rng, now, count, parents):
+    """Return to-dos spread over the Inbox and the projects, headings and areas."""
+    projects, headings, areas = parents
+    todos = []
+    for index in range(count):
+        placement = rng.random()
+        if placement < 0.05:
+            context = {"start": 0}
+        elif placement < 0.45 and projects:
+            context = {"project": rng.choice(projects)["uuid"]}
+        elif placement < 0.6 and headings:
+            context = {"heading": rng.choice(headings)["uuid"]}
+        elif placement < 0.8 and areas:
+            context = {"area": rng.choice(areas)["uuid"]}
+        else:
+            context = {}
+        todos.append(make_task(rng, now, 0, index, **context))
+    return todos
+
+
+def make_checklist_items(rng, count, todos):
+    """Return checklist items of random to-dos."""
+    checklist_items = []
+    for index in range(count if todos else 0):
+        todo = rng.choice(todos)
+        status = rng.choices(*STATUS_WEIGHTS)[0]
+        checklist_items.append(
+            {
+                "uuid": make_uuid(rng),
+                "userModificationDate": todo["creationDate"],
+                "creationDate": todo["creationDate"],
+                "title": make_title(rng, "Item"),
+                "status": status,
+                "stopDate": todo["creationDate"] if status else None,
+                "index": index,
+                "task": todo["uuid"],
+            }
+        )
+    return checklist_items
+
+
+def make_taggings(rng, tags, tasks, areas):
+    """Return TMTaskTag and TMAreaTag rows tagging some tasks and areas."""
+    task_tags = []
+    area_tags = []
+    for task in tasks if tags else []:
+        if rng.random() < 0.2:
+            for tag in rng.sample(tags, min(2, len(tags))):
+                task_tags.append({"tasks": task["uuid"], "tags": tag["uuid"]})
+    for area in areas if tags else []:
+        if rng.random() < 0.3:
+            area_tags.append({"areas": area["uuid"], "tags": rng.choice(tags)["uuid"]})
+    return task_tags, area_tags
+
+
+def generate(path, seed=0, **counts):  # pylint: disable=too-many-locals
+    """Write a Things database with the given number of objects to `path`."""
+    counts = {**DEFAULT_COUNTS, **counts}
+    rng = random.Random(seed)
+    now = datetime.datetime.now().timestamp()
+
+    tags = [
+        {"uuid": make_uuid(rng), "title": f"Tag {index}", "index": index}
+        for index in range(counts["tags"])
+    ]
+    areas = [
+        {"uuid": make_uuid(rng), "title": f"Area {index}", "index": index}
+        for index in range(counts["areas"])
+    ]
+    projects = [
+        make_task(rng, now, 1, index, area=rng.choice([*areas, {"uuid": None}])["uuid"])
+        for index in range(counts["projects"])
+    ]
+    headings = [
+        make_task(rng, now, 2, index, project=rng.choice(projects)["uuid"])
+        for index in range(counts["headings"] if projects else 0)
+    ]
+    todos = make_todos(rng, now, counts["todos"], (projects, headings, areas))
+    checklist_items = make_checklist_items(rng, counts["checklist_items"], todos)
+    task_tags, area_tags = make_taggings(rng, tags, todos + projects, areas)
+
+    tasks = projects + headings + todos
+    # Unique Today indices, ties would make things.today() compare None dates
+    for today_index, task in enumerate(tasks):
+        task["todayIndex"] = today_index
+
+    if os.path.exists(path):
+        os.unlink(path)
+    connection = sqlite3.connect(path)
+    copy_schema(connection)
+    with connection:
+        insert(connection, "TMTag", tags)
+        insert(connection, "TMArea", areas)
+        insert(connection, "TMTask", tasks)
+        insert(connection, "TMChecklistItem", checklist_items)
+        insert(connection, "TMTaskTag", task_tags)
+        insert(connection, "TMAreaTag", area_tags)
+    connection.close()
+
+
+def add_arguments(parser):
+    """Add the object counts as command line options."""
+    for name, count in DEFAULT_COUNTS.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=int,
+            default=count,
+            dest=name,
+            help=f"number of {name.replace('_', ' ')} (default {count})",
+        )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+
+def main():
+    """Generate a database from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="path of the database to write")
+    add_arguments(parser)
+    args = vars(parser.parse_args())
+    generate(args.pop("path"), **args)
+
+
+if __name__ == "__main__":
+    main()
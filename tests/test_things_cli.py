@@ -2,11 +2,59 @@
 
 """Module documentation goes here."""
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager, redirect_stderr
+import csv
 import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
-from things_cli import cli
+from tests import generate_database
+from things_cli import (batch, cache, cli, client, completion, connection,
+                        export, fanout, model, search, server, snapshot, stats,
+                        stream, timings, tree, watch)
+
+
+CACHE_DIRECTORY = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+os.environ[cache.ENVIRONMENT_VARIABLE_WITH_CACHE] = os.path.join(
+    CACHE_DIRECTORY.name, "cache.sqlite"
+)
+
+
+def run(*arguments, database="tests/main.sqlite"):
+    """Run a command line without the cache, return it as a completed process."""
+    output = io.StringIO()
+    errors = io.StringIO()
+    things_cli = cli.ThingsCLI(database=database, output=output, errors=errors)
+    args = things_cli.get_parser().parse_args(["--no-cache", *arguments])
+    status = 0
+    with redirect_stderr(errors):
+        try:
+            things_cli.main(args)
+        except SystemExit as error:
+            status = error.code
+    return subprocess.CompletedProcess(
+        arguments, status, output.getvalue(), errors.getvalue()
+    )
+
+
+@contextmanager
+def generated_database(**counts):
+    """Yield the path of a generated database in a temporary directory."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "main.sqlite")
+        generate_database.generate(path, **counts)
+        yield path
 
 
 class ThingsCLICase(unittest.TestCase):
@@ -30,7 +78,21 @@ class ThingsCLICase(unittest.TestCase):
         for command in parser._subparsers._actions[
             1
         ].choices:  # noqa # pylint: disable=protected-access
-            if command not in ["feedback", "search", "logtoday", "createdtoday"]:
+            if command not in [
+                "feedback",
+                "search",
+                "logtoday",
+                "createdtoday",
+                "cachestats",
+                "serve",
+                "batch",
+                "watch",
+                "index",
+                "snapshot",
+                "export",
+                "statcsv",
+                "empty",
+            ]:
                 args = parser.parse_args([command])
                 self._test_main(args, " ")
                 args = parser.parse_args(["-r", command])
@@ -41,6 +103,8 @@ class ThingsCLICase(unittest.TestCase):
                 self._test_main(args, ";")
                 args = parser.parse_args(["-r", "-j", command])
                 self._test_main(args, " ")
+                args = parser.parse_args(["-r", "--jsonl", "--flatten", command])
+                self._test_main(args, " ")
             elif command in ["logtoday"]:
                 args = parser.parse_args([command])
                 self._test_main(args, "")
@@ -50,6 +114,22 @@ class ThingsCLICase(unittest.TestCase):
         args = parser.parse_args(["search", "To-Do"])
         self._test_main(args, "To-Do in Today")
 
+    def test_lazy_imports(self):
+        """Test that heavy dependencies are not imported at start-up."""
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, things_cli.cli; print('\\n'.join(sys.modules))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        loaded = process.stdout.split()
+        for module in ["argcomplete", "csv", "json", "things", "webbrowser", "xml"]:
+            self.assertNotIn(module, loaded)
+
     def test_noparam(self):
         """Test no parameter."""
         new_out = io.StringIO()
@@ -79,6 +159,727 @@ class ThingsCLICase(unittest.TestCase):
             sys.stdout = old_out
         self.assertIn("To-Do in Today", new_out.getvalue())
 
+    def test_all_workers(self):
+        """Test that concurrent and sequential fetching give the same result."""
+        parser = self.things3_cli.get_parser()
+        outputs = []
+        for workers in ["1", "8"]:
+            # Uncached, as --workers is not part of the cache key
+            args = parser.parse_args(
+                ["--no-cache", "-r", "-j", "--workers", workers, "all"]
+            )
+            new_out = io.StringIO()
+            old_out = sys.stdout
+            try:
+                sys.stdout = new_out
+                self.things3_cli.main(args)
+            finally:
+                sys.stdout = old_out
+            outputs.append(new_out.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn('"title": "Areas"', outputs[1])
+
+    def test_cache(self):
+        """Test answering repeated commands from the cache."""
+        parser = self.things3_cli.get_parser()
+        args = parser.parse_args(["-j", "cachestats"])
+        new_out = io.StringIO()
+        old_out = sys.stdout
+        try:
+            sys.stdout = new_out
+            self.things3_cli.main(parser.parse_args(["-r", "inbox"]))
+            self.things3_cli.main(parser.parse_args(["-r", "inbox"]))
+            self.things3_cli.main(parser.parse_args(["--no-cache", "-r", "inbox"]))
+            output = new_out.getvalue()
+            new_out.seek(0)
+            new_out.truncate()
+            self.things3_cli.main(args)
+        finally:
+            sys.stdout = old_out
+        third = len(output) // 3
+        self.assertEqual(output[:third], output[third : 2 * third])
+        self.assertEqual(output[:third], output[2 * third :])
+        self.assertGreaterEqual(json.loads(new_out.getvalue())["hits"], 1)
+
+    def test_cache_eviction(self):
+        """Test evicting least recently used entries."""
+        with tempfile.TemporaryDirectory() as directory:
+            result_cache = cache.Cache(os.path.join(directory, "c.sqlite"), 10)
+            result_cache.put("a", "state", "12345")
+            result_cache.put("b", "state", "12345")
+            self.assertEqual("12345", result_cache.get("a", "state"))
+            self.assertIsNone(result_cache.get("a", "other state"))
+            result_cache.put("c", "state", "12345")
+            self.assertIsNone(result_cache.get("b", "state"))
+            self.assertEqual(1, result_cache.stats()["evictions"])
+            result_cache.close()
+
+    def test_server(self):
+        """Test answering commands over a Unix socket."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "things-cli.sock")
+            things_server = server.ThingsServer("tests/main.sqlite")
+            thread = threading.Thread(
+                target=things_server.serve_unix, args=(path,), daemon=True
+            )
+            thread.start()
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            new_out, new_err = io.StringIO(), io.StringIO()
+            status = client.request(["--no-cache", "today"], path, new_out, new_err)
+            self.assertEqual(0, status)
+            self.assertIn("To-Do in Today", new_out.getvalue())
+            status = client.request(["serve"], path, new_out, new_err)
+            self.assertEqual(2, status)
+            status = client.request(["unknown"], path, new_out, new_err)
+            self.assertEqual(2, status)
+            self.assertIn("invalid choice", new_err.getvalue())
+            self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+
+            environment = {"XDG_CACHE_HOME": directory, "XDG_RUNTIME_DIR": ""}
+            with mock.patch.dict(os.environ, environment):
+                os.environ.pop(client.ENVIRONMENT_VARIABLE_WITH_SOCKET, None)
+                self.assertEqual(
+                    os.path.join(directory, "things-cli", "things-cli.sock"),
+                    client.default_socket_path(),
+                )
+
+        output = io.StringIO()
+        argv = ["--no-cache", "-d", "main.sqlite", "today"]
+        self.assertEqual((0, ""), things_server.run(argv, output, cwd="tests"))
+        self.assertIn("To-Do in Today", output.getvalue())
+        for argv, message in [
+            (["snapshot", "copy.sqlite"], "command 'snapshot' is not available"),
+            (["--profile", "run.prof", "today"], "option --profile is not"),
+            (["stat", "--since", "bogus"], "invalid day 'bogus'"),
+        ]:
+            status, errors = things_server.run(argv, io.StringIO())
+            self.assertEqual(2, status)
+            self.assertIn(message, errors)
+
+    def test_server_http(self):
+        """Test that the HTTP server only answers JSON requests to loopback."""
+        import http.client  # pylint: disable=import-outside-toplevel
+        import socket  # pylint: disable=import-outside-toplevel
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        things_server = server.ThingsServer("tests/main.sqlite")
+        threading.Thread(
+            target=things_server.serve_http, args=(port,), daemon=True
+        ).start()
+        body = json.dumps({"argv": ["--no-cache", "today"]})
+        for headers, expected in [
+            ({"Host": "evil.example:80", "Content-Type": "application/json"}, 403),
+            ({"Host": f"localhost:{port}", "Content-Type": "text/plain"}, 415),
+            ({"Host": f"127.0.0.1:{port}", "Content-Type": "application/json"}, 200),
+        ]:
+            for _ in range(100):
+                try:
+                    http_connection = http.client.HTTPConnection("127.0.0.1", port)
+                    http_connection.request("POST", "/", body, headers)
+                    break
+                except ConnectionRefusedError:
+                    time.sleep(0.01)
+            response = http_connection.getresponse()
+            self.assertEqual(expected, response.status)
+            if expected == 200:
+                self.assertIn("To-Do in Today", json.loads(response.read())["stdout"])
+            http_connection.close()
+
+    def test_batch(self):
+        """Test running several command lines in one process."""
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as file:
+            file.write("# comment\n\ntoday\nthings-cli -j inbox\n")
+            file.write('search "To-Do in Today"\nserve\nunknown\n')
+            file.flush()
+            for jobs in ["1", "4"]:
+                output = io.StringIO()
+                things_cli = cli.ThingsCLI(database="tests/main.sqlite", output=output)
+                args = things_cli.get_parser().parse_args(
+                    ["--no-cache", "batch", "--jobs", jobs, file.name]
+                )
+                with self.assertRaises(SystemExit):
+                    things_cli.main(args)
+                records = [json.loads(line) for line in output.getvalue().splitlines()]
+                self.assertEqual(
+                    [3, 4, 5, 6, 7], [record["line"] for record in records]
+                )
+                self.assertEqual(
+                    [0, 0, 0, 2, 2], [record["exit"] for record in records]
+                )
+                self.assertIn("To-Do in Today", records[0]["stdout"])
+                self.assertEqual(["-j", "inbox"], records[1]["argv"])
+                self.assertTrue(json.loads(records[1]["stdout"]))
+                self.assertIn("To-Do in Today", records[2]["stdout"])
+                self.assertIn("batch mode", records[3]["stderr"])
+                self.assertIn("invalid choice", records[4]["stderr"])
+
+        # Errors after parsing and reports belong to the record of their command
+        runner = batch.BatchRunner("tests/main.sqlite", use_cache=False)
+        lines = ["stat --since bogus", "--sort nope mostClosed", "--timings today"]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            records = list(executor.map(runner.run_line, range(3), lines))
+        self.assertEqual([2, 2, 0], [record["exit"] for record in records])
+        self.assertIn("invalid day 'bogus'", records[0]["stderr"])
+        self.assertIn("has no column 'nope'", records[1]["stderr"])
+        self.assertEqual("today", json.loads(records[2]["stderr"])["command"])
+
+    def test_watch(self):
+        """Test emitting the changes of a command after writes."""
+        with generated_database(areas=2, projects=0, todos=0) as path:
+            things_cli = cli.ThingsCLI(database=path)
+            args = things_cli.get_parser().parse_args(
+                ["watch", "--debounce", "0.01", "--", "-r", "areas"]
+            )
+            watcher = watch.PollingWatcher(path, interval=0.01)
+            changes = watch.changes(things_cli, args, watcher)
+            events = next(changes)
+            self.assertEqual(["added"] * 2, [event["event"] for event in events])
+            with closing(sqlite3.connect(path)) as writer:
+                with writer:
+                    writer.execute(
+                        "UPDATE TMArea SET title = 'Renamed' WHERE `index` = 0"
+                    )
+                    writer.execute("DELETE FROM TMArea WHERE `index` = 1")
+            events = next(changes)
+            self.assertEqual(
+                [("modified", "Renamed"), ("removed", "Area 1")],
+                [(event["event"], event["task"]["title"]) for event in events],
+            )
+            changes.close()
+
+    def test_search_index(self):
+        """Test the full-text search index and its incremental updates."""
+        self.assertEqual(
+            '"To-Do" "in"* OR "a b"', search.make_query('To-Do in* OR "a b"')
+        )
+        self.assertEqual('"foo" "AND"', search.make_query("foo AND"))
+        self.assertEqual('"OR" "a" "OR" "NOT" "b"', search.make_query("OR a OR NOT b"))
+        with generated_database(todos=200, checklist_items=50) as path:
+            directory = os.path.dirname(path)
+            index = search.SearchIndex(path, os.path.join(directory, "index.sqlite"))
+            self.assertEqual(200 + 300 + 600, index.update())
+            self.assertEqual(0, index.update())
+            with closing(sqlite3.connect(path)) as writer:
+                with writer:
+                    uuid, title = writer.execute(
+                        "SELECT uuid, title FROM TMTask WHERE type = 0"
+                    ).fetchone()
+                    writer.execute(
+                        "UPDATE TMTask SET title = 'Zebra crossing',"
+                        " userModificationDate = userModificationDate + 1e9"
+                        " WHERE uuid = ?",
+                        (uuid,),
+                    )
+                    writer.execute("DELETE FROM TMTask WHERE title LIKE 'Heading%'")
+            self.assertEqual([], index.search("zebra"))
+            self.assertLess(1 + 600, index.update())
+            self.assertEqual([uuid], index.search("zeb*"))
+            self.assertEqual([uuid], index.search('"zebra crossing"'))
+            self.assertEqual([], index.search(title))
+            self.assertEqual([], index.search("Heading"))
+            for string in ["foo AND", "OR", "AND NOT", "zebra OR OR crossing", '"']:
+                self.assertIsInstance(index.search(string), list)
+            index.close()
+
+    def test_completion(self):
+        """Test the completers and the refresh of their index."""
+        with generated_database(todos=50) as path:
+            args = argparse.Namespace(database=path)
+            with closing(sqlite3.connect(path)) as reader:
+                uuid, title = reader.execute(
+                    "SELECT uuid, title FROM TMTask WHERE type = 1 AND status = 0"
+                ).fetchone()
+            completers = completion.Completers()
+            self.assertEqual({uuid: title}, completers.projects(uuid[:8], args))
+            self.assertIn(uuid, completers.projects(title.lower(), args))
+            self.assertTrue(completers.validate(uuid, title))
+            self.assertFalse(completers.validate("other", title))
+            self.assertEqual(["Tag 1"], completers.tags("tag 1", args)[:1])
+            self.assertIn("Area 0", completers.areas("area 0", args).values())
+            self.assertIn("review", completers.search("Rev", args))
+
+            index = completion.index_path(path)
+            state = os.stat(index).st_mtime_ns
+            self.assertNotIn("Zebra", completion.load(path)["projects"].values())
+            self.assertEqual(state, os.stat(index).st_mtime_ns)
+            with closing(sqlite3.connect(path)) as writer:
+                with writer:
+                    writer.execute(
+                        "UPDATE TMTask SET title = 'Zebra' WHERE uuid = ?", (uuid,)
+                    )
+            self.assertEqual("Zebra", completion.load(path)["projects"][uuid])
+            self.assertEqual(completion.index_key(path), completion.load(path)["key"])
+
+            output = os.path.join(os.path.dirname(path), "completions")
+            line = f"things-cli -d {path} search zeb"
+            environment = {
+                **os.environ,
+                "_ARGCOMPLETE": "1",
+                "COMP_LINE": line,
+                "COMP_POINT": str(len(line)),
+                "_ARGCOMPLETE_STDOUT_FILENAME": output,
+            }
+            subprocess.run(
+                [sys.executable, "-m", "things_cli.cli"], env=environment, check=True
+            )
+            with open(output, encoding="utf-8") as file:
+                self.assertEqual(["zebra"], file.read().split())
+
+    def test_connection(self):
+        """Test that queries share read-only connections next to a writer."""
+        import things as api  # pylint: disable=import-outside-toplevel
+
+        with generated_database(todos=50) as path:
+            expected = api.todos(filepath=path)
+            with closing(sqlite3.connect(path, isolation_level=None)) as writer:
+                writer.execute("PRAGMA journal_mode = WAL")
+                writer.execute("CREATE TABLE app (value)")
+                writer.execute("BEGIN IMMEDIATE")
+                writer.execute("INSERT INTO app VALUES (2)")
+
+                pool = connection.Pool(mmap_size=1, cache_size=1)
+                database = connection.ReadOnlyDatabase(path, pool)
+                self.assertEqual(expected, api.todos(database=database))
+                self.assertEqual(1, len(pool.idle[path]))
+                with pool.connection(path) as reader:
+                    self.assertEqual(
+                        1, reader.execute("PRAGMA query_only").fetchone()[0]
+                    )
+                    with self.assertRaises(sqlite3.OperationalError):
+                        reader.execute("DELETE FROM app")
+                pool.close()
+                # The readers did not keep the writer from committing
+                writer.execute("COMMIT")
+
+    def test_snapshot(self):
+        """Test writing a snapshot and reading lists from it."""
+        with generated_database(todos=200, checklist_items=50) as database:
+            path = os.path.join(os.path.dirname(database), "snapshot.sqlite")
+            self.assertIn(path, run("snapshot", path, database=database).stdout)
+            self.assertFalse(os.path.exists(path + "-wal"))
+            self.assertEqual(
+                json.loads(run("-j", "today", database=database).stdout),
+                snapshot.read_list(path, "today"),
+            )
+            self.assertIsNone(snapshot.read_list(database, "today"))
+            for arguments in [["-j", "all"], ["-r", "projects"], ["-c", "logbook"]]:
+                self.assertEqual(
+                    run(*arguments, database=database).stdout,
+                    run(*arguments, database=path).stdout,
+                )
+            # Live databases are recognized once per run, not per list
+            for filepath, expected in [(database, False), (path, True)]:
+                things_cli = cli.ThingsCLI(database=filepath, output=io.StringIO())
+                things_cli.main(
+                    things_cli.get_parser().parse_args(["--no-cache", "all"])
+                )
+                self.assertIs(expected, things_cli.current_snapshot)
+            with closing(sqlite3.connect(path)) as reader:
+                (tags,) = reader.execute(
+                    "SELECT tag_titles FROM snapshot_tasks WHERE tags"
+                ).fetchone()
+            self.assertTrue(json.loads(tags))
+
+            broken = os.path.join(os.path.dirname(database), "broken.sqlite")
+            with open(broken, "w", encoding="utf-8") as file:
+                file.write("not a database")
+            with self.assertRaises(sqlite3.DatabaseError):
+                snapshot.write(broken, path)
+            self.assertFalse(os.path.exists(f"{path}.partial"))
+
+    def test_stats(self):
+        """Test the statistics commands and their date range."""
+        counts = {
+            row["statistic"]: row["count"]
+            for row in json.loads(run("-j", "stat").stdout)
+        }
+        self.assertEqual(35, counts["created"])
+        self.assertEqual(11, counts["completed"])
+        self.assertEqual(
+            [{"date": "2021-03-28", "count": 31}],
+            json.loads(
+                run(
+                    "-j",
+                    "mostCreated",
+                    "--since",
+                    "2021-01-01",
+                    "--until",
+                    "2021-03-28",
+                ).stdout
+            ),
+        )
+        self.assertEqual(
+            "date;created;completed;canceled;trashed\r\n" "2021-03-28;31;11;11;3\r\n\n",
+            run("statcsv", "--since", "2021-03-28", "--until", "2021-03-28").stdout,
+        )
+        projects = json.loads(
+            run("-j", "--limit", "1", "--sort=-total", "mostTasks").stdout
+        )
+        self.assertEqual(["Project in Area 1"], [row["title"] for row in projects])
+        self.assertEqual("title\n", run("--fields", "title", "empty").stdout)
+        self.assertEqual(
+            '"title" IS NULL, "title" DESC', stats.order("-title", ["title"])
+        )
+        self.assertIsNone(stats.order("nope", ["title"]))
+        for option in ["-p", "-a", "-t"]:
+            result = run(option, "x", "stat")
+            self.assertEqual(2, result.returncode)
+            self.assertIn("do not apply to statistics", result.stderr)
+
+    def test_export(self):
+        """Test exporting changes since a checkpoint, with tombstones."""
+
+        def export_records(database, checkpoint):
+            output = run("export", checkpoint, database=database).stdout
+            return [json.loads(line) for line in output.splitlines()]
+
+        with generated_database(todos=50) as database:
+            checkpoint = os.path.join(os.path.dirname(database), "export.checkpoint")
+            records = export_records(database, checkpoint)
+            self.assertIn("area", {record["type"] for record in records})
+            self.assertEqual([], export_records(database, checkpoint))
+
+            with closing(sqlite3.connect(database)) as writer:
+                with writer:
+                    todo, project = writer.execute(
+                        "SELECT uuid, project FROM TMTask WHERE type = 0 "
+                        "AND project IS NOT NULL AND heading IS NULL LIMIT 1"
+                    ).fetchone()
+                    writer.execute("DELETE FROM TMTask WHERE uuid = ?", (todo,))
+                    writer.execute(
+                        "UPDATE TMTask SET title = 'Renamed' WHERE uuid = ?",
+                        (project,),
+                    )
+            # Changes are exported again until the checkpoint is committed
+            uncommitted = export.Checkpoint(checkpoint, database)
+            self.assertTrue(uncommitted.changes())
+            with self.assertRaises(sqlite3.OperationalError):
+                uncommitted.connection.execute("DELETE FROM things.TMTask")
+            uncommitted.close()
+            # Tombstones are rows of CSV, OPML and GANTT cannot show them
+            copied = f"{checkpoint}.copy"
+            shutil.copyfile(checkpoint, copied)
+            output = run("-c", "export", copied, database=database).stdout
+            rows = csv.DictReader(io.StringIO(output), delimiter=";")
+            self.assertIn(
+                {"uuid": todo, "type": "to-do", "deleted": "True"},
+                [{key: value for key, value in row.items() if value} for row in rows],
+            )
+            for option in ["-o", "-g"]:
+                result = run(option, "export", checkpoint, database=database)
+                self.assertEqual(2, result.returncode)
+                self.assertIn("cannot show deleted tasks", result.stderr)
+            records = export_records(database, checkpoint)
+            self.assertIn({"uuid": todo, "type": "to-do", "deleted": True}, records)
+            self.assertEqual(
+                {"Renamed"},
+                {record.get("project_title", record.get("title")) for record in records}
+                - {None},
+            )
+            self.assertEqual([], export_records(database, checkpoint))
+
+    def test_fanout(self):
+        """Test running a command on several databases with an error."""
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["a", "b"]:
+                path = os.path.join(directory, f"{name}.sqlite")
+                generate_database.generate(path, todos=20, projects=2)
+            broken = os.path.join(directory, "c.sqlite")
+            with open(broken, "w", encoding="utf-8") as file:
+                file.write("not a database")
+            pattern = os.path.join(directory, "*.sqlite")
+            self.assertEqual(
+                [os.path.join(directory, f"{name}.sqlite") for name in "abc"],
+                fanout.expand([pattern, broken]),
+            )
+
+            result = run("-d", pattern, "--workers", "2", "-j", "todos", database=None)
+            sections = json.loads(result.stdout)
+            self.assertEqual(1, result.returncode)
+            self.assertIn("c.sqlite", result.stderr)
+            self.assertEqual(fanout.expand([pattern]), [s["title"] for s in sections])
+            single = run("-j", "todos", database=sections[0]["title"])
+            self.assertEqual(json.loads(single.stdout), sections[0]["items"])
+            self.assertIn("error", sections[2])
+
+            result = run(
+                "-d", sections[0]["title"], "-d", sections[1]["title"], "-j", "stat"
+            )
+            self.assertEqual(0, result.returncode)
+            self.assertEqual(18, len(json.loads(result.stdout)))
+            self.assertEqual(2, run("-d", pattern, "snapshot", "x").returncode)
+
+            # Errors go to the error stream of the app, CSV has a database column
+            output, errors = io.StringIO(), io.StringIO()
+            things_cli = cli.ThingsCLI(output=output, errors=errors)
+            args = things_cli.get_parser().parse_args(
+                ["-d", pattern, "--workers", "1", "-c", "todos"]
+            )
+            with redirect_stderr(io.StringIO()) as stderr:
+                with self.assertRaises(SystemExit):
+                    things_cli.main(args)
+            self.assertEqual("", stderr.getvalue())
+            self.assertIn("c.sqlite", errors.getvalue())
+            rows = list(csv.reader(io.StringIO(output.getvalue()), delimiter=";"))
+            self.assertEqual(["database", "uuid"], rows[0][:2])
+            self.assertEqual(
+                set(fanout.expand([pattern])[:2]), {row[0] for row in rows[1:] if row}
+            )
+
+    def test_tree(self):
+        """Test loading items level by level like things.py does."""
+        import things as api  # pylint: disable=import-outside-toplevel
+
+        with generated_database(todos=300, checklist_items=100) as database:
+            things_cli = cli.ThingsCLI(database=database)
+            for name in ["today", "anytime", "projects", "areas", "tags", "logbook"]:
+                defaults = {"filepath": database, "include_items": True}
+                counted = things_cli.timings = timings.Timings()
+                result = tree.load(things_cli, name, defaults)
+                self.assertEqual(getattr(api, name)(**defaults), result)
+                self.assertLess(0, counted.queries)
+                self.assertLess(counted.queries, 20)
+            things_cli.timings = None
+
+            things_cli.only_projects = True
+            for name in ["areas", "projects", "tags"]:
+                expected = getattr(api, name)(**defaults)
+                cli.ThingsCLI.prune_projects(expected)
+                result = tree.load(things_cli, name, defaults)
+                cli.ThingsCLI.prune_projects(result)
+                self.assertEqual(expected, result)
+
+    def test_createdtoday(self):
+        """Test that the tasks created today are shown without filters."""
+        with generated_database(todos=50) as path:
+            with closing(sqlite3.connect(path)) as writer:
+                with writer:
+                    writer.execute("UPDATE TMTask SET creationDate = ?", (time.time(),))
+                    (project,) = writer.execute(
+                        "SELECT uuid FROM TMTask WHERE type = 1"
+                    ).fetchone()
+            expected = run("-j", "createdtoday", database=path).stdout
+            self.assertTrue(json.loads(expected))
+            for option, value in [("-p", project), ("-a", "nope"), ("-t", "nope")]:
+                result = run(option, value, "-j", "createdtoday", database=path)
+                self.assertEqual(expected, result.stdout)
+
+    def test_only_projects(self):
+        """Test that only areas and projects are shown below the top level."""
+        output = io.StringIO()
+        things_cli = cli.ThingsCLI(database="tests/main.sqlite", output=output)
+        args = things_cli.get_parser().parse_args(
+            ["--no-cache", "-e", "-r", "-j", "all"]
+        )
+        things_cli.main(args)
+
+        def types(tasks):
+            for task in tasks:
+                yield task.get("type")
+                yield from types(task.get("items", []))
+
+        sections = json.loads(output.getvalue())
+        self.assertEqual({"area", "project"}, set(types(sections)) - {None})
+
+    def test_stream(self):
+        """Test streaming lists in chunks like things.py returns them."""
+        import things as api  # pylint: disable=import-outside-toplevel
+
+        with generated_database(todos=300, seed=3) as database:
+            for name in stream.STREAMS:
+                expected = getattr(api, name)(filepath=database)
+                pages = [
+                    ([], slice(None)),
+                    (["--offset", "5", "--limit", "4"], slice(5, 9)),
+                ]
+                for options, page in pages:
+                    output = io.StringIO()
+                    things_cli = cli.ThingsCLI(database=database, output=output)
+                    args = things_cli.get_parser().parse_args(
+                        ["--no-cache", "-j", "--chunk-size", "7", *options, name]
+                    )
+                    things_cli.main(args)
+                    self.assertTrue(stream.streamed(things_cli, name))
+                    self.assertEqual(expected[page], json.loads(output.getvalue()))
+
+            result = run(
+                "--chunk-size", "2", "--max-memory", "1", "logbook", database=database
+            )
+            self.assertEqual(1, result.returncode)
+            self.assertIn("--max-memory: exceeded 1 MB", result.stderr)
+
+            # Where the current resident memory is unknown the ceiling is rejected
+            errors = io.StringIO()
+            things_cli = cli.ThingsCLI(database=database, errors=errors)
+            args = things_cli.get_parser().parse_args(
+                ["--no-cache", "--max-memory", "64", "logbook"]
+            )
+            with mock.patch.object(stream, "rss", return_value=None):
+                with self.assertRaises(SystemExit):
+                    things_cli.main(args)
+            self.assertIn("resident memory of this system is unknown", errors.getvalue())
+
+    def test_search_limit(self):
+        """Test limiting the results of both search implementations."""
+        args = self.things3_cli.get_parser().parse_args(
+            ["--no-cache", "search", "To-Do", "--limit", "2"]
+        )
+        self._test_main(args, "To-Do")
+        with generated_database(todos=50) as path:
+            for command in [[], ["index"]]:
+                if command:
+                    run(*command, database=path)
+                output = run("search", "To-Do", "--limit", "3", database=path).stdout
+                self.assertEqual(3, len(output.splitlines()))
+
+    def test_model(self):
+        """Test converting tasks to records and rendering them repeatedly."""
+        import things  # pylint: disable=import-outside-toplevel
+
+        tasks = things.projects(filepath="tests/main.sqlite", include_items=True)
+        expected = json.dumps(tasks)
+        records = model.from_dicts(json.loads(expected))
+        self.assertIsInstance(records[0], model.Task)
+        self.assertFalse(hasattr(records[0], "__dict__"))
+        self.assertEqual(expected, json.dumps(records, default=model.to_json))
+        self.assertEqual(tasks, [model.to_dict(record) for record in records])
+        self.assertEqual(list(tasks[0]), list(records[0]))
+        self.assertNotIn("trashed", records[0])
+        self.assertIsNone(records[0].get("trashed"))
+        with self.assertRaises(KeyError):
+            records[0]["trashed"]  # pylint: disable=pointless-statement
+        copy = records[0].copy()
+        self.assertEqual(records[0]["uuid"], copy.pop("uuid"))
+        self.assertNotIn("uuid", copy)
+        self.assertIn("uuid", records[0])
+        self.assertIsNone(copy.pop("uuid", None))
+        things_cli = cli.ThingsCLI()
+        for render in [things_cli.txt_dumps, things_cli.opml_dumps]:
+            self.assertEqual(render(tasks), render(records))
+            self.assertEqual(render(records), render(records))
+
+    def test_pagination(self):
+        """Test sorting, paging and projecting tasks."""
+
+        def tasks_of(*arguments):
+            return json.loads(run("-j", *arguments).stdout)
+
+        tasks = tasks_of("-r", "todos")
+        self.assertEqual(
+            tasks[1:3], tasks_of("-r", "--limit", "2", "--offset", "1", "todos")
+        )
+        self.assertEqual(tasks[2:], tasks_of("-r", "--offset", "2", "todos"))
+        titles = sorted(task["title"] for task in tasks)
+        self.assertEqual(
+            titles[::-1][:3],
+            [
+                task["title"]
+                for task in tasks_of("--sort=-title", "--limit", "3", "todos")
+            ],
+        )
+        self.assertEqual(
+            titles, [task["title"] for task in tasks_of("--sort", "title", "todos")]
+        )
+        projects = tasks_of("-r", "--fields", "title,items", "projects")
+        self.assertEqual(["title", "items"], list(projects[0]))
+        self.assertEqual(["title"], list(projects[0]["items"][0]))
+        self.assertEqual(
+            [{"title": project["title"]} for project in projects],
+            tasks_of("-r", "--fields", "title", "projects"),
+        )
+        sections = tasks_of("-r", "--limit", "1", "all")
+        self.assertTrue(all(len(section["items"]) <= 1 for section in sections))
+
+    def test_timings(self):
+        """Test the timings report and the profile of a run."""
+        output = io.StringIO()
+        errors = io.StringIO()
+        things_cli = cli.ThingsCLI(database="tests/main.sqlite", output=output)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.prof")
+            args = things_cli.get_parser().parse_args(
+                ["--no-cache", "--timings", "--profile", path, "-r", "today"]
+            )
+            with redirect_stderr(errors):
+                things_cli.main(args)
+            self.assertTrue(os.path.getsize(path))
+        report = json.loads(errors.getvalue())
+        self.assertEqual("today", report["command"])
+        self.assertGreater(report["queries"], 0)
+        self.assertEqual(3, report["tasks"])
+        self.assertIn("query", report["phases"])
+        self.assertIn("render", report["phases"])
+        self.assertAlmostEqual(report["seconds"], sum(report["phases"].values()), 3)
+        self.assertIsNone(things_cli.timings)
+        self.assertFalse(isinstance(things_cli.output, timings.TimedStream))
+
+        # Concurrent requests of a server count their own queries
+        things_server = server.ThingsServer("tests/main.sqlite")
+        argv = ["--no-cache", "--timings", "-r", "today"]
+        expected = json.loads(things_server.run(argv, io.StringIO())[1])["queries"]
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(things_server.run(argv, io.StringIO()))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts = {json.loads(errors)["queries"] for _status, errors in results}
+        self.assertEqual({expected}, counts)
+        self.assertEqual(
+            timings.count_tasks([{"title": "Section", "items": [{"type": "to-do"}]}]),
+            1,
+        )
+
+    def test_txt_stream(self):
+        """Test streaming text output into a file object."""
+        tasks = [
+            {
+                "title": "Project",
+                "start": "Anytime",
+                "items": [{"title": "To-Do", "project_title": "Project"}],
+            }
+        ]
+        output = io.StringIO()
+        things3_cli = cli.ThingsCLI(output=output)
+        things3_cli.print_tasks(tasks)
+        expected = "- Project (Anytime)\n  - To-Do (Project)\n"
+        self.assertEqual(expected, output.getvalue())
+        self.assertEqual(expected, things3_cli.txt_dumps(tasks))
+        self.assertIn("items", tasks[0])
+
+    def test_opml_escape(self):
+        """Test OPML output of special characters and empty results."""
+        things3_cli = cli.ThingsCLI()
+        opml = things3_cli.opml_dumps([{"title": 'A & <B> "C"', "items": []}])
+        self.assertIn('<outline text="A &amp; &lt;B&gt; &quot;C&quot;"/>', opml)
+        self.assertIn("<body/>", things3_cli.opml_dumps([]))
+
+    def test_gantt(self):
+        """Test GANTT sections and duplicate handling."""
+        task = {"title": "Plan: A", "start": "Anytime", "start_date": "2021-03-28"}
+        tasks = [
+            task,
+            dict(task, title="PLAN: A", deadline="2021-04-01"),
+            dict(task, title="Plan: B", deadline="2021-04-01"),
+            dict(task, title="Done", stop_date="2021-03-29"),
+        ]
+        self.assertEqual(
+            "  section Anytime\n"
+            "    Plan  A :milestone, 2021-03-28, 1h\n"
+            "    Plan  B :active, 2021-03-28, 2021-04-01\n",
+            cli.ThingsCLI().gantt_dumps(tasks),
+        )
+
     def test_csv(self):
         """Test Next via CSV."""
         args = self.things3_cli.get_parser().parse_args(
@@ -93,6 +894,17 @@ class ThingsCLICase(unittest.TestCase):
             sys.stdout = old_out
         self.assertIn("E18tg5qepzrQk9J6jQtb5C", new_out.getvalue())
 
+    def test_csv_fields(self):
+        """Test CSV with explicit columns and without mutating the tasks."""
+        tasks = [{"uuid": "A", "title": "Project", "items": [{"uuid": "B"}]}]
+        things3_cli = cli.ThingsCLI()
+        things3_cli.fields = ["uuid", "title"]
+        self.assertEqual(
+            "uuid;title\r\nB;\r\nA;Project\r\n", things3_cli.csv_dumps(tasks)
+        )
+        self.assertEqual(things3_cli.csv_dumps(tasks), things3_cli.csv_dumps(tasks))
+        self.assertIn("items", tasks[0])
+
     def test_json(self):
         """Test Upcoming via JSON."""
         args = self.things3_cli.get_parser().parse_args(
@@ -107,6 +919,47 @@ class ThingsCLICase(unittest.TestCase):
             sys.stdout = old_out
         self.assertIn("7F4vqUNiTvGKaCUfv5pqYG", new_out.getvalue())
 
+    def test_jsonl(self):
+        """Test flattened JSON Lines output."""
+        args = self.things3_cli.get_parser().parse_args(
+            ["-d", "tests/main.sqlite", "-r", "--jsonl", "--flatten", "projects"]
+        )
+        new_out = io.StringIO()
+        old_out = sys.stdout
+        try:
+            sys.stdout = new_out
+            self.things3_cli.main(args)
+        finally:
+            sys.stdout = old_out
+        records = [json.loads(line) for line in new_out.getvalue().splitlines()]
+        self.assertEqual(0, records[0]["depth"])
+        self.assertIsNone(records[0]["parent_uuid"])
+        self.assertEqual(records[0]["uuid"], records[1]["parent_uuid"])
+        self.assertNotIn("items", records[0])
+
+        output = io.StringIO()
+        things_cli = cli.ThingsCLI(database="tests/main.sqlite", output=output)
+        things_cli.main(
+            things_cli.get_parser().parse_args(
+                ["--no-cache", "-r", "--jsonl", "--flatten", "all"]
+            )
+        )
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual("section:Inbox", records[0]["uuid"])
+        uuids = {record["uuid"] for record in records}
+        for record in records:
+            if record["depth"]:
+                self.assertIn(record["parent_uuid"], uuids)
+
+    def test_generated_database(self):
+        """Test commands against a generated database."""
+        with generated_database(
+            areas=3, projects=5, headings=5, todos=50, tags=4
+        ) as path:
+            output = run("areas", database=path).stdout
+            self.assertEqual(3, len(output.splitlines()))
+            self.assertTrue(json.loads(run("-j", "-r", "all", database=path).stdout))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+"""Run many things-cli command lines in a single process."""
+
+# Every non-empty line of the input that does not start with `#` is a command
+# line such as `-j today` or `search "some text"`. The commands share the parser
+# and the Things database objects; each result is written as one JSON object
+# `{"line", "argv", "exit", "stdout", "stderr"}` in the order of the input.
+# `stderr` holds everything the command reported, including errors found after
+# parsing and its `--timings` report.
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import io
+import json
+import shlex
+import sys
+
+from things_cli.server import REJECTED_COMMANDS, ThingsServer
+
+
+class BatchRunner(ThingsServer):
+    """Run command lines against shared database objects."""
+
+    mode = "batch mode"
+    # Files are written where the user running the batch asks for
+    rejected_commands = REJECTED_COMMANDS
+    rejected_options = {}
+
+    def __init__(self, database=None, use_cache=True):
+        """Set up the parser and the default database."""
+        super().__init__(database)
+        self.use_cache = use_cache
+
+    def run_line(self, number, line):
+        """Run one command line and return its result record."""
+        try:
+            argv = shlex.split(line)
+        except ValueError as error:
+            return {
+                "line": number,
+                "argv": None,
+                "exit": 2,
+                "stdout": "",
+                "stderr": f"{error}\n",
+            }
+        if argv and argv[0] == "things-cli":
+            argv = argv[1:]
+        options = [] if self.use_cache else ["--no-cache"]
+        output = io.StringIO()
+        status, errors = self.run(options + argv, output)
+        return {
+            "line": number,
+            "argv": argv,
+            "exit": status,
+            "stdout": output.getvalue(),
+            "stderr": errors,
+        }
+
+
+def read_command_lines(file):
+    """Yield line numbers and command lines, skipping blanks and comments."""
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield number, line
+
+
+def batch(things_cli, args):
+    """Run the command lines of a file or stdin for the `batch` command."""
+    # Exit with status 1 if any of the commands failed.
+    # Hold on to the real stdout: parsing redirects sys.stdout meanwhile.
+    stream = things_cli.stream
+    runner = BatchRunner(things_cli.database, things_cli.use_cache)
+    failed = False
+    if args.file == "-":
+        context = nullcontext(sys.stdin)
+    else:
+        context = open(args.file, encoding="utf-8")
+    with context as file:
+        lines = read_command_lines(file)
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            for record in executor.map(lambda entry: runner.run_line(*entry), lines):
+                failed = failed or record["exit"] != 0
+                stream.write(json.dumps(record) + "\n")
+                stream.flush()
+    if failed:
+        sys.exit(1)
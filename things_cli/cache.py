@@ -0,0 +1,240 @@
+"""Persistent cache of rendered command output."""
+
+import json
+import os
+import time
+
+
+ENVIRONMENT_VARIABLE_WITH_CACHE = "THINGS_CLI_CACHE"
+ENVIRONMENT_VARIABLE_WITH_CACHE_SIZE = "THINGS_CLI_CACHE_SIZE"
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+# Commands that do not print tasks or a table of their database
+SERVICE_COMMANDS = [
+    "feedback",
+    "cachestats",
+    "serve",
+    "batch",
+    "watch",
+    "index",
+    "snapshot",
+    "export",
+]
+
+# Commands whose output depends on more than the database content
+UNCACHEABLE_COMMANDS = ["createdtoday", *SERVICE_COMMANDS]
+
+# Arguments that do not change the output of a command
+IGNORED_ARGUMENTS = [
+    "database",
+    "databases",
+    "no_cache",
+    "workers",
+    "chunk_size",
+    "max_memory",
+    "mmap_size",
+    "page_cache",
+    "timings",
+    "profile",
+]
+
+
+def default_path():
+    """Return the path of the cache database."""
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.getenv(ENVIRONMENT_VARIABLE_WITH_CACHE) or os.path.join(
+        cache_home, "things-cli", "cache.sqlite"
+    )
+
+
+def database_path(filepath=None):
+    """Return the path of the Things database the API would read."""
+    if filepath:
+        return os.path.abspath(filepath)
+    return default_database_path()
+
+
+def default_database_path():
+    """Return the path of the Things database the API reads without `-d`."""
+    import things.database  # pylint: disable=import-outside-toplevel
+
+    return (
+        os.getenv(things.database.ENVIRONMENT_VARIABLE_WITH_FILEPATH)
+        or things.database.DEFAULT_FILEPATH
+    )
+
+
+def fingerprint(filepath=None):
+    """Identify the state of a Things database by size and mtime of its files."""
+    # Every write of the Things app touches the write-ahead log, so the
+    # fingerprint changes whenever the content might have changed. Return None
+    # if the database does not exist.
+    path = database_path(filepath)
+    parts = []
+    for suffix in ["", "-wal"]:
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            if not suffix:
+                return None
+            parts.append("-")
+            continue
+        parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return f"{path}|{'|'.join(parts)}"
+
+
+def make_key(filepath, arguments):
+    """Make a cache key from the database path and the parsed arguments."""
+    # The current date is part of the key as lists such as Today or Upcoming are
+    # relative to it.
+    from datetime import datetime  # pylint: disable=import-outside-toplevel
+
+    options = {
+        key: value for key, value in arguments.items() if key not in IGNORED_ARGUMENTS
+    }
+    options["database"] = database_path(filepath)
+    options["date"] = datetime.now().strftime("%Y-%m-%d")
+    return json.dumps(options, sort_keys=True)
+
+
+class Cache:
+    """Cache rendered output in a small SQLite database."""
+
+    # Entries are only valid for the database fingerprint they were created
+    # with. The least recently used entries are evicted once the total size of
+    # all entries exceeds `max_size` bytes.
+
+    def __init__(self, path=None, max_size=None):
+        """Open (and create) the cache database."""
+        # Imported here, completion reads the fingerprints of this module only
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self.path = path or default_path()
+        self.max_size = max_size or int(
+            os.getenv(ENVIRONMENT_VARIABLE_WITH_CACHE_SIZE) or DEFAULT_MAX_SIZE
+        )
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=1)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT,
+                    output TEXT,
+                    size INTEGER,
+                    used REAL
+                )
+                """)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+
+    def close(self):
+        """Close the cache database."""
+        self.connection.close()
+
+    def get(self, key, state):
+        """Return the cached output for `key` if it is valid for `state`."""
+        row = self.connection.execute(
+            "SELECT fingerprint, output FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        hit = row is not None and row[0] == state
+        with self.connection:
+            self.count("hits" if hit else "misses")
+            if hit:
+                self.connection.execute(
+                    "UPDATE entries SET used = ? WHERE key = ?", (time.time(), key)
+                )
+        return row[1] if hit else None
+
+    def put(self, key, state, output):
+        """Store the output of a command and evict old entries."""
+        size = len(output.encode())
+        if size > self.max_size:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, state, output, size, time.time()),
+            )
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the size limit is met."""
+        total = self.connection.execute(
+            "SELECT IFNULL(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        rows = self.connection.execute(
+            "SELECT key, size FROM entries ORDER BY used"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.count("evictions")
+            total -= size
+
+    def count(self, name):
+        """Increase a statistics counter."""
+        self.connection.execute(
+            """
+            INSERT INTO stats VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+            """,
+            (name,),
+        )
+
+    def stats(self):
+        """Return statistics about the cache."""
+        entries, size = self.connection.execute(
+            "SELECT COUNT(*), IFNULL(SUM(size), 0) FROM entries"
+        ).fetchone()
+        result = {
+            "path": self.path,
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+        result.update(self.connection.execute("SELECT name, value FROM stats"))
+        return result
+
+
+class Tee:
+    """Write to a stream while recording the output up to a size limit."""
+
+    def __init__(self, stream, limit):
+        """Wrap `stream`."""
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+        self.parts = []
+        self.complete = True
+
+    def write(self, data):
+        """Write data to the stream and record it."""
+        if self.complete:
+            self.size += len(data)
+            if self.size > self.limit:
+                self.complete = False
+                self.parts = []
+            else:
+                self.parts.append(data)
+        return self.stream.write(data)
+
+    def writelines(self, lines):
+        """Write lines to the stream and record them."""
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+    def getvalue(self):
+        """Return the recorded output."""
+        return "".join(self.parts)
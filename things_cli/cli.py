@@ -4,28 +4,98 @@
 
 from __future__ import print_function
 
-import argparse
-import csv
-from datetime import datetime
-from io import StringIO
-import json
+from itertools import chain
+import os
 import sys
-from typing import Dict
-import webbrowser
-from xml.dom import minidom
-import xml.etree.ElementTree as ETree
-from xml.etree.ElementTree import Element, SubElement
-
-import argcomplete  # type: ignore
-import things as api
-
-from things_cli import __version__
-
-
-class ThingsCLI:  # pylint: disable=too-many-instance-attributes
+import time
+
+from things_cli.model import Area, Tag, Task
+from things_cli.parser import CHUNK_SIZE, STATISTICS_COMMANDS, make_parser
+
+
+# Only lightweight modules are imported at load time. Dependencies of
+# single commands and output formats (things, argcomplete, csv, json, ...)
+# are imported where they are needed to keep the start-up time low.
+# pylint: disable=import-outside-toplevel
+
+# Columns of the CSV output per task type: the fields without nested lists,
+# and those of the tombstones of deleted tasks (see things_cli/export.py)
+CSV_FIELDS = {
+    **{
+        task_type: [
+            field for field in record.fields if field not in ["checklist", "items"]
+        ]
+        for task_type, record in [("to-do", Task), ("area", Area), ("tag", Tag)]
+    },
+    "tombstone": ["uuid", "type", "deleted"],
+}
+CSV_COMMAND_TYPES = {
+    "areas": ["area"],
+    "tags": ["tag"],
+    "export": ["to-do", "area", "tombstone"],
+}
+
+# Sections of the "all" command and the API functions to fetch them
+ALL_SECTIONS = [
+    ("Inbox", "inbox"),
+    ("Today", "today"),
+    ("Upcoming", "upcoming"),
+    ("Anytime", "anytime"),
+    ("Someday", "someday"),
+    ("Logbook", "logbook"),
+    ("No Area", "projects"),
+    ("Areas", "areas"),
+]
+
+# Filters that do not apply to the lists of a command
+IGNORED_FILTERS = {
+    "tags": ["tag", "project"],
+    "all": ["area", "project"],
+    "areas": ["area", "project"],
+}
+
+# Methods handling the commands that are not a list of things.py
+COMMAND_METHODS = {
+    "all": "print_all",
+    "logtoday": "print_logtoday",
+    "createdtoday": "print_createdtoday",
+    "upcoming": "print_upcoming",
+    "search": "print_search",
+    "cachestats": "print_cachestats",
+    "feedback": "open_feedback",
+}
+
+# Modules and their functions `(things_cli, args)` handling the other commands
+COMMAND_MODULES = {
+    "index": ("search", "build"),
+    "serve": ("server", "serve"),
+    "batch": ("batch", "batch"),
+    "watch": ("watch", "watch"),
+    "snapshot": ("snapshot", "snapshot"),
+    "export": ("export", "export"),
+    **{name: ("stats", "stats") for name, _description in STATISTICS_COMMANDS},
+}
+
+# Attributes of the output formats, text is shown if none is set
+OUTPUT_FORMATS = ["print_json", "print_jsonl", "print_csv", "print_opml", "print_gantt"]
+
+OPML_INDENT = "   "
+OPML_ENTITIES = [
+    ("&", "&amp;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ('"', "&quot;"),
+    ("\n", "&#10;"),
+    ("\r", "&#13;"),
+    ("\t", "&#9;"),
+]
+
+
+class ThingsCLI:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """A simple Python 3 CLI to read your Things app data."""
 
     print_json = False
+    print_jsonl = False
     print_csv = False
     print_gantt = False
     print_opml = False
@@ -36,73 +106,315 @@ class ThingsCLI:  # pylint: disable=too-many-instance-attributes
     filter_area = None
     filter_tag = None
     only_projects = None
-
-    def __init__(self, database=None):
+    flatten = False
+    fields = None
+    limit = None
+    offset = None
+    sort = None
+    include_items = False
+    deferred_items = False
+    command = None
+    workers = None
+    chunk_size = CHUNK_SIZE
+    max_memory = None
+    mmap_size = None
+    page_cache = None
+    use_cache = True
+    things_database = None
+    current_snapshot = None
+    timings = None
+
+    def __init__(self, database=None, output=None, errors=None):
         """Initialize class."""
         self.database = database
-
-    def print_tasks(self, tasks):
+        self.output = output
+        self.errors = errors
+
+    @property
+    def stream(self):
+        """File object the output is written to (defaults to stdout)."""
+        return self.output or sys.stdout
+
+    @property
+    def error_stream(self):
+        """File object errors and reports are written to (defaults to stderr)."""
+        return self.errors or sys.stderr
+
+    def error(self, message):
+        """Report a usage error like argparse, but on the error stream, and exit."""
+        parser = self.get_parser()
+        parser.print_usage(self.error_stream)
+        self.error_stream.write(f"{parser.prog}: error: {message}\n")
+        sys.exit(2)
+
+    def selected_format(self):
+        """Return the attribute of the selected output format, None for text."""
+        return next((name for name in OUTPUT_FORMATS if getattr(self, name)), None)
+
+    def mark(self, phase, tasks=None):
+        """End a phase of the run if it is timed (see `--timings`)."""
+        # `tasks` are counted as the tasks shown.
+        if self.timings:
+            if tasks is not None:
+                from things_cli.timings import count_tasks
+
+                self.timings.tasks = count_tasks(tasks)
+            self.timings.mark(phase)
+
+    def print_tasks(self, tasks, default_sort=None):
         """Print a task."""
 
+        self.mark("query")
+        tasks = self.select(tasks, self.sort or default_sort)
+        self.mark("select")
+
+        if self.recursive:
+            from things_cli.model import from_dicts
+
+            tasks = from_dicts(tasks)
+
         if self.only_projects:
-            for task in tasks:
-                task["items"] = (
-                    [
-                        items
-                        for items in task["items"]
-                        if items["type"] in ["area", "project"]
-                    ]
-                    if task.get("items")
-                    else []
-                )
-                for items in task["items"]:
-                    items["items"] = (
-                        [
-                            sub_items
-                            for sub_items in items["items"]
-                            if sub_items["type"] in ["area", "project"]
-                        ]
-                        if items.get("items")
-                        else []
-                    )
+            self.prune_projects(tasks)
+        self.mark("prune", tasks)
 
         if self.print_json:
-            print(json.dumps(tasks))
+            import json
+
+            from things_cli.model import to_json
+
+            if self.fields:
+                tasks = self.project(tasks)
+            if isinstance(tasks, list):
+                print(json.dumps(tasks, default=to_json), file=self.stream)
+            else:
+                self.stream.writelines(self.json_array(tasks))
+        elif self.print_jsonl:
+            self.stream.writelines(self.jsonl_lines(tasks))
         elif self.print_opml:
-            print(self.opml_dumps(tasks))
+            self.stream.writelines(self.opml_lines(tasks))
+            self.stream.write("\n")
         elif self.print_csv:
-            print(self.csv_dumps(tasks))
+            self.csv_write(tasks, self.stream)
+            self.stream.write("\n")
         elif self.print_gantt:
-            print("gantt")
-            print("  dateFormat  YYYY-MM-DD")
-            print("  title       Things To-Dos")
-            print("  excludes    weekends")
-            print(self.gantt_dumps(tasks))
+            print("gantt", file=self.stream)
+            print("  dateFormat  YYYY-MM-DD", file=self.stream)
+            print("  title       Things To-Dos", file=self.stream)
+            print("  excludes    weekends", file=self.stream)
+            self.stream.writelines(self.gantt_lines(tasks))
+            self.stream.write("\n")
         else:
-            print(self.txt_dumps(tasks), end="")
+            self.stream.writelines(self.txt_lines(tasks))
+        self.mark("render")
 
-    def gantt_dumps(self, tasks, array=None):
-        """Convert tasks into mermaid-js GANTT."""
+    @classmethod
+    def prune_projects(cls, tasks):
+        """Keep only areas and projects in the items of tasks, at any depth."""
+        # With items, the fetch already left out everything else below the top
+        # level; this drops the tasks of the sections of `all`.
+        for task in tasks:
+            task["items"] = [
+                item
+                for item in task.get("items") or []
+                if item["type"] in ["area", "project"]
+            ]
+            cls.prune_projects(task["items"])
+
+    def print_table(self, columns, rows):
+        """Print rows of statistics as a table in the selected output format."""
+
+        self.mark("query")
+        if self.fields:
+            columns = [column for column in self.fields if column in columns]
+        rows = [{column: row[column] for column in columns} for row in rows]
+
+        if self.print_json:
+            import json
+
+            print(json.dumps(rows), file=self.stream)
+        elif self.print_jsonl:
+            import json
+
+            self.stream.writelines(json.dumps(row) + "\n" for row in rows)
+        elif self.print_opml:
+            outlines = [
+                {"title": ", ".join(f"{key}: {value}" for key, value in row.items())}
+                for row in rows
+            ]
+            self.stream.writelines(self.opml_lines(outlines))
+            self.stream.write("\n")
+        elif self.print_csv:
+            import csv
+
+            writer = csv.DictWriter(
+                self.stream, fieldnames=columns, delimiter=";", escapechar="\\"
+            )
+            writer.writeheader()
+            writer.writerows(rows)
+            self.stream.write("\n")
+        else:
+            self.stream.writelines(self.table_lines(columns, rows))
+        self.mark("render")
+
+    @staticmethod
+    def table_lines(columns, rows):
+        """Yield the lines of a text table with aligned columns."""
+        cells = [columns] + [
+            ["" if row[column] is None else str(row[column]) for column in columns]
+            for row in rows
+        ]
+        widths = [
+            max(len(line[index]) for line in cells) for index in range(len(columns))
+        ]
+        for line in cells:
+            yield "  ".join(
+                cell.ljust(width) for cell, width in zip(line, widths)
+            ).rstrip() + "\n"
+
+    @staticmethod
+    def json_array(tasks):
+        """Yield the JSON array of a stream of tasks, like `json.dumps` of a list."""
+        import json
+
+        from things_cli.model import to_json
+
+        separator = "["
+        for task in tasks:
+            yield separator + json.dumps(task, default=to_json)
+            separator = ", "
+        yield "[]\n" if separator == "[" else "]\n"
 
-        result = ""
+    def jsonl_lines(self, tasks, parent_uuid=None, depth=0):
+        """Yield one JSON document per line (JSON Lines) for each task."""
+        import json
 
-        if array is None:
-            array = {}
+        from things_cli.model import to_json
 
+        if not self.flatten:
+            for task in self.project(tasks) if self.fields else tasks:
+                yield json.dumps(task, default=to_json) + "\n"
+            return
+
+        if tasks is True:
+            return
         for task in tasks:
-            ThingsCLI.gantt_add_task(task, array)
-            self.gantt_dumps(task.get("items", []), array)
+            record = {
+                key: value
+                for key, value in task.items()
+                if key not in ["items", "checklist"] or not isinstance(value, list)
+            }
+            uuid = task.get("uuid")
+            if uuid is None and "type" not in task:
+                # Sections of `all` have no UUID, they are keyed by their title
+                uuid = record["uuid"] = f"section:{task['title']}"
+            if self.fields:
+                record = self.project([record])[0]
+            record["parent_uuid"] = parent_uuid
+            record["depth"] = depth
+            yield json.dumps(record, default=to_json) + "\n"
+            yield from self.jsonl_lines(task.get("items", []), uuid, depth + 1)
+            yield from self.jsonl_lines(task.get("checklist", []), uuid, depth + 1)
+
+    def select(self, tasks, sort=None):
+        """Order and page tasks, then fetch the items of the selected ones."""
+        # With a limit, only the first `offset + limit` tasks are kept while
+        # ordering (in a bounded heap). The sections of `all` are paged one by
+        # one. `sort` is a field name, with a leading `-` for descending.
+        # Streams of tasks are paged while they are read, see `stream`.
+        import heapq
+
+        stop = self.bound()
+        selected = sort or self.offset or stop is not None or self.deferred_items
+        if not selected or not isinstance(tasks, list):
+            return tasks
+        if tasks and "type" not in tasks[0] and "items" in tasks[0]:
+            return [
+                {**section, "items": self.select(section["items"], sort)}
+                for section in tasks
+            ]
+
+        if sort:
+            field = sort.lstrip("-")
+            descending = sort.startswith("-")
+
+            def key(task):
+                value = task.get(field)
+                # Tasks without a value come last in both directions
+                if value is None:
+                    return (0 if descending else 1, "")
+                return (1 if descending else 0, value)
+
+            if stop is None:
+                tasks = sorted(tasks, key=key, reverse=descending)
+            elif descending:
+                tasks = heapq.nlargest(stop, tasks, key=key)
+            else:
+                tasks = heapq.nsmallest(stop, tasks, key=key)
+        if self.offset or stop is not None:
+            tasks = tasks[self.offset or 0 : stop]
+        if self.deferred_items:
+            tasks = [self.expand(task) for task in tasks]
+        return tasks
+
+    def bound(self):
+        """Return how many tasks are needed for the requested page, or None."""
+        if self.limit is None:
+            return None
+        return (self.offset or 0) + self.limit
+
+    def expand(self, task):
+        """Fetch a task, area or tag again with its items."""
+        import things as api
+
+        database = self.open_database()
+        if task.get("type") == "area":
+            return api.areas(uuid=task["uuid"], include_items=True, database=database)
+        if task.get("type") == "tag":
+            return api.tags(title=task["title"], include_items=True, database=database)
+        return api.tasks(uuid=task["uuid"], database=database)
+
+    def project(self, tasks):
+        """Return copies of the tasks with the requested fields only."""
+        # A stream of tasks is projected while it is read.
+        records = map(self.project_task, tasks)
+        return list(records) if isinstance(tasks, list) else records
+
+    def project_task(self, task):
+        """Return a copy of a task or section with the requested fields only."""
+        if "type" not in task and "items" in task:
+            return {**task, "items": self.project(task["items"])}
+        record = {field: task[field] for field in self.fields if field in task}
+        for nested in ["items", "checklist"]:
+            if isinstance(record.get(nested), list):
+                record[nested] = self.project(record[nested])
+        return record
+
+    def gantt_dumps(self, tasks):
+        """Convert tasks into mermaid-js GANTT."""
+        return "".join(self.gantt_lines(tasks))
+
+    def gantt_lines(self, tasks):
+        """Yield mermaid-js GANTT sections, rendered once after the walk."""
 
-        for group in array:
-            result += f"  section {group}\n"
-            for item in array[group]:
-                result += item
+        array = {}
+        titles = {}
+        self.gantt_collect(tasks, array, titles)
 
-        return result
+        for group, items in array.items():
+            yield f"  section {group}\n"
+            yield from items
+
+    def gantt_collect(self, tasks, array, titles):
+        """Add tasks and their nested items to the GANTT sections."""
+        for task in tasks:
+            ThingsCLI.gantt_add_task(task, array, titles)
+            self.gantt_collect(task.get("items", []), array, titles)
 
     @staticmethod
-    def gantt_add_task(task, array):
+    def gantt_add_task(task, array, titles):
         """Add a task to a mermaid-js GANTT."""
+        # `titles` indexes the lowercased titles already added per section to
+        # skip duplicates.
 
         context = (
             task.get("project_title", None)
@@ -127,81 +439,126 @@ class ThingsCLI:  # pylint: disable=too-many-instance-attributes
         if start and not task.get("stop_date"):
             if context not in array:
                 array[context] = []
-            if not "".join(s for s in array[context] if title.lower() in s.lower()):
+                titles[context] = set()
+            if title.lower() not in titles[context]:
+                titles[context].add(title.lower())
                 array[context].append(f"    {title} {visual}, {start}, {deadline}\n")
 
     def csv_dumps(self, tasks):
         """Convert tasks into CSV."""
-
-        fieldnames = []
-        self.csv_header(tasks, fieldnames)
-        if "items" in fieldnames:
-            fieldnames.remove("items")
-        if "checklist" in fieldnames:
-            fieldnames.remove("checklist")
+        from io import StringIO
 
         output = StringIO()
-        writer = csv.DictWriter(
-            output, fieldnames=fieldnames, delimiter=";", escapechar="\\"
-        )
-        writer.writeheader()
+        self.csv_write(tasks, output)
+        return output.getvalue()
 
-        self.csv_converter(tasks, writer)
+    def csv_fieldnames(self):
+        """Return the CSV columns, derived from the task types of the command."""
 
-        return output.getvalue()
+        if self.fields:
+            return self.fields
 
-    def csv_header(self, tasks, fieldnames):
-        """Convert tasks into CSV header."""
-        for task in tasks:
-            fieldnames.extend(field for field in task if field not in fieldnames)
-            self.csv_header(task.get("items", []), fieldnames)
+        types = CSV_COMMAND_TYPES.get(self.command, ["to-do"])
+        if self.recursive:
+            types = types + ["to-do"]
 
-    def csv_converter(self, tasks, writer):
-        """Convert tasks into CSV."""
+        fieldnames = []
+        for task_type in types:
+            fieldnames.extend(
+                field for field in CSV_FIELDS[task_type] if field not in fieldnames
+            )
+        return fieldnames
+
+    def csv_write(self, tasks, output):
+        """Write tasks as CSV rows into a file object in a single pass."""
+        writer = self.csv_writer(output, self.csv_fieldnames())
+        writer.writeheader()
+        writer.writerows(self.csv_rows(tasks))
+
+    @staticmethod
+    def csv_writer(output, fieldnames):
+        """Return a writer of tasks as CSV rows with the given columns."""
+        import csv
+
+        return csv.DictWriter(
+            output,
+            fieldnames=fieldnames,
+            delimiter=";",
+            escapechar="\\",
+            extrasaction="ignore",
+        )
+
+    def csv_rows(self, tasks):
+        """Yield tasks as CSV rows, nested items before their parents."""
         if tasks is True:
             return
         for task in tasks:
-            self.csv_converter(task.get("items", []), writer)
-            task.pop("items", [])
-            self.csv_converter(task.get("checklist", []), writer)
-            task.pop("checklist", [])
-            writer.writerow(task)
+            yield from self.csv_rows(task.get("items", []))
+            yield from self.csv_rows(task.get("checklist", []))
+            yield task
 
     def opml_dumps(self, tasks):
         """Convert tasks into OPML."""
+        return "".join(self.opml_lines(tasks))
 
-        top = Element("opml")
-        head = SubElement(top, "head")
-        SubElement(head, "title").text = "Things 3 Database"
-        body = SubElement(top, "body")
+    def opml_lines(self, tasks):
+        """Yield indented OPML lines while walking the selected tasks."""
 
-        self.opml_convert(tasks, body)
+        yield '<?xml version="1.0" ?>\n'
+        yield "<opml>\n"
+        yield f"{OPML_INDENT}<head>\n"
+        yield f"{OPML_INDENT * 2}<title>Things 3 Database</title>\n"
+        yield f"{OPML_INDENT}</head>\n"
+
+        outlines = self.opml_convert(tasks, 2)
+        first = next(outlines, None)
+        if first is None:
+            yield f"{OPML_INDENT}<body/>\n"
+        else:
+            yield f"{OPML_INDENT}<body>\n"
+            yield first
+            yield from outlines
+            yield f"{OPML_INDENT}</body>\n"
 
-        return minidom.parseString(ETree.tostring(top)).toprettyxml(indent="   ")
+        yield "</opml>\n"
 
-    def opml_convert(self, tasks, top):
-        """Print pretty OPML of selected tasks."""
+    def opml_convert(self, tasks, depth):
+        """Yield pretty OPML outline elements of selected tasks."""
 
         if tasks is True:
             return
+        indentation = OPML_INDENT * depth
         for task in tasks:
-            area = SubElement(top, "outline")
             text = task["title"]
             if task.get("start_date"):
                 text = f"{text} (Scheduled: {task['start_date']})"
             elif task.get("start"):
                 text = f"{text} ({task['start']})"
-            area.set("text", text)
-            self.opml_convert(task.get("items", []), area)
-            task.pop("items", [])
-            self.opml_convert(task.get("checklist", []), area)
-            task.pop("checklist", [])
+            for character, entity in OPML_ENTITIES:
+                text = text.replace(character, entity)
 
-    def txt_dumps(self, tasks, indentation="", result=""):
+            children = chain(
+                self.opml_convert(task.get("items", []), depth + 1),
+                self.opml_convert(task.get("checklist", []), depth + 1),
+            )
+            first = next(children, None)
+            if first is None:
+                yield f'{indentation}<outline text="{text}"/>\n'
+            else:
+                yield f'{indentation}<outline text="{text}">\n'
+                yield first
+                yield from children
+                yield f"{indentation}</outline>\n"
+
+    def txt_dumps(self, tasks, indentation=""):
         """Print pretty text version of selected tasks."""
+        return "".join(self.txt_lines(tasks, indentation))
+
+    def txt_lines(self, tasks, indentation=""):
+        """Yield pretty text lines of selected tasks while walking the tree."""
 
         if tasks is True:
-            return result
+            return
         for task in tasks:
             title = task["title"]
             context = (
@@ -212,14 +569,9 @@ class ThingsCLI:  # pylint: disable=too-many-instance-attributes
             )
             start = task.get("start_date", None)
             details = " | ".join(filter(None, [start, context]))
-            result = result + f"{indentation}- {title} ({details})\n"
-            result = self.txt_dumps(task.get("items", []), indentation + "  ", result)
-            task.pop("items", [])
-            result = self.txt_dumps(
-                task.get("checklist", []), indentation + "  ", result
-            )
-
-        return result
+            yield f"{indentation}- {title} ({details})\n"
+            yield from self.txt_lines(task.get("items", []), indentation + "  ")
+            yield from self.txt_lines(task.get("checklist", []), indentation + "  ")
 
     @classmethod
     def print_unimplemented(cls, command):
@@ -229,258 +581,312 @@ class ThingsCLI:  # pylint: disable=too-many-instance-attributes
     @classmethod
     def get_parser(cls):
         """Create command line argument parser."""
-        parser = argparse.ArgumentParser(description="Simple read-only Thing 3 CLI.")
-
-        subparsers = parser.add_subparsers(
-            help="", metavar="command", required=True, dest="command"
-        )
-
-        ################################
-        # Core database methods
-        ################################
-        subparsers.add_parser("inbox", help="Shows inbox tasks")
-        subparsers.add_parser("today", help="Shows todays tasks")
-        subparsers.add_parser("upcoming", help="Shows upcoming tasks")
-        subparsers.add_parser("anytime", help="Shows anytime tasks")
-        subparsers.add_parser("completed", help="Shows completed tasks")
-        subparsers.add_parser("someday", help="Shows someday tasks")
-        subparsers.add_parser("canceled", help="Shows canceled tasks")
-        subparsers.add_parser("trash", help="Shows trashed tasks")
-        subparsers.add_parser("todos", help="Shows all todos")
-        subparsers.add_parser("all", help="Shows all tasks")
-        subparsers.add_parser("areas", help="Shows all areas")
-        subparsers.add_parser("projects", help="Shows all projects")
-        subparsers.add_parser("logbook", help="Shows completed tasks")
-        subparsers.add_parser("logtoday", help="Shows tasks completed today")
-        subparsers.add_parser("createdtoday", help="Shows tasks created today")
-        subparsers.add_parser("tags", help="Shows all tags ordered by their usage")
-        subparsers.add_parser("deadlines", help="Shows tasks with due dates")
-
-        ################################
-        # Additional functions
-        ################################
-        subparsers.add_parser("feedback", help="Give feedback")
-        subparsers.add_parser(
-            "search", help="Searches for a specific task"
-        ).add_argument("string", help="String to search for")
-
-        ################################
-        # To be implemented in things.py
-        ################################
-        # subparsers.add_parser("repeating", help="Shows all repeating tasks")
-        # subparsers.add_parser("subtasks", help="Shows all subtasks")
-        # subparsers.add_parser("headings", help="Shows headings")
-
-        ################################
-        # To be converted from https://github.com/alexanderwillner/things.sh
-        ################################
-        # subparsers.add_parser("backlog", help="Shows backlog tasks")
-        # subparsers.add_parser("empty", help="Shows projects that are empty")
-        # subparsers.add_parser("hours", help="Shows hours planned today")
-        # subparsers.add_parser("ical", help="Shows tasks ordered by due date as iCal")
-        # subparsers.add_parser("lint", help="Shows tasks that float around")
-        # subparsers.add_parser(
-        #     "mostClosed", help="Shows days when most tasks were closed"
-        # )
-        # subparsers.add_parser(
-        #     "mostCancelled", help="Shows days when most tasks were cancelled"
-        # )
-        # subparsers.add_parser(
-        #     "mostTrashed", help="Shows days when most tasks were trashed"
-        # )
-        # subparsers.add_parser(
-        #     "mostCreated", help="Shows days when most tasks were created"
-        # )
-        # subparsers.add_parser("mostTasks", help="Shows projects that have most tasks")
-        # subparsers.add_parser(
-        #     "mostCharacters", help="Shows tasks that have most characters"
-        # )
-        # subparsers.add_parser("nextish", help="Shows all nextish tasks")
-        # subparsers.add_parser("old", help="Shows all old tasks")
-        # subparsers.add_parser("schedule", help="Schedules an event using a template")
-        # subparsers.add_parser("stat", help="Provides a number of statistics")
-        # subparsers.add_parser("statcsv", help="Exports some statistics as CSV")
-        # subparsers.add_parser("tag", help="Shows all tasks with the waiting for tag")
-        # subparsers.add_parser(
-        #     "waiting", help="Shows all tasks with the waiting for tag"
-        # )
-
-        ################################
-        # To be converted from https://github.com/alexanderwillner/things.sh
-        ################################
-        # parser.add_argument("-a", "--anonymize",
-        #                     action="store_true", default=False,
-        #                     help="anonymize output", dest="anonymize")
-
-        parser.add_argument(
-            "-p", "--filter-project", dest="filter_project", help="filter by project (UUID)"
-        )
-        parser.add_argument(
-            "-a", "--filter-area", dest="filter_area", help="filter by area (UUID)"
-        )
-        parser.add_argument(
-            "-t", "--filtertag", dest="filter_tag", help="filter by tag"
-        )
-        parser.add_argument(
-            "-e",
-            "--only-projects",
-            action="store_true",
-            default=False,
-            dest="only_projects",
-            help="export only projects",
-        )
-        parser.add_argument(
-            "-o",
-            "--opml",
-            action="store_true",
-            default=False,
-            help="output as OPML",
-            dest="opml",
-        )
-
-        parser.add_argument(
-            "-j",
-            "--json",
-            action="store_true",
-            default=False,
-            help="output as JSON",
-            dest="json",
-        )
-
-        parser.add_argument(
-            "-c",
-            "--csv",
-            action="store_true",
-            default=False,
-            help="output as CSV",
-            dest="csv",
-        )
-
-        parser.add_argument(
-            "-g",
-            "--gantt",
-            action="store_true",
-            default=False,
-            help="output as mermaid-js GANTT",
-            dest="gantt",
-        )
-
-        parser.add_argument(
-            "-r",
-            "--recursive",
-            help="in-depth output",
-            dest="recursive",
-            default=False,
-            action="store_true",
-        )
-
-        parser.add_argument(
-            "-d", "--database", help="set path to database", dest="database"
-        )
+        return make_parser()
 
-        parser.add_argument(
-            "--version",
-            "-v",
-            action="version",
-            version=f"%(prog)s (version {__version__})",
-        )
+    def open_database(self):
+        """Return the database of the run, opened on first use."""
+        # Its queries share a pool of tuned read-only connections, see
+        # `connection`, and are counted in the timings of the run.
+        if self.things_database is None:
+            from things_cli.connection import Pool, ReadOnlyDatabase
 
-        argcomplete.autocomplete(parser)
+            self.things_database = ReadOnlyDatabase(
+                self.database, Pool(self.mmap_size, self.page_cache), self.timings
+            )
+        elif self.timings and self.things_database.timings is not self.timings:
+            import copy
 
-        return parser
+            # A resident database is shared with the runs of other requests
+            self.things_database = copy.copy(self.things_database)
+            self.things_database.timings = self.timings
+        return self.things_database
 
     def defaults(self):
         """Set default options for the new API."""
-        return {
+        defaults = {
             "project": self.filter_project,
             "area": self.filter_area,
             "tag": self.filter_tag,
-            "include_items": self.recursive,
+            "include_items": self.include_items,
             "filepath": self.database,
         }
+        if self.things_database:
+            defaults["database"] = self.open_database()
+        return defaults
 
-    def main(self, args=None):
+    def main(self, args=None, started=None):
         """Start the main app."""
+        from things_cli import timings
 
+        # `started` is the `time.perf_counter()` before parsing `args`
         if args is None:
-            self.main(ThingsCLI.get_parser().parse_args())
+            started = time.perf_counter()
+            self.main(ThingsCLI.get_parser().parse_args(), started)
+            return
+
+        if timings.requested(args):
+            with timings.instrument(self, args, started):
+                self.run(args)
+        else:
+            self.run(args)
+
+    def run(self, args):
+        """Run a parsed command line."""
+        if args.databases:
+            from things_cli import fanout
+
+            if fanout.requested(args):
+                fanout.fanout(self, args)
+                return
+        self.configure(args)
+        defaults = self.defaults()
+
+        if self.use_cache:
+            self.parse_cached_command(defaults, args)
         else:
-            self.print_json = args.json
-            self.print_csv = args.csv
-            self.print_gantt = args.gantt
-            self.print_opml = args.opml
-            self.database = args.database or self.database
-            self.filter_project = args.filter_project or None
-            self.filter_area = args.filter_area or None
-            self.filter_tag = args.filter_tag or None
-            self.only_projects = args.only_projects or None
-            self.recursive = args.recursive
-            # self.anonymize = args.anonymize
-            # self.things3.anonymize = self.anonymize ## not implemented
-            defaults = self.defaults()
+            self.parse_command(defaults, args)
 
+    def configure(self, args):
+        """Set the options of a parsed command line."""
+        self.print_json = args.json
+        self.print_jsonl = args.jsonl
+        self.flatten = args.flatten
+        self.fields = args.fields.split(",") if args.fields else None
+        self.command = args.command
+        self.print_csv = args.csv
+        self.print_gantt = args.gantt
+        self.print_opml = args.opml
+        self.database = args.database or self.database
+        self.current_snapshot = None
+        self.filter_project = args.filter_project or None
+        self.filter_area = args.filter_area or None
+        self.filter_tag = args.filter_tag or None
+        self.only_projects = args.only_projects or None
+        self.recursive = args.recursive
+        self.limit = args.limit
+        self.offset = args.offset
+        self.sort = args.sort
+        # Projected JSON without items or checklist needs no nested items
+        nested = self.recursive and not (
+            self.fields
+            and (self.print_json or (self.print_jsonl and not self.flatten))
+            and not {"items", "checklist"} & set(self.fields)
+        )
+        # Items of paged tasks are only fetched for the selected page
+        paged = self.sort or self.limit is not None or self.offset
+        self.include_items = nested and not paged
+        self.deferred_items = nested and bool(paged)
+        self.workers = args.workers
+        self.chunk_size = args.chunk_size
+        self.max_memory = args.max_memory
+        self.mmap_size = args.mmap_size
+        self.page_cache = args.page_cache
+        self.use_cache = not args.no_cache
+        # self.anonymize = args.anonymize
+        # self.things3.anonymize = self.anonymize ## not implemented
+
+    def parse_cached_command(self, defaults: dict, args):
+        """Answer a command from the result cache or run and cache it."""
+        from contextlib import closing
+        import sqlite3
+
+        from things_cli.cache import Tee
+
+        opened = self.open_cache(args)
+        if opened is None:
             self.parse_command(defaults, args)
+            return
+
+        cache, key, state = opened
+        with closing(cache):
+            try:
+                cached = cache.get(key, state)
+            except sqlite3.Error:
+                cached = None
+            if cached is not None:
+                if self.timings:
+                    self.timings.cached = True
+                self.mark("cache")
+                self.stream.write(cached)
+                return
+
+            output = self.output
+            tee = self.output = Tee(self.stream, cache.max_size)
+            try:
+                self.parse_command(defaults, args)
+            finally:
+                self.output = output
+            if tee.complete:
+                try:
+                    cache.put(key, state, tee.getvalue())
+                except sqlite3.Error:
+                    pass
+
+    def open_cache(self, args):
+        """Return the result cache, the key and the database state of a command."""
+        # Return None if the command is not cached or there is no database or
+        # cache.
+        import sqlite3
+
+        from things_cli import cache
+
+        if args.command in cache.UNCACHEABLE_COMMANDS:
+            return None
+        state = cache.fingerprint(self.database)
+        if state is None:
+            return None
+        try:
+            opened = cache.Cache()
+        except (OSError, sqlite3.Error):
+            return None
+
+        arguments = vars(args)
+        if args.command == "search":
+            # Results are ranked differently once there is an index
+            from things_cli.search import index_path
+
+            indexed = os.path.exists(index_path(self.database))
+            arguments = dict(arguments, indexed=indexed)
+        return opened, cache.make_key(self.database, arguments), state
+
+    def fetch_concurrently(self, names, defaults):
+        """Call independent API functions on a thread pool, keeping their order."""
+        # The results are the items of sections, like those of `all`.
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = min(self.workers or len(names), len(names))
+        if workers <= 1:
+            return [self.fetch(name, defaults, nested=True) for name in names]
+
+        # The threads share the database and the connections of its pool
+        self.open_database()
+        if not defaults.get("include_items"):
+            self.is_snapshot()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.fetch, name, defaults, nested=True)
+                for name in names
+            ]
+            return [future.result() for future in futures]
 
-    def parse_command(self, defaults: Dict, args):
+    def fetch(self, name, defaults, nested=False):
+        """Call an API function, reading whole lists from a snapshot if given."""
+        # Items are loaded level by level with a constant number of queries.
+        # `nested` results are items themselves, see `tree.load`.
+        import things as api
+
+        if defaults.get("include_items"):
+            from things_cli import tree
+
+            return tree.load(self, name, defaults, nested)
+        filters = [defaults.get(key) for key in ["project", "area", "tag"]]
+        if not self.include_items and not any(filters) and self.is_snapshot():
+            from things_cli.snapshot import read_list
+
+            result = read_list(self.database, name)
+            if result is not None:
+                return result
+        return getattr(api, name)(**dict(defaults, database=self.open_database()))
+
+    def is_snapshot(self):
+        """Return whether the database is a snapshot taken today (see `snapshot`)."""
+        # The database is only opened to check this once per run.
+        if self.current_snapshot is None:
+            from things_cli.snapshot import is_current
+
+            self.current_snapshot = bool(self.database) and is_current(self.database)
+        return self.current_snapshot
+
+    def parse_command(self, defaults: dict, args):
         """Handle given command."""
+        import things as api
 
         command = args.command
 
-        if command == "tags":
-            defaults.pop("tag")
-            defaults.pop("project")
-        if command in ["all", "areas"]:
-            defaults.pop("area")
-            defaults.pop("project")
-
-        if command == "all":
-            inbox = api.inbox(**defaults)
-            today = api.today(**defaults)
-            upcoming = api.upcoming(**defaults)
-            anytime = api.anytime(**defaults)
-            someday = api.someday(**defaults)
-            logbook = api.logbook(**defaults)
-
-            no_area = api.projects(**defaults)
-            areas = api.areas(**defaults)
-            structure = [
-                {"title": "Inbox", "items": inbox},
-                {"title": "Today", "items": today},
-                {"title": "Upcoming", "items": upcoming},
-                {"title": "Anytime", "items": anytime},
-                {"title": "Someday", "items": someday},
-                {"title": "Logbook", "items": logbook},
-                {"title": "No Area", "items": no_area},
-                {"title": "Areas", "items": areas},
-            ]
-            self.print_tasks(structure)
-        elif command == "logtoday":
-            today = datetime.now().strftime("%Y-%m-%d")
-            result = getattr(api, "logbook")(**defaults, stop_date=today)
-            self.print_tasks(result)
-        elif command == "createdtoday":
-            result = getattr(api, "last")("1d")
-            self.print_tasks(result)
-        elif command == "upcoming":
-            result = getattr(api, command)(**defaults)
-            result.sort(key=lambda task: task["start_date"], reverse=False)
-            self.print_tasks(result)
-        elif command == "search":
-            self.print_tasks(
-                api.search(
-                    args.string,
-                    filepath=self.database,
-                    include_items=self.recursive,
-                )
+        for key in IGNORED_FILTERS.get(command, []):
+            defaults.pop(key)
+
+        if command in COMMAND_METHODS:
+            getattr(self, COMMAND_METHODS[command])(defaults, args)
+            return
+        if command in COMMAND_MODULES:
+            import importlib
+
+            module, function = COMMAND_MODULES[command]
+            getattr(importlib.import_module(f"things_cli.{module}"), function)(
+                self, args
             )
-        elif command == "feedback":  # pragma: no cover
-            webbrowser.open("https://github.com/thingsapi/things-cli/issues")
-        elif command in dir(api):
-            self.print_tasks(getattr(api, command)(**defaults))
+            return
+
+        if command in dir(api):
+            from things_cli import stream
+
+            tasks = stream.tasks(self, command, defaults)
+            self.print_tasks(tasks or self.fetch(command, defaults))
         else:  # pragma: no cover
             ThingsCLI.print_unimplemented(command)
             sys.exit(3)
 
+    def print_all(self, defaults, _args):
+        """Print the sections of the `all` command."""
+        results = self.fetch_concurrently(
+            [name for _title, name in ALL_SECTIONS], defaults
+        )
+        structure = [
+            {"title": title, "items": items}
+            for (title, _name), items in zip(ALL_SECTIONS, results)
+        ]
+        self.print_tasks(structure)
+
+    def print_logtoday(self, defaults, _args):
+        """Print the tasks completed today."""
+        from datetime import datetime
+
+        import things as api
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        defaults["database"] = self.open_database()
+        self.print_tasks(api.logbook(**defaults, stop_date=today))
+
+    def print_createdtoday(self, _defaults, _args):
+        """Print the tasks created today, in any project, area or with any tag."""
+        import things as api
+
+        self.print_tasks(api.last("1d", database=self.open_database()))
+
+    def print_upcoming(self, defaults, _args):
+        """Print the upcoming tasks, by default in the order of their start."""
+        result = self.fetch("upcoming", defaults)
+        self.print_tasks(result, default_sort="start_date")
+
+    def print_search(self, _defaults, args):
+        """Print the tasks found by a search."""
+        from things_cli import search
+
+        self.print_tasks(search.search(self, args.string))
+
+    def print_cachestats(self, _defaults, _args):
+        """Print the statistics of the result cache."""
+        from contextlib import closing
+        import json
+
+        from things_cli.cache import Cache
+
+        with closing(Cache()) as cache:
+            stats = cache.stats()
+        if self.print_json:
+            print(json.dumps(stats), file=self.stream)
+        else:
+            for key, value in stats.items():
+                print(f"{key}: {value}", file=self.stream)
+
+    @staticmethod
+    def open_feedback(_defaults, _args):  # pragma: no cover
+        """Open the issues of the project to give feedback."""
+        import webbrowser
+
+        webbrowser.open("https://github.com/thingsapi/things-cli/issues")
+
 
 def main():
     """Start for CLI installation."""
@@ -0,0 +1,60 @@
+"""Thin client forwarding a command line to a running `things-cli serve`."""
+
+# Only lightweight modules are imported here so the client starts fast. If no
+# server is running, the command is run in-process instead.
+
+import json
+import os
+import socket
+import sys
+
+
+ENVIRONMENT_VARIABLE_WITH_SOCKET = "THINGS_CLI_SOCKET"
+
+
+def default_socket_path():
+    """Return the path of the Unix socket shared by server and client."""
+    # Both directories belong to the user, unlike the shared /tmp
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    directory = os.getenv("XDG_RUNTIME_DIR") or os.path.join(cache_home, "things-cli")
+    return os.getenv(ENVIRONMENT_VARIABLE_WITH_SOCKET) or os.path.join(
+        directory, "things-cli.sock"
+    )
+
+
+def request(argv, path=None, stdout=None, stderr=None):
+    """Send a command line to the server, print its output, return the exit status."""
+    # Raises OSError if the server cannot be reached
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path or default_socket_path())
+        # Relative paths are those of the client
+        request_line = json.dumps({"argv": argv, "cwd": os.getcwd()})
+        connection.sendall(request_line.encode() + b"\n")
+        with connection.makefile("rb") as reader:
+            for line in reader:
+                message = json.loads(line)
+                if "stdout" in message:
+                    stdout.write(message["stdout"])
+                elif "stderr" in message:
+                    stderr.write(message["stderr"])
+                elif "exit" in message:
+                    return message["exit"]
+    return 1
+
+
+def main():
+    """Start for the client installation."""
+    try:
+        status = request(sys.argv[1:])
+    except (FileNotFoundError, ConnectionRefusedError):
+        from things_cli import cli  # pylint: disable=import-outside-toplevel
+
+        cli.main()
+        return
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
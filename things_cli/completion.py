@@ -0,0 +1,180 @@
+"""Dynamic shell completion of projects, areas, tags and search terms."""
+
+# With argcomplete, `-p` and `-a` complete the UUIDs of open projects and of
+# areas, matched by the start of the UUID or any part of the title (which is
+# shown as the description where the shell supports it), `-t` completes tag
+# titles and `search` the words of the titles of open tasks.
+#
+# The completers read a small JSON index of these titles in the cache directory.
+# It is rebuilt with a few small queries when the fingerprint of the database
+# (see `cache.fingerprint`) changed, so a completion costs a `stat` and reading
+# the file, and things.py is not imported. Modules only needed to rebuild the
+# index, such as sqlite3, are imported when it is rebuilt.
+
+import json
+import os
+import re
+import zlib
+
+from things_cli.cache import database_path, default_path, fingerprint
+from things_cli.stats import INCOMPLETE, PROJECT, TODO
+
+
+# Variable of things.py with the path of the database
+ENVIRONMENT_VARIABLE_WITH_FILEPATH = "THINGSDB"
+
+PROJECTS_SQL = f"""
+    SELECT uuid, title FROM TMTask
+    WHERE type = {PROJECT} AND status = {INCOMPLETE} AND trashed = 0
+    ORDER BY "index"
+    """
+AREAS_SQL = 'SELECT uuid, title FROM TMArea ORDER BY "index"'
+TAGS_SQL = 'SELECT title FROM TMTag ORDER BY "index"'
+TITLES_SQL = f"""
+    SELECT title FROM TMTask
+    WHERE type IN ({TODO}, {PROJECT}) AND status = {INCOMPLETE} AND trashed = 0
+    """
+
+# Search terms: the most frequent words of three or more characters, starting
+# with a letter
+WORD = re.compile(r"[^\W\d_]\w{2,}")
+MAX_WORDS = 5000
+
+EMPTY = {"projects": {}, "areas": {}, "tags": [], "words": []}
+
+
+def index_key(filepath=None):
+    """Return what identifies the database of a completion index."""
+    # Without a path it depends on the environment like the default database of
+    # things.py, but things.py is not imported to find it.
+    if filepath:
+        return os.path.abspath(filepath)
+    return os.getenv(ENVIRONMENT_VARIABLE_WITH_FILEPATH, "")
+
+
+def index_path(filepath=None):
+    """Return the path of the completion index of a Things database."""
+    # The name is a checksum of `index_key`, the index keeps the key itself in
+    # case of a collision.
+    checksum = zlib.crc32(index_key(filepath).encode())
+    return os.path.join(
+        os.path.dirname(default_path()), f"completion-{checksum:08x}.json"
+    )
+
+
+def build(filepath):
+    """Return the titles to complete of the database at a path."""
+    import sqlite3  # pylint: disable=import-outside-toplevel
+
+    connection = sqlite3.connect(f"file:{filepath}?mode=ro", uri=True)
+    try:
+        connection.execute("PRAGMA query_only = ON")
+        counts = {}
+        for (title,) in connection.execute(TITLES_SQL):
+            for word in WORD.findall((title or "").lower()):
+                counts[word] = counts.get(word, 0) + 1
+        words = sorted(counts, key=lambda word: (-counts[word], word))[:MAX_WORDS]
+        return {
+            "projects": dict(connection.execute(PROJECTS_SQL).fetchall()),
+            "areas": dict(connection.execute(AREAS_SQL).fetchall()),
+            "tags": [title for (title,) in connection.execute(TAGS_SQL)],
+            "words": sorted(words),
+        }
+    finally:
+        connection.close()
+
+
+def load(filepath=None):
+    """Return the completion index of a database, rebuilt if the database changed."""
+    key = index_key(filepath)
+    path = index_path(filepath)
+    try:
+        with open(path, encoding="utf-8") as file:
+            index = json.load(file)
+        if index["key"] == key and index["fingerprint"] == fingerprint(
+            index["database"]
+        ):
+            return index
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return rebuild(filepath, key, path)
+
+
+def rebuild(filepath, key, path):
+    """Build the completion index of a database and save it to `path`."""
+    import sqlite3  # pylint: disable=import-outside-toplevel
+
+    database = database_path(filepath)
+    state = fingerprint(database)
+    if state is None:
+        return EMPTY
+    try:
+        index = dict(build(database), key=key, database=database, fingerprint=state)
+    except sqlite3.Error:
+        return EMPTY
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}"
+        with open(partial, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+        os.replace(partial, path)
+    except OSError:
+        pass
+    return index
+
+
+class Completers:
+    """Completers of argcomplete for the database of the command line."""
+
+    # Completions are matched here, not only by their prefix, so `validate` has
+    # to be the validator of argcomplete.
+
+    def __init__(self):
+        """Start without an index, it is loaded by the first completer."""
+        self.index = None
+        self.matched = set()
+
+    def load(self, parsed_args):
+        """Return the completion index of the database of the parsed arguments."""
+        if self.index is None:
+            self.index = load(getattr(parsed_args, "database", None))
+        return self.index
+
+    def projects(self, prefix, parsed_args, **_kwargs):
+        """Complete the UUID of a project, with its title."""
+        return self.match(self.load(parsed_args)["projects"], prefix)
+
+    def areas(self, prefix, parsed_args, **_kwargs):
+        """Complete the UUID of an area, with its title."""
+        return self.match(self.load(parsed_args)["areas"], prefix)
+
+    def tags(self, prefix, parsed_args, **_kwargs):
+        """Complete a tag title containing the prefix."""
+        needle = prefix.lower()
+        tags = [tag for tag in self.load(parsed_args)["tags"] if needle in tag.lower()]
+        self.matched.update(tags)
+        return tags
+
+    def search(self, prefix, parsed_args, **_kwargs):
+        """Complete a word of the titles of open tasks."""
+        needle = prefix.lower()
+        words = [
+            word for word in self.load(parsed_args)["words"] if word.startswith(needle)
+        ]
+        self.matched.update(words)
+        return words
+
+    def match(self, titles, prefix):
+        """Return the UUIDs and titles whose UUID starts with or title contains prefix."""
+        needle = prefix.lower()
+        result = {
+            uuid: title or ""
+            for uuid, title in titles.items()
+            if uuid.startswith(prefix) or needle in (title or "").lower()
+        }
+        self.matched.update(result)
+        return result
+
+    def validate(self, completion, prefix):
+        """Accept completions by prefix, and those matched by a completer."""
+        return completion.startswith(prefix) or completion in self.matched
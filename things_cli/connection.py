@@ -0,0 +1,98 @@
+"""Read-only connections to the Things database, shared by the queries of a run."""
+
+# things.py opens a new connection for every query, with the default page cache
+# and without memory-mapped I/O. A `ReadOnlyDatabase` runs the queries of
+# things.py and of things-cli on a small pool of connections opened once per run
+# (or once per server) and tuned for reading:
+#
+# - read-only twice, with `mode=ro` and `PRAGMA query_only`, so the database of
+#   the app is never written, checkpointed or locked;
+# - with the database file memory-mapped up to `--mmap-size`, so pages are read
+#   from the file cache of the system instead of being copied;
+# - with a page cache of `--page-cache` that outlives single queries.
+#
+# In WAL mode readers do not block the writes of the app. Every query fetches
+# all its rows, which ends its read transaction, so checkpoints of the app are
+# not held back between queries.
+
+from contextlib import contextmanager
+import sqlite3
+import threading
+
+from things.database import Database, dict_factory
+
+
+MMAP_SIZE = 256  # MiB
+CACHE_SIZE = 16  # MiB
+# Idle connections kept per database, for concurrent queries
+POOL_SIZE = 4
+
+
+class Pool:
+    """Idle read-only connections by database path."""
+
+    def __init__(self, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE):
+        """Tune new connections with sizes in MiB."""
+        self.mmap_size = MMAP_SIZE if mmap_size is None else mmap_size
+        self.cache_size = CACHE_SIZE if cache_size is None else cache_size
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def connect(self, filepath):
+        """Open a tuned read-only connection."""
+        connection = sqlite3.connect(
+            f"file:{filepath}?mode=ro", uri=True, check_same_thread=False
+        )
+        connection.execute("PRAGMA query_only = ON")
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size * 2**20)}")
+        connection.execute(f"PRAGMA cache_size = {-int(self.cache_size * 2**10)}")
+        return connection
+
+    @contextmanager
+    def connection(self, filepath):
+        """Lend a connection to the database at `filepath`."""
+        with self.lock:
+            idle = self.idle.get(filepath)
+            connection = idle.pop() if idle else None
+        if connection is None:
+            connection = self.connect(filepath)
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                idle = self.idle.setdefault(filepath, [])
+                if len(idle) < POOL_SIZE:
+                    idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def close(self):
+        """Close the idle connections."""
+        with self.lock:
+            idle = [connection for pool in self.idle.values() for connection in pool]
+            self.idle.clear()
+        for connection in idle:
+            connection.close()
+
+
+class ReadOnlyDatabase(Database):
+    """Database of things.py running its queries on the connections of a pool."""
+
+    # The queries and their rows are counted in `timings` if given.
+
+    def __init__(self, filepath=None, pool=None, timings=None):
+        """Open the database, sharing the connections of `pool` if given."""
+        self.pool = pool or Pool()
+        self.timings = timings
+        super().__init__(filepath=filepath)
+
+    def execute_query(self, sql_query, parameters=(), row_factory=None):
+        """Run a query on a connection of the pool."""
+        with self.pool.connection(self.filepath) as connection:
+            cursor = connection.cursor()
+            cursor.row_factory = row_factory or dict_factory
+            rows = cursor.execute(sql_query, parameters).fetchall()
+        if self.timings:
+            self.timings.count_query(len(rows))
+        return rows
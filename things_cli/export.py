@@ -0,0 +1,249 @@
+"""Incremental export of the changes of a Things database since a checkpoint."""
+
+# `things-cli export CHECKPOINT` prints the tasks (to-dos, projects and
+# headings) and areas that changed since the run that wrote CHECKPOINT, and a
+# tombstone `{"uuid": ..., "type": ..., "deleted": true}` for each one that was
+# deleted. The first run, without a checkpoint file, exports everything. Tasks
+# are the dicts of things.py with their tags and checklist; trashed, completed
+# and canceled tasks are included.
+#
+# A task changed if it or one of its checklist items was created or modified
+# since the checkpoint, or if the title of its project, heading or area or of
+# one of its tags changed, as these titles are part of the record. Areas have no
+# modification date and are compared with the checkpoint. The checkpoint is a
+# small SQLite database with the uuid and the title of every exported object and
+# is only updated after the changes were written, so a failed run is repeated by
+# the next one.
+
+import json
+import os
+import sqlite3
+
+import things.database
+
+from things_cli.cache import database_path
+from things_cli.search import MODIFIED
+from things_cli.tree import CHECKLIST_SQL, TAGS_SQL, tuple_factory
+
+
+SCHEMA = [
+    # Exported objects: a change of `title` changes the records of others
+    """
+    CREATE TABLE IF NOT EXISTS records (
+        uuid TEXT PRIMARY KEY, type TEXT, title TEXT, tags TEXT
+    ) WITHOUT ROWID
+    """,
+    "CREATE TABLE IF NOT EXISTS tags (uuid TEXT PRIMARY KEY, title TEXT)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)",
+]
+
+# Tag titles of an area as stored in the checkpoint
+AREA_TAGS = """(
+    SELECT json_group_array(title) FROM (
+        SELECT TAG.title FROM things.TMAreaTag AREA_TAG
+        JOIN things.TMTag TAG ON TAG.uuid = AREA_TAG.tags
+        WHERE AREA_TAG.areas = AREA.uuid
+        ORDER BY TAG."index"
+    )
+)"""
+
+CHANGED_TASKS_SQL = f"""
+    INSERT OR IGNORE INTO changed
+    SELECT uuid FROM things.TMTask TASK WHERE {MODIFIED.format("TASK")} > :since
+    UNION
+    SELECT task FROM things.TMChecklistItem ITEM WHERE {MODIFIED.format("ITEM")} > :since
+    UNION
+    SELECT uuid FROM renamed
+    UNION
+    SELECT TASK.uuid FROM things.TMTask TASK
+    LEFT JOIN things.TMTask HEADING ON HEADING.uuid = TASK.heading
+    WHERE TASK.project IN (SELECT uuid FROM renamed)
+    OR TASK.heading IN (SELECT uuid FROM renamed)
+    OR HEADING.project IN (SELECT uuid FROM renamed)
+    OR TASK.area IN (SELECT uuid FROM renamed)
+    UNION
+    SELECT TASK_TAG.tasks FROM things.TMTaskTag TASK_TAG
+    WHERE TASK_TAG.tags IN (SELECT uuid FROM renamed)
+    """
+
+# Projects, headings, areas and tags whose title is not the exported one
+RENAMED_SQL = f"""
+    INSERT INTO renamed
+    SELECT TASK.uuid FROM things.TMTask TASK
+    JOIN records ON records.uuid = TASK.uuid
+    WHERE (TASK.{things.database.IS_PROJECT} OR TASK.{things.database.IS_HEADING})
+    AND records.title IS NOT TASK.title
+    UNION
+    SELECT AREA.uuid FROM things.TMArea AREA
+    JOIN records ON records.uuid = AREA.uuid
+    WHERE records.title IS NOT AREA.title
+    UNION
+    SELECT TAG.uuid FROM things.TMTag TAG
+    JOIN tags ON tags.uuid = TAG.uuid
+    WHERE tags.title IS NOT TAG.title
+    """
+
+AREAS_SQL = f"""
+    SELECT
+        AREA.uuid,
+        'area' AS type,
+        AREA.title,
+        CASE
+            WHEN EXISTS (SELECT 1 FROM things.TMAreaTag WHERE areas = AREA.uuid)
+            THEN 1
+        END AS tags,
+        {AREA_TAGS} AS tag_titles
+    FROM things.TMArea AREA
+    LEFT JOIN records ON records.uuid = AREA.uuid
+    WHERE records.title IS NOT AREA.title OR records.tags IS NOT {AREA_TAGS}
+    ORDER BY AREA."index"
+    """
+
+DELETED_SQL = """
+    SELECT uuid, type FROM records
+    WHERE uuid NOT IN (SELECT uuid FROM things.TMTask)
+    AND uuid NOT IN (SELECT uuid FROM things.TMArea)
+    """
+
+
+class Checkpoint:
+    """Changes of a Things database since the state in a checkpoint file."""
+
+    def __init__(self, path, filepath=None):
+        """Open (and create) the checkpoint and attach the Things database."""
+        self.path = path
+        # Reads of the Things database and writes of the checkpoint are one
+        # transaction, so the checkpoint matches what was exported. The
+        # connection takes URIs, so the Things database is attached read-only.
+        self.connection = sqlite3.connect(
+            f"file:{path}", uri=True, isolation_level=None, timeout=1
+        )
+        self.connection.execute(
+            "ATTACH DATABASE ? AS things",
+            (f"file:{database_path(filepath)}?mode=ro",),
+        )
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.execute("BEGIN")
+
+    def close(self):
+        """Close the checkpoint, discarding uncommitted changes."""
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+        self.connection.close()
+
+    def commit(self):
+        """Store the state of the exported changes."""
+        self.connection.execute("COMMIT")
+
+    def query(self, sql, parameters=(), row_factory=things.database.dict_factory):
+        """Return the rows of a query, as dicts of things.py by default."""
+        cursor = self.connection.cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(sql, parameters).fetchall()
+
+    def changes(self):
+        """Return the records of the changes and prepare the checkpoint."""
+        execute = self.connection.execute
+        row = execute("SELECT value FROM meta WHERE key = 'modified'").fetchone()
+        since = row[0] if row else -1
+
+        for table in ["changed", "renamed"]:
+            execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (uuid TEXT PRIMARY KEY)")
+            execute(f"DELETE FROM {table}")  # nosec
+        execute(RENAMED_SQL)
+        execute(CHANGED_TASKS_SQL, {"since": since})
+
+        areas = self.changed_areas()
+        tasks = self.changed_tasks()
+        deleted = [
+            {"uuid": uuid, "type": kind, "deleted": True}
+            for uuid, kind in execute(DELETED_SQL).fetchall()
+        ]
+
+        execute(
+            "DELETE FROM records WHERE uuid IN (SELECT value FROM json_each(?))",
+            (json.dumps([record["uuid"] for record in deleted]),),
+        )
+        execute("DELETE FROM tags")
+        execute("INSERT INTO tags SELECT uuid, title FROM things.TMTag")
+        execute(
+            f"""
+            INSERT OR REPLACE INTO meta
+            SELECT 'modified', MAX(IFNULL(task, -1), IFNULL(item, -1), :since)
+            FROM (SELECT MAX({MODIFIED.format("TASK")}) AS task
+                  FROM things.TMTask TASK),
+                 (SELECT MAX({MODIFIED.format("ITEM")}) AS item
+                  FROM things.TMChecklistItem ITEM)
+            """,
+            {"since": since},
+        )
+        return [*areas, *tasks, *deleted]
+
+    def changed_areas(self):
+        """Return the new and changed areas with their tags."""
+        areas = self.query(AREAS_SQL)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, 'area', ?, ?)",
+            [(area["uuid"], area["title"], area.pop("tag_titles")) for area in areas],
+        )
+        tags = self.tags("area", [area["uuid"] for area in areas if area.get("tags")])
+        for area in areas:
+            if area.get("tags"):
+                area["tags"] = tags.get(area["uuid"], [])
+        return areas
+
+    def changed_tasks(self):
+        """Return the new and changed tasks with their tags and checklists."""
+        tasks = self.query(things.database.make_tasks_sql_query(f"""
+                TASK.{things.database.IS_NOT_RECURRING}
+                AND TASK.uuid IN (SELECT uuid FROM temp.changed)
+                """))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?, NULL)",
+            [(task["uuid"], task["type"], task["title"]) for task in tasks],
+        )
+        tags = self.tags("task", [task["uuid"] for task in tasks if task.get("tags")])
+        checklists = {}
+        rows = self.query(
+            CHECKLIST_SQL,
+            (json.dumps([task["uuid"] for task in tasks if task.get("checklist")]),),
+        )
+        for item in rows:
+            checklists.setdefault(item.pop("parent"), []).append(item)
+        for task in tasks:
+            if task.get("tags"):
+                task["tags"] = tags.get(task["uuid"], [])
+            if task.get("checklist"):
+                task["checklist"] = checklists.get(task["uuid"], [])
+        return tasks
+
+    def tags(self, kind, uuids):
+        """Return the tag titles of tasks or areas by uuid."""
+        result = {}
+        rows = self.query(
+            TAGS_SQL[kind], (json.dumps(uuids),), row_factory=tuple_factory
+        )
+        for uuid, title in rows:
+            result.setdefault(uuid, []).append(title)
+        return result
+
+
+def export(things_cli, args):
+    """Print the changes since a checkpoint for the `export` command."""
+    if things_cli.limit is not None or things_cli.offset:
+        things_cli.error("export: --limit and --offset would skip changes")
+    if things_cli.print_opml or things_cli.print_gantt:
+        things_cli.error("export: -o and -g cannot show deleted tasks, use -j or -c")
+    if things_cli.selected_format() is None:
+        things_cli.print_jsonl = True
+    directory = os.path.dirname(args.checkpoint)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint, things_cli.database)
+    try:
+        things_cli.print_tasks(checkpoint.changes())
+        things_cli.stream.flush()
+        checkpoint.commit()
+    finally:
+        checkpoint.close()
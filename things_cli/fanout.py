@@ -0,0 +1,170 @@
+"""Run a command on several Things databases at once."""
+
+# `-d` can be repeated and takes glob patterns, for example `-d
+# 'backups/*.sqlite'`. With more than one database, the command runs for each of
+# them in a pool of processes (at most `--workers`) and the results are merged
+# in the order of the databases: tasks as one section per database, `{"title":
+# ..., "database": ..., "items": [...]}`, and statistics and CSV as one table
+# with an additional `database` column. A database that fails gets a section
+# with an `error` instead of items, its error is reported on the error stream,
+# and the exit status is 1.
+
+import glob
+import io
+import os
+import sys
+
+from things_cli.cache import SERVICE_COMMANDS
+
+
+def expand(patterns):
+    """Return the databases of paths and glob patterns, without duplicates."""
+    databases = []
+    for pattern in patterns or []:
+        pattern = os.path.expanduser(pattern)
+        if glob.has_magic(pattern):
+            databases += sorted(glob.glob(pattern))
+        else:
+            databases.append(pattern)
+    return list(dict.fromkeys(databases))
+
+
+def requested(args):
+    """Return whether a command line names more than one database."""
+    patterns = args.databases or []
+    return len(patterns) > 1 or any(map(glob.has_magic, patterns))
+
+
+def source_cli(app, database, errors):
+    """Return a command line app keeping what it would print for the merge."""
+    # `app` is the class of the app of the command line (ThingsCLI), which
+    # imports this module
+
+    class SourceCLI(app):
+        """Command line app of one database."""
+
+        result = None
+
+        def print_tasks(self, tasks, default_sort=None):
+            """Keep the selected tasks."""
+            tasks = list(self.select(tasks, self.sort or default_sort))
+            if self.only_projects:
+                self.prune_projects(tasks)
+            self.result = {"tasks": tasks}
+
+        def print_table(self, columns, rows):
+            """Keep the columns and rows."""
+            self.result = {"columns": columns, "rows": rows}
+
+    return SourceCLI(database=database, output=io.StringIO(), errors=errors)
+
+
+def run(app, args, database):
+    """Run a parsed command line on one database, return its result."""
+    # This runs in a worker process; errors are returned, not raised.
+    args.database = database
+    args.databases = None
+    # The cache would print directly, timings are those of the whole run
+    args.no_cache = True
+    args.timings = False
+    args.profile = None
+
+    errors = io.StringIO()
+    things_cli = source_cli(app, database, errors)
+    try:
+        things_cli.main(args)
+    except SystemExit as error:
+        if error.code:
+            return {"error": errors.getvalue().strip() or f"exit {error.code}"}
+    except Exception as error:  # pylint: disable=broad-except
+        return {"error": f"{type(error).__name__}: {error}"}
+    return things_cli.result or {"tasks": []}
+
+
+def merge(databases, results):
+    """Return the merged tasks or the merged table of the results."""
+    tables = [result for result in results if "columns" in result]
+    if not tables:
+        return [
+            {
+                "title": database,
+                "database": database,
+                **({"error": result["error"]} if "error" in result else {}),
+                "items": result.get("tasks", []),
+            }
+            for database, result in zip(databases, results)
+        ], None
+    columns = ["database", *tables[0]["columns"]]
+    rows = [
+        {"database": database, **row}
+        for database, result in zip(databases, results)
+        for row in result.get("rows", [])
+    ]
+    return rows, columns
+
+
+def write_csv(things_cli, databases, results):
+    """Print the tasks of all databases as one CSV table with their database."""
+    fieldnames = things_cli.csv_fieldnames()
+    if not things_cli.fields:
+        fieldnames = ["database", *fieldnames]
+    writer = things_cli.csv_writer(things_cli.stream, fieldnames)
+    writer.writeheader()
+    for database, result in zip(databases, results):
+        writer.writerows(
+            dict(row.items(), database=database)
+            for row in things_cli.csv_rows(result.get("tasks", []))
+        )
+    things_cli.stream.write("\n")
+
+
+def fanout(things_cli, args):
+    """Run a command on all databases of the command line and print the merge."""
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+    import copy
+
+    if args.command in SERVICE_COMMANDS:
+        things_cli.error(f"command '{args.command}' does not support several databases")
+    databases = expand(args.databases)
+    if not databases:
+        things_cli.error(f"no database matches {args.databases}")
+
+    app = type(things_cli)
+    workers = min(args.workers or os.cpu_count() or 1, len(databases))
+    if workers <= 1:
+        results = [run(app, copy.copy(args), database) for database in databases]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    run, [app] * len(databases), [args] * len(databases), databases
+                )
+            )
+
+    failed = False
+    for database, result in zip(databases, results):
+        if "error" in result:
+            failed = True
+            print(
+                f"things-cli: {database}: {result['error']}",
+                file=things_cli.error_stream,
+            )
+
+    # Each database already ordered, paged and pruned its own tasks
+    args = copy.copy(args)
+    args.limit = args.offset = args.sort = None
+    args.only_projects = False
+    things_cli.configure(args)
+    things_cli.database = None
+    merged, columns = merge(databases, results)
+    if columns is None and things_cli.print_csv:
+        write_csv(things_cli, databases, results)
+    elif columns is None:
+        things_cli.print_tasks(merged)
+    else:
+        from things_cli import stats
+
+        stats.show(things_cli, args.command, columns, merged)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,267 @@
+"""Compact in-memory model of the tasks, areas and tags of things.py."""
+
+# things.py returns every task as a dict with its own hash table of repeated
+# string keys. The records here keep the same fields in slots instead, share
+# repeated strings such as titles of projects and areas, and behave like
+# read-only dicts (`get`, `[]`, `in`, `items`), so the renderers work on both.
+# `to_dict` returns the original dict shape.
+
+import sys
+
+
+class Missing:  # pylint: disable=too-few-public-methods
+    """Marker of a field that the dict of things.py does not have."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        """Represent the marker."""
+        return "MISSING"
+
+
+MISSING = Missing()
+
+
+def make_fields(names):
+    """Map field names to slot names."""
+    # Slots get a leading underscore, a slot `items` would hide `Record.items`.
+    return {name: f"_{name}" for name in names}
+
+
+class Record:
+    """Dict-like record with a fixed, ordered set of fields."""
+
+    # Subclasses list their fields in the key order of things.py; keys unknown
+    # to the subclass are kept in `extra`.
+
+    __slots__ = ("extra",)
+    fields: dict = {}
+    interned: frozenset = frozenset()
+
+    def __init__(self, data):
+        """Copy the fields of a dict, converting nested lists of dicts."""
+        self.extra = None
+        for slot in self.fields.values():
+            setattr(self, slot, MISSING)
+        for key, value in data.items():
+            if isinstance(value, list):
+                value = from_dicts(value)
+            elif key in self.interned and isinstance(value, str):
+                value = sys.intern(value)
+            self[key] = value
+
+    def __getitem__(self, key):
+        """Return the value of a field like `dict[key]`."""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """Set the value of a field like `dict[key] = value`."""
+        slot = self.fields.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        """Return whether the record has a field."""
+        return self.get(key, MISSING) is not MISSING
+
+    def __iter__(self):
+        """Iterate over the keys like a dict."""
+        return iter(self.keys())
+
+    def __len__(self):
+        """Return the number of keys."""
+        return len(self.keys())
+
+    def __eq__(self, other):
+        """Compare with records and dicts by content."""
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        """Represent the record like its dict."""
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def pop(self, key, default=MISSING):
+        """Remove a field and return its value like `dict.pop`."""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            if default is MISSING:
+                raise KeyError(key)
+            return default
+        slot = self.fields.get(key)
+        if slot is not None:
+            setattr(self, slot, MISSING)
+        else:
+            del self.extra[key]
+        return value
+
+    def copy(self):
+        """Return a shallow copy like `dict.copy`."""
+        record = type(self).__new__(type(self))
+        record.extra = None if self.extra is None else dict(self.extra)
+        for slot in self.fields.values():
+            setattr(record, slot, getattr(self, slot))
+        return record
+
+    def get(self, key, default=None):
+        """Return the value of a field or `default` like `dict.get`."""
+        slot = self.fields.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return default if value is MISSING else value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def keys(self):
+        """Return the keys in the order of things.py."""
+        return [key for key, _value in self.items()]
+
+    def values(self):
+        """Return the values in the order of the keys."""
+        return [value for _key, value in self.items()]
+
+    def items(self):
+        """Return the (key, value) pairs in the order of things.py."""
+        pairs = [
+            (field, getattr(self, slot))
+            for field, slot in self.fields.items()
+            if getattr(self, slot) is not MISSING
+        ]
+        if self.extra is not None:
+            pairs.extend(self.extra.items())
+        return pairs
+
+    def to_dict(self):
+        """Return the dict things.py returned, including nested records."""
+        return {
+            key: [to_dict(item) for item in value] if isinstance(value, list) else value
+            for key, value in self.items()
+        }
+
+
+class Task(Record):
+    """To-do, project or heading."""
+
+    fields = make_fields(
+        [
+            "uuid",
+            "type",
+            "trashed",
+            "title",
+            "status",
+            "area",
+            "area_title",
+            "project",
+            "project_title",
+            "heading",
+            "heading_title",
+            "notes",
+            "tags",
+            "start",
+            "checklist",
+            "start_date",
+            "deadline",
+            "stop_date",
+            "created",
+            "modified",
+            "index",
+            "today_index",
+            "items",
+        ]
+    )
+    __slots__ = tuple(fields.values())
+    interned = frozenset(
+        [
+            "type",
+            "status",
+            "area",
+            "area_title",
+            "project",
+            "project_title",
+            "heading",
+            "heading_title",
+            "start",
+            "start_date",
+            "deadline",
+        ]
+    )
+
+
+class ChecklistItem(Record):
+    """Item of the checklist of a to-do."""
+
+    fields = make_fields(
+        ["title", "status", "stop_date", "type", "uuid", "created", "modified"]
+    )
+    __slots__ = tuple(fields.values())
+    interned = frozenset(["status", "type"])
+
+
+class Area(Record):
+    """Area of responsibility."""
+
+    fields = make_fields(["uuid", "type", "title", "tags", "items"])
+    __slots__ = tuple(fields.values())
+    interned = frozenset(["type"])
+
+
+class Tag(Record):
+    """Tag of tasks and areas."""
+
+    fields = make_fields(["uuid", "type", "title", "shortcut", "items"])
+    __slots__ = tuple(fields.values())
+    interned = frozenset(["type"])
+
+
+class Section(Record):
+    """Titled list of tasks, such as a list of the `all` command."""
+
+    fields = make_fields(["title", "items"])
+    __slots__ = tuple(fields.values())
+
+
+RECORD_TYPES = {
+    "to-do": Task,
+    "project": Task,
+    "heading": Task,
+    "checklist-item": ChecklistItem,
+    "area": Area,
+    "tag": Tag,
+    None: Section,
+}
+
+
+def from_dict(data):
+    """Return the record of a dict of things.py."""
+    return RECORD_TYPES.get(data.get("type"), Section)(data)
+
+
+def from_dicts(values):
+    """Convert a list of dicts to records in place and return it."""
+    # Each dict is replaced as soon as it is converted, so the dicts can be
+    # freed while the rest of the list is converted.
+    for position, value in enumerate(values):
+        if isinstance(value, dict):
+            values[position] = from_dict(value)
+    return values
+
+
+def to_dict(value):
+    """Return the dict of a record, other values unchanged."""
+    return value.to_dict() if isinstance(value, Record) else value
+
+
+def to_json(value):
+    """Serialize records for `json.dumps(..., default=to_json)`."""
+    if isinstance(value, Record):
+        return dict(value.items())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
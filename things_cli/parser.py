@@ -0,0 +1,443 @@
+"""Command line arguments of the CLI."""
+
+# The commands and options are defined here, apart from the commands themselves,
+# so completing a command line only needs this module (see
+# `things_cli.completion`).
+
+import argparse
+import os
+
+from things_cli import __version__
+
+
+# Lists of things.py shown by the commands of the same name
+LIST_COMMANDS = [
+    ("inbox", "Shows inbox tasks"),
+    ("today", "Shows todays tasks"),
+    ("upcoming", "Shows upcoming tasks"),
+    ("anytime", "Shows anytime tasks"),
+    ("completed", "Shows completed tasks"),
+    ("someday", "Shows someday tasks"),
+    ("canceled", "Shows canceled tasks"),
+    ("trash", "Shows trashed tasks"),
+    ("todos", "Shows all todos"),
+    ("all", "Shows all tasks"),
+    ("areas", "Shows all areas"),
+    ("projects", "Shows all projects"),
+    ("logbook", "Shows completed tasks"),
+    ("logtoday", "Shows tasks completed today"),
+    ("createdtoday", "Shows tasks created today"),
+    ("tags", "Shows all tags ordered by their usage"),
+    ("deadlines", "Shows tasks with due dates"),
+]
+
+# Statistics commands converted from things.sh (see things_cli/stats.py)
+STATISTICS_COMMANDS = [
+    ("stat", "Provides a number of statistics"),
+    ("statcsv", "Exports some statistics as CSV"),
+    ("mostClosed", "Shows days when most tasks were closed"),
+    ("mostCancelled", "Shows days when most tasks were cancelled"),
+    ("mostTrashed", "Shows days when most tasks were trashed"),
+    ("mostCreated", "Shows days when most tasks were created"),
+    ("mostTasks", "Shows projects that have most tasks"),
+    ("mostCharacters", "Shows tasks that have most characters"),
+    ("hours", "Shows hours planned today"),
+    ("empty", "Shows projects that are empty"),
+]
+
+# Rows read at a time when a list is streamed (see things_cli/stream.py)
+CHUNK_SIZE = 1000
+
+
+class DatabaseAction(argparse.Action):
+    """Keep every `-d` in `databases` and the last one in `database`."""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """Add a database."""
+        namespace.databases = [*(namespace.databases or []), values]
+        setattr(namespace, self.dest, values)
+
+
+def make_parser():
+    """Create command line argument parser."""
+    parser = argparse.ArgumentParser(description="Simple read-only Thing 3 CLI.")
+
+    subparsers = parser.add_subparsers(
+        help="", metavar="command", required=True, dest="command"
+    )
+    completed = add_commands(subparsers)
+
+    ################################
+    # To be converted from https://github.com/alexanderwillner/things.sh
+    ################################
+    # parser.add_argument("-a", "--anonymize",
+    #                     action="store_true", default=False,
+    #                     help="anonymize output", dest="anonymize")
+
+    completed.update(add_filters(parser))
+    add_output_options(parser)
+    add_run_options(parser)
+
+    if "_ARGCOMPLETE" in os.environ:
+        # pylint: disable=import-outside-toplevel
+        import argcomplete  # type: ignore
+
+        from things_cli.completion import Completers
+
+        completers = Completers()
+        for name, action in completed.items():
+            action.completer = getattr(completers, name)
+        # Completers need the database of `-d`
+        argcomplete.safe_actions.add(DatabaseAction)
+        argcomplete.autocomplete(parser, validator=completers.validate)
+
+    return parser
+
+
+def add_commands(subparsers):
+    """Add the commands, return the completed arguments by completer."""
+
+    ################################
+    # Core database methods
+    ################################
+    for name, description in LIST_COMMANDS:
+        subparsers.add_parser(name, help=description)
+    for name, description in STATISTICS_COMMANDS:
+        stats_parser = subparsers.add_parser(name, help=description)
+        if name == "hours":
+            continue
+        stats_parser.add_argument(
+            "--since",
+            metavar="YYYY-MM-DD",
+            help="count from this day on",
+            dest="since",
+        )
+        stats_parser.add_argument(
+            "--until",
+            metavar="YYYY-MM-DD",
+            help="count up to this day",
+            dest="until",
+        )
+
+    ################################
+    # Additional functions
+    ################################
+    subparsers.add_parser("feedback", help="Give feedback")
+    subparsers.add_parser("cachestats", help="Shows cache statistics")
+    serve_parser = subparsers.add_parser(
+        "serve", help="Answers commands over a local socket"
+    )
+    serve_parser.add_argument("--socket", help="path of the Unix socket", dest="socket")
+    serve_parser.add_argument(
+        "--http",
+        type=int,
+        help="serve HTTP on this loopback port instead",
+        dest="http",
+    )
+    serve_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=60.0,
+        help="close connections idle for this many seconds",
+        dest="idle_timeout",
+    )
+    search_parser = subparsers.add_parser("search", help="Searches for a specific task")
+    completed = {
+        "search": search_parser.add_argument("string", help="String to search for")
+    }
+    search_parser.add_argument(
+        "--limit",
+        type=int,
+        default=argparse.SUPPRESS,
+        help="show at most this many tasks",
+        dest="limit",
+    )
+    add_file_commands(subparsers)
+
+    ################################
+    # To be implemented in things.py
+    ################################
+    # subparsers.add_parser("repeating", help="Shows all repeating tasks")
+    # subparsers.add_parser("subtasks", help="Shows all subtasks")
+    # subparsers.add_parser("headings", help="Shows headings")
+
+    ################################
+    # To be converted from https://github.com/alexanderwillner/things.sh
+    ################################
+    # subparsers.add_parser("backlog", help="Shows backlog tasks")
+    # subparsers.add_parser("ical", help="Shows tasks ordered by due date as iCal")
+    # subparsers.add_parser("lint", help="Shows tasks that float around")
+    # subparsers.add_parser("nextish", help="Shows all nextish tasks")
+    # subparsers.add_parser("old", help="Shows all old tasks")
+    # subparsers.add_parser("schedule", help="Schedules an event using a template")
+    # subparsers.add_parser("tag", help="Shows all tasks with the waiting for tag")
+    # subparsers.add_parser(
+    #     "waiting", help="Shows all tasks with the waiting for tag"
+    # )
+
+    return completed
+
+
+def add_file_commands(subparsers):
+    """Add the commands that read or write files."""
+    subparsers.add_parser(
+        "index", help="Builds or updates the full-text search index"
+    ).add_argument(
+        "--rebuild",
+        action="store_true",
+        help="index all tasks again",
+        dest="rebuild",
+    )
+    subparsers.add_parser(
+        "snapshot", help="Writes a denormalized, indexed copy of the database"
+    ).add_argument("path", help="file to write the snapshot to")
+    subparsers.add_parser(
+        "export", help="Exports the changes since the last export as JSON Lines"
+    ).add_argument(
+        "checkpoint", help="file with the state of the last export (updated)"
+    )
+    batch_parser = subparsers.add_parser(
+        "batch", help="Runs command lines from a file as JSON records"
+    )
+    batch_parser.add_argument(
+        "file",
+        nargs="?",
+        default="-",
+        help="file with one command line per line (default: stdin)",
+    )
+    batch_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of command lines to run concurrently",
+        dest="jobs",
+    )
+    watch_parser = subparsers.add_parser(
+        "watch", help="Shows changes to the result of a command as JSON lines"
+    )
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between checks for writes if they cannot be awaited",
+        dest="interval",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.2,
+        help="seconds without writes before the command is run again",
+        dest="debounce",
+    )
+    watch_parser.add_argument(
+        "--skip-initial",
+        action="store_true",
+        help="do not show the current result as added tasks",
+        dest="skip_initial",
+    )
+    watch_parser.add_argument(
+        "watched",
+        nargs=argparse.REMAINDER,
+        help="command to watch, global options go before `watch`",
+    )
+
+
+def add_filters(parser):
+    """Add the filters, return the completed arguments by completer."""
+    completed = {}
+    completed["projects"] = parser.add_argument(
+        "-p",
+        "--filter-project",
+        dest="filter_project",
+        help="filter by project (UUID)",
+    )
+    completed["areas"] = parser.add_argument(
+        "-a", "--filter-area", dest="filter_area", help="filter by area (UUID)"
+    )
+    completed["tags"] = parser.add_argument(
+        "-t", "--filtertag", dest="filter_tag", help="filter by tag"
+    )
+    parser.add_argument(
+        "-e",
+        "--only-projects",
+        action="store_true",
+        default=False,
+        dest="only_projects",
+        help="export only projects",
+    )
+    return completed
+
+
+def add_output_options(parser):
+    """Add the options of the output format."""
+    parser.add_argument(
+        "-o",
+        "--opml",
+        action="store_true",
+        default=False,
+        help="output as OPML",
+        dest="opml",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--json",
+        action="store_true",
+        default=False,
+        help="output as JSON",
+        dest="json",
+    )
+
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        default=False,
+        help="output as JSON Lines (one task per line)",
+        dest="jsonl",
+    )
+
+    parser.add_argument(
+        "--flatten",
+        action="store_true",
+        default=False,
+        help="flatten recursive JSON Lines output (adds parent_uuid and depth)",
+        dest="flatten",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--csv",
+        action="store_true",
+        default=False,
+        help="output as CSV",
+        dest="csv",
+    )
+
+    parser.add_argument(
+        "--fields",
+        help="comma-separated list of fields of CSV, JSON and JSON Lines output",
+        dest="fields",
+    )
+
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="show at most this many tasks (per list for `all`)",
+        dest="limit",
+    )
+
+    parser.add_argument(
+        "--offset",
+        type=int,
+        help="skip this many tasks",
+        dest="offset",
+    )
+
+    parser.add_argument(
+        "--sort",
+        help="order tasks by a field, prefix `-` for descending (--sort=-created)",
+        dest="sort",
+    )
+
+    parser.add_argument(
+        "-g",
+        "--gantt",
+        action="store_true",
+        default=False,
+        help="output as mermaid-js GANTT",
+        dest="gantt",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        help="in-depth output",
+        dest="recursive",
+        default=False,
+        action="store_true",
+    )
+
+
+def add_run_options(parser):
+    """Add the options of the database, the resources and reports of a run."""
+    parser.add_argument(
+        "-d",
+        "--database",
+        action=DatabaseAction,
+        help="set path to database (repeat or use a glob for several)",
+        dest="database",
+    )
+    parser.set_defaults(databases=None)
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="maximum number of concurrent queries or databases "
+        "(1 disables concurrency)",
+        dest="workers",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        metavar="ROWS",
+        help="rows read at a time when a list is streamed to the output "
+        f"(default: {CHUNK_SIZE})",
+        dest="chunk_size",
+        default=CHUNK_SIZE,
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        metavar="MB",
+        help="shrink the chunks of streamed lists to stay below this "
+        "resident memory, fail if impossible (Linux and macOS)",
+        dest="max_memory",
+    )
+
+    parser.add_argument(
+        "--mmap-size",
+        type=int,
+        metavar="MB",
+        help="memory-map up to this much of the database (default: 256)",
+        dest="mmap_size",
+    )
+
+    parser.add_argument(
+        "--page-cache",
+        type=int,
+        metavar="MB",
+        help="SQLite page cache of the read-only connections (default: 16)",
+        dest="page_cache",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        help="do not read or write the result cache",
+        dest="no_cache",
+        default=False,
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--timings",
+        help="report time per phase, queries and peak memory to stderr as JSON",
+        dest="timings",
+        default=False,
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write a cProfile dump of the run to FILE (see pstats)",
+        dest="profile",
+    )
+
+    parser.add_argument(
+        "--version",
+        "-v",
+        action="version",
+        version=f"%(prog)s (version {__version__})",
+    )
@@ -0,0 +1,281 @@
+"""Full-text search index of a Things database."""
+
+# The index is an FTS5 table in a sidecar database next to the result cache,
+# with one document per task made of its title, notes, checklist items and the
+# names of its project, heading and area. It is built by `things-cli index` and
+# brought up to date from the modification dates of tasks and checklist items
+# before every search. Without an index, the `search` command falls back to the
+# substring search of things.py.
+
+import hashlib
+import os
+import re
+import sqlite3
+
+from things_cli.cache import database_path, default_path
+
+
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(
+        title, notes, checklist, context,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, uuid TEXT UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS areas (uuid TEXT PRIMARY KEY, title TEXT)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)",
+]
+
+# Weights of title, notes, checklist and context for bm25()
+WEIGHTS = (10.0, 1.0, 2.0, 1.0)
+
+# A quoted phrase or a bare word, either optionally followed by `*`
+TOKEN = re.compile(r'"[^"]*"\*?|[^\s"]+')
+
+OPERATORS = ["AND", "OR", "NOT"]
+
+MODIFIED = "IFNULL({0}.userModificationDate, IFNULL({0}.creationDate, 0))"
+
+DOCUMENT_SQL = """
+    INSERT INTO documents (rowid, title, notes, checklist, context)
+    SELECT
+        docs.id,
+        TASK.title,
+        TASK.notes,
+        (
+            SELECT group_concat(ITEM.title, ' ')
+            FROM things.TMChecklistItem ITEM
+            WHERE ITEM.task = TASK.uuid
+        ),
+        IFNULL(PROJECT.title, '') || ' ' || IFNULL(HEADING.title, '') || ' '
+        || IFNULL(PROJECT_OF_HEADING.title, '') || ' ' || IFNULL(AREA.title, '')
+    FROM changed
+    JOIN docs ON docs.uuid = changed.uuid
+    JOIN things.TMTask TASK ON TASK.uuid = changed.uuid
+    LEFT JOIN things.TMTask PROJECT ON TASK.project = PROJECT.uuid
+    LEFT JOIN things.TMTask HEADING ON TASK.heading = HEADING.uuid
+    LEFT JOIN things.TMTask PROJECT_OF_HEADING
+        ON HEADING.project = PROJECT_OF_HEADING.uuid
+    LEFT JOIN things.TMArea AREA ON TASK.area = AREA.uuid
+    """
+
+
+def index_path(filepath=None):
+    """Return the path of the search index of a Things database."""
+    digest = hashlib.sha1(database_path(filepath).encode()).hexdigest()[:16]
+    return os.path.join(os.path.dirname(default_path()), f"search-{digest}.sqlite")
+
+
+def make_query(string):
+    """Turn a search string into an FTS5 query."""
+    # Words match as prefixes if they end with `*`, text in double quotes
+    # matches as a phrase, and AND, OR and NOT between two other terms are kept
+    # as operators. Everything else is quoted, including operators at the start
+    # or end or next to another operator, so that any input is a valid query.
+    terms = []
+    for token in TOKEN.findall(string):
+        if token in OPERATORS:
+            terms.append(token)
+            continue
+        prefix = token.endswith("*")
+        words = token.rstrip("*").strip('"')
+        if words:
+            terms.append(f'"{words}"' + ("*" if prefix else ""))
+    operands = [term not in OPERATORS for term in terms]
+    for position, term in enumerate(terms):
+        between = 0 < position < len(terms) - 1
+        if not operands[position] and not (
+            between and operands[position - 1] and operands[position + 1]
+        ):
+            terms[position] = f'"{term}"'
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """FTS5 index of the tasks of a Things database."""
+
+    def __init__(self, filepath=None, path=None):
+        """Open (and create) the index and attach the Things database."""
+        self.filepath = database_path(filepath)
+        self.path = path or index_path(filepath)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # URI filenames are needed to attach the Things database read-only
+        self.connection = sqlite3.connect(f"file:{self.path}", uri=True, timeout=1)
+        self.connection.execute(
+            "ATTACH DATABASE ? AS things", (f"file:{self.filepath}?mode=ro",)
+        )
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        """Close the index."""
+        self.connection.close()
+
+    def update(self, rebuild=False):
+        """Index tasks changed since the last update, return their number."""
+        execute = self.connection.execute
+        with self.connection:
+            if rebuild:
+                for table in ["documents", "docs", "areas", "meta"]:
+                    execute(f"DELETE FROM {table}")  # nosec
+            row = execute("SELECT value FROM meta WHERE key = 'modified'").fetchone()
+            since = row[0] if row else -1
+
+            execute("CREATE TEMP TABLE IF NOT EXISTS changed (uuid TEXT PRIMARY KEY)")
+            execute("DELETE FROM changed")
+            # Tasks and checklist items modified since the last update
+            execute(
+                f"""
+                INSERT OR IGNORE INTO changed
+                SELECT uuid FROM things.TMTask TASK WHERE {MODIFIED.format("TASK")} > ?
+                UNION
+                SELECT task FROM things.TMChecklistItem ITEM
+                WHERE {MODIFIED.format("ITEM")} > ?
+                """,
+                (since, since),
+            )
+            # Deleted tasks
+            execute("""
+                INSERT OR IGNORE INTO changed
+                SELECT uuid FROM docs
+                WHERE uuid NOT IN (SELECT uuid FROM things.TMTask)
+                """)
+            # Tasks whose project, heading or area was renamed or deleted
+            execute("""
+                INSERT OR IGNORE INTO changed
+                SELECT TASK.uuid FROM things.TMTask TASK
+                WHERE TASK.project IN (SELECT uuid FROM changed)
+                OR TASK.heading IN (SELECT uuid FROM changed)
+                OR TASK.heading IN (
+                    SELECT HEADING.uuid FROM things.TMTask HEADING
+                    WHERE HEADING.project IN (SELECT uuid FROM changed)
+                )
+                OR TASK.area IN (
+                    SELECT AREA.uuid FROM things.TMArea AREA
+                    LEFT JOIN areas ON areas.uuid = AREA.uuid
+                    WHERE areas.title IS NOT AREA.title
+                )
+                """)
+            execute("""
+                DELETE FROM documents
+                WHERE rowid IN (
+                    SELECT id FROM docs WHERE uuid IN (SELECT uuid FROM changed)
+                )
+                """)
+            execute("DELETE FROM docs WHERE uuid IN (SELECT uuid FROM changed)")
+            execute("""
+                INSERT INTO docs (uuid)
+                SELECT uuid FROM changed
+                WHERE uuid IN (SELECT uuid FROM things.TMTask)
+                """)
+            execute(DOCUMENT_SQL)
+            execute("DELETE FROM areas")
+            execute("INSERT INTO areas SELECT uuid, title FROM things.TMArea")
+            execute(f"""
+                INSERT OR REPLACE INTO meta
+                SELECT 'modified', MAX(IFNULL(task, -1), IFNULL(item, -1))
+                FROM (SELECT MAX({MODIFIED.format("TASK")}) AS task
+                      FROM things.TMTask TASK),
+                     (SELECT MAX({MODIFIED.format("ITEM")}) AS item
+                      FROM things.TMChecklistItem ITEM)
+                """)
+            return execute("SELECT COUNT(*) FROM changed").fetchone()[0]
+
+    def search(self, string):
+        """Return the uuids of the tasks matching `string`, best match first."""
+        query = make_query(string)
+        if not query:
+            return []
+        rows = self.connection.execute(
+            f"""
+            SELECT docs.uuid FROM documents
+            JOIN docs ON docs.id = documents.rowid
+            WHERE documents MATCH ?
+            ORDER BY bm25(documents, {", ".join(map(str, WEIGHTS))})
+            """,
+            (query,),
+        )
+        return [uuid for (uuid,) in rows]
+
+
+def fetch(database, uuids, include_items=False):
+    """Return the tasks `things.search` would find among `uuids`, in that order."""
+    # Like things.py, only incomplete tasks outside of the trash and without a
+    # trashed project are returned.
+    # pylint: disable=import-outside-toplevel
+    import json
+
+    import things as api
+    import things.database
+
+    where = f"""
+        TASK.{things.database.IS_NOT_RECURRING}
+        AND TASK.{things.database.TRASHED_TO_FILTER[False]}
+        {things.database.make_truthy_filter("PROJECT.trashed", False)}
+        {things.database.make_truthy_filter("PROJECT_OF_HEADING.trashed", False)}
+        AND TASK.{things.database.STATUS_TO_FILTER["incomplete"]}
+        AND TASK.uuid IN (SELECT value FROM json_each(?))
+        """
+    rows = database.execute_query(
+        things.database.make_tasks_sql_query(where), (json.dumps(uuids),)
+    )
+    order = {uuid: position for position, uuid in enumerate(uuids)}
+    rows.sort(key=lambda task: order[task["uuid"]])
+
+    result = []
+    for task in rows:
+        if include_items:
+            # Fetching a single task includes its items like `tasks()` does
+            task = api.tasks(uuid=task["uuid"], database=database)
+        elif task.get("tags"):
+            task["tags"] = database.get_tags(task=task["uuid"])
+        result.append(task)
+    return result
+
+
+def search(things_cli, string):
+    """Return the tasks found by the `search` command."""
+    # With an index, only as many tasks as the requested page needs are fetched,
+    # best match first.
+    # pylint: disable=import-outside-toplevel
+    import things as api
+
+    database = things_cli.open_database()
+    include_items = things_cli.include_items
+    path = index_path(things_cli.database)
+    if not os.path.exists(path):
+        return api.search(string, database=database, include_items=include_items)
+
+    index = SearchIndex(things_cli.database, path)
+    try:
+        index.update()
+        uuids = index.search(string)
+    finally:
+        index.close()
+    bound = None if things_cli.sort else things_cli.bound()
+    if bound is None:
+        return fetch(database, uuids, include_items)
+
+    # Matches that are completed or trashed are dropped, so fetch in chunks
+    result = []
+    chunk = max(2 * bound, 100)
+    for start in range(0, len(uuids), chunk):
+        result += fetch(database, uuids[start : start + chunk], include_items)
+        if len(result) >= bound:
+            break
+    return result[:bound]
+
+
+def build(things_cli, args):
+    """Build or update the search index for the `index` command."""
+    index = SearchIndex(things_cli.database)
+    try:
+        count = index.update(rebuild=args.rebuild)
+    finally:
+        index.close()
+    print(f"indexed {count} tasks in {index.path}", file=things_cli.stream)
@@ -0,0 +1,281 @@
+"""Resident server answering things-cli commands over a local socket."""
+
+# The server keeps the argument parser, the Things database objects and their
+# read-only connections in memory, so a request only pays for the query and the
+# rendering. Requests are JSON lines of the form `{"argv": [...], "cwd": ...}`;
+# the response is a sequence of JSON lines `{"stdout": ...}`, `{"stderr": ...}`
+# and finally `{"exit": status}`. Clients may send several requests per
+# connection. Relative paths of `-d` are resolved against the `cwd` of the
+# request.
+#
+# Any local process, and any web page a browser shows, can reach a local server.
+# The socket is only accessible to its owner, the HTTP server only accepts JSON
+# requests addressed to the loopback host (which browsers cannot send across
+# origins, also after DNS rebinding), and commands and options that write files
+# at paths of the request are rejected.
+
+from contextlib import redirect_stderr, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+
+from things_cli.cli import ThingsCLI
+from things_cli.client import default_socket_path
+from things_cli.connection import Pool, ReadOnlyDatabase
+
+
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+# Commands that make no sense inside a running server
+REJECTED_COMMANDS = ["serve", "feedback", "batch", "watch"]
+# Commands and options that write files, rejected in server mode
+WRITING_COMMANDS = ["index", "snapshot", "export"]
+WRITING_OPTIONS = {"profile": "--profile"}
+
+# Hosts of HTTP requests that are no DNS rebinding
+LOOPBACK_HOSTS = ["127.0.0.1", "localhost"]
+
+
+class MessageWriter:
+    """File object sending written text as JSON lines over a connection."""
+
+    def __init__(self, wfile, buffer_size=64 * 1024):
+        """Wrap a writable binary file object."""
+        self.wfile = wfile
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        """Buffer data and send it once the buffer is full."""
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def writelines(self, lines):
+        """Buffer lines."""
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Send buffered data."""
+        if self.buffer:
+            self.send({"stdout": "".join(self.buffer)})
+            self.buffer = []
+            self.size = 0
+
+    def send(self, message):
+        """Send a message."""
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+
+class ThingsServer:
+    """Run things-cli commands against resident database objects."""
+
+    mode = "server mode"
+    rejected_commands = REJECTED_COMMANDS + WRITING_COMMANDS
+    rejected_options = WRITING_OPTIONS
+
+    def __init__(self, database=None, idle_timeout=DEFAULT_IDLE_TIMEOUT, pool=None):
+        """Set up the parser, the default database and the shared connections."""
+        self.database = database
+        self.pool = pool or Pool()
+        self.idle_timeout = idle_timeout
+        self.parser = ThingsCLI.get_parser()
+        self.parser_lock = threading.Lock()
+        self.databases = {}
+        self.databases_lock = threading.Lock()
+
+    def get_database(self, filepath):
+        """Return the resident database object for a path."""
+        with self.databases_lock:
+            if filepath not in self.databases:
+                self.databases[filepath] = ReadOnlyDatabase(filepath, self.pool)
+            return self.databases[filepath]
+
+    def parse(self, argv, output, errors):
+        """Parse a command line, returning the arguments or an exit status."""
+        # argparse reports --help, --version and usage errors on the
+        # process-wide stdout/stderr, so parsing is serialized.
+        with self.parser_lock:
+            messages = io.StringIO()
+            try:
+                with redirect_stdout(messages), redirect_stderr(errors):
+                    return self.parser.parse_args(argv)
+            except SystemExit as error:
+                return error.code or 0
+            finally:
+                output.write(messages.getvalue())
+
+    def rejected(self, args):
+        """Return why a parsed command line is not run, or None."""
+        if args.command in self.rejected_commands:
+            return f"command '{args.command}' is not available in {self.mode}"
+        for option, name in self.rejected_options.items():
+            if getattr(args, option, None):
+                return f"option {name} is not available in {self.mode}"
+        return None
+
+    def run(self, argv, output, cwd=None):
+        """Run a command line, writing to `output`."""
+        # Relative database paths are resolved against `cwd` if given. Return
+        # the exit status and the error output.
+        errors = io.StringIO()
+        args = self.parse(argv, output, errors)
+        if isinstance(args, int):
+            return args, errors.getvalue()
+        reason = self.rejected(args)
+        if reason:
+            return 2, f"{reason}\n"
+        if cwd:
+            resolve_paths(args, cwd)
+
+        things_cli = ThingsCLI(database=self.database, output=output, errors=errors)
+        try:
+            things_cli.things_database = self.get_database(
+                args.database or self.database
+            )
+            things_cli.main(args)
+        except SystemExit as error:
+            status = error.code or 0
+            if not isinstance(status, int):
+                errors.write(f"{status}\n")
+                status = 1
+            return status, errors.getvalue()
+        except Exception as error:  # pylint: disable=broad-except
+            errors.write(f"{type(error).__name__}: {error}\n")
+            return 1, errors.getvalue()
+        return 0, errors.getvalue()
+
+    def serve_unix(self, path=None):
+        """Answer requests on a Unix socket until interrupted."""
+        path = path or default_socket_path()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        # The socket is created accessible to its owner only, not changed after
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixServer(path, UnixRequestHandler)
+        finally:
+            os.umask(umask)
+        with server:
+            server.things_server = self
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:  # pragma: no cover
+                pass
+            finally:
+                os.unlink(path)
+
+    def serve_http(self, port):
+        """Answer POST requests on a loopback HTTP port until interrupted."""
+        with ThreadingHTTPServer(("127.0.0.1", port), HTTPRequestHandler) as server:
+            server.things_server = self
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:  # pragma: no cover
+                pass
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server handling each connection in a thread."""
+
+    daemon_threads = True
+    things_server: ThingsServer
+
+
+class UnixRequestHandler(socketserver.StreamRequestHandler):
+    """Answer JSON line requests until the client disconnects or idles."""
+
+    def setup(self):
+        """Close connections that stay idle."""
+        self.timeout = self.server.things_server.idle_timeout  # type: ignore
+        super().setup()
+
+    def handle(self):
+        """Answer requests of one connection."""
+        things_server = self.server.things_server  # type: ignore
+        try:
+            for line in self.rfile:
+                request = json.loads(line)
+                writer = MessageWriter(self.wfile)
+                status, errors = things_server.run(
+                    request["argv"], writer, request.get("cwd")
+                )
+                writer.flush()
+                if errors:
+                    writer.send({"stderr": errors})
+                writer.send({"exit": status})
+        except (OSError, ValueError, KeyError):
+            pass  # idle timeout, client gone or malformed request
+
+
+class HTTPRequestHandler(BaseHTTPRequestHandler):
+    """Answer `POST /` with a JSON body `{"argv": [...], "cwd": ...}`."""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Run the command and respond with its output as JSON."""
+        things_server = self.server.things_server  # type: ignore
+        host, _, port = (self.headers.get("Host") or "").rpartition(":")
+        if host not in LOOPBACK_HOSTS or port != str(self.server.server_port):
+            self.send_error(403, "expected a request to the loopback address")
+            return
+        content_type = self.headers.get("Content-Type") or ""
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            self.send_error(415, "expected a JSON body")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            argv, cwd = request["argv"], request.get("cwd")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_error(400, "expected a JSON body with an argv list")
+            return
+        output = io.StringIO()
+        status, errors = things_server.run(argv, output, cwd)
+        body = json.dumps(
+            {"stdout": output.getvalue(), "stderr": errors, "exit": status}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests to stderr only when asked for."""
+        if os.getenv("THINGS_CLI_SERVER_LOG"):  # pragma: no cover
+            sys.stderr.write(format % args + "\n")
+
+
+def resolve_paths(args, cwd):
+    """Make the database paths of a command line absolute, relative to `cwd`."""
+    if args.database:
+        args.database = os.path.join(cwd, os.path.expanduser(args.database))
+    if args.databases:
+        args.databases = [
+            os.path.join(cwd, os.path.expanduser(pattern)) for pattern in args.databases
+        ]
+
+
+def serve(things_cli, args):
+    """Start the server for the `serve` command."""
+    things_server = ThingsServer(
+        things_cli.database,
+        args.idle_timeout,
+        Pool(things_cli.mmap_size, things_cli.page_cache),
+    )
+    if args.http:
+        things_server.serve_http(args.http)
+    else:
+        things_server.serve_unix(args.socket)
@@ -0,0 +1,190 @@
+"""Denormalized, indexed snapshot of a Things database."""
+
+# `things-cli snapshot PATH` copies the database with the SQLite backup API, so
+# the app is not blocked and the copy is consistent, and adds:
+#
+# - `snapshot_tasks`: every task with the titles of its project, heading and
+#   area and its tag titles as a JSON array, for analytics;
+# - `snapshot_lists`: the lists of the app (inbox, today, ...) in their order,
+#   each task as the JSON object things.py returned for the list;
+# - `snapshot_meta`: the source database and the date of the snapshot.
+#
+# The tables of the app are kept, so `-d PATH` works for every command. Commands
+# that show a whole list without filters or items are read from `snapshot_lists`
+# in one query while the snapshot is from the current day (Today and Upcoming
+# are relative to it). The snapshot has no write-ahead log and can be opened
+# read-only (`?mode=ro&immutable=1`).
+
+from datetime import datetime
+import json
+import os
+import sqlite3
+
+from things_cli.cache import database_path
+
+
+# Lists stored in the snapshot: commands and API functions of the same name
+LISTS = [
+    "inbox",
+    "today",
+    "upcoming",
+    "anytime",
+    "someday",
+    "logbook",
+    "trash",
+    "todos",
+    "projects",
+    "completed",
+    "canceled",
+    "deadlines",
+]
+
+TASKS_SQL = """
+    CREATE TABLE snapshot_tasks AS
+    SELECT
+        TASK.*,
+        PROJECT_OF_HEADING.uuid AS heading_project,
+        PROJECT_OF_HEADING.title AS heading_project_title,
+        (
+            SELECT json_group_array(title) FROM (
+                SELECT TAG.title FROM TMTaskTag TASK_TAG
+                JOIN TMTag TAG ON TAG.uuid = TASK_TAG.tags
+                WHERE TASK_TAG.tasks = TASK.uuid
+                ORDER BY TAG."index"
+            )
+        ) AS tag_titles
+    FROM ({tasks}) TASK
+    LEFT JOIN TMTask HEADING ON HEADING.uuid = TASK.heading
+    LEFT JOIN TMTask PROJECT_OF_HEADING ON PROJECT_OF_HEADING.uuid = HEADING.project
+    """
+
+SCHEMA = [
+    """
+    CREATE TABLE snapshot_lists (
+        list TEXT, position INTEGER, uuid TEXT, data TEXT,
+        PRIMARY KEY (list, position)
+    ) WITHOUT ROWID
+    """,
+    "CREATE TABLE snapshot_meta (key TEXT PRIMARY KEY, value)",
+]
+
+INDEXES = [
+    "CREATE UNIQUE INDEX snapshot_tasks_uuid ON snapshot_tasks (uuid)",
+    "CREATE INDEX snapshot_tasks_project ON snapshot_tasks (project)",
+    "CREATE INDEX snapshot_tasks_area ON snapshot_tasks (area)",
+    "CREATE INDEX snapshot_lists_uuid ON snapshot_lists (uuid)",
+]
+
+
+def today():
+    """Return the current local date like the snapshot stores it."""
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def write(source, path):
+    """Write a snapshot of the Things database `source` to `path`."""
+    # The snapshot is built next to `path` and moved there when complete.
+    # pylint: disable=import-outside-toplevel
+    import things as api
+    from things.database import make_tasks_sql_query
+
+    source = database_path(source)
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.unlink(partial)
+    connection = sqlite3.connect(partial)
+    try:
+        live = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        try:
+            live.backup(connection)
+        finally:
+            live.close()
+        connection.execute("PRAGMA journal_mode = DELETE")
+        with connection:
+            connection.execute(TASKS_SQL.format(tasks=make_tasks_sql_query()))
+            for statement in SCHEMA:
+                connection.execute(statement)
+        # The lists are read with things.py from the copy, not the live database
+        for name in LISTS:
+            rows = getattr(api, name)(filepath=partial)
+            with connection:
+                connection.executemany(
+                    "INSERT INTO snapshot_lists VALUES (?, ?, ?, ?)",
+                    (
+                        (name, position, row["uuid"], json.dumps(row))
+                        for position, row in enumerate(rows)
+                    ),
+                )
+        with connection:
+            for statement in INDEXES:
+                connection.execute(statement)
+            connection.executemany(
+                "INSERT INTO snapshot_meta VALUES (?, ?)",
+                [("source", source), ("date", today())],
+            )
+        connection.execute("VACUUM")
+    except BaseException:
+        # A failed snapshot leaves nothing behind
+        connection.close()
+        os.unlink(partial)
+        raise
+    finally:
+        connection.close()
+    os.replace(partial, path)
+
+
+def is_current(filepath):
+    """Return whether a database is a snapshot taken today."""
+    if not os.path.exists(filepath):
+        return False
+    connection = sqlite3.connect(f"file:{filepath}?mode=ro", uri=True)
+    try:
+        return snapshot_date(connection) == today()
+    finally:
+        connection.close()
+
+
+def snapshot_date(connection):
+    """Return the date of the snapshot of a connection, None for other databases."""
+    try:
+        date = connection.execute(
+            "SELECT value FROM snapshot_meta WHERE key = 'date'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return date[0] if date else None
+
+
+def read_list(filepath, name):
+    """Return a list of a snapshot taken today, or None if there is none."""
+    # None is returned for databases that are not snapshots.
+    rows = list_rows(filepath, name)
+    if rows is None:
+        return None
+    try:
+        return [json.loads(data) for (data,) in rows]
+    finally:
+        rows.connection.close()
+
+
+def list_rows(filepath, name):
+    """Return a cursor over the JSON tasks of a list of a snapshot taken today."""
+    # The caller closes the connection of the cursor. None is returned if there
+    # is no such list.
+    if name not in LISTS or not os.path.exists(filepath):
+        return None
+    connection = sqlite3.connect(f"file:{filepath}?mode=ro", uri=True)
+    if snapshot_date(connection) == today():
+        return connection.execute(
+            "SELECT data FROM snapshot_lists WHERE list = ? ORDER BY position",
+            (name,),
+        )
+    connection.close()
+    return None
+
+
+def snapshot(things_cli, args):
+    """Write a snapshot for the `snapshot` command."""
+    write(things_cli.database, args.path)
+    source = database_path(things_cli.database)
+    print(f"wrote snapshot of {source} to {args.path}", file=things_cli.stream)
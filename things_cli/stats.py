@@ -0,0 +1,283 @@
+"""Statistics of the tasks, counted by aggregate SQL queries."""
+
+# These are the statistics commands of things.sh. Each one is a single query
+# that groups and counts in SQLite, so no list of tasks is loaded. Dates are
+# local days. `--since` and `--until` bound the day each statistic is about: the
+# stop date of completed and canceled tasks, the modification date of trashed
+# tasks and the creation date otherwise. Ordering (`--sort`), `--limit` and
+# `--offset` are part of the query as well. The statistics cover the whole
+# database, filters (`-p`, `-a`, `-t`) are rejected.
+
+# The constants are read by shell completion (see things_cli/completion.py),
+# other modules are imported where they are needed.
+# pylint: disable=import-outside-toplevel
+
+
+# Statuses and types as stored by Things
+TODO = 0
+PROJECT = 1
+INCOMPLETE = 0
+CANCELED = 2
+COMPLETED = 3
+
+# Local day of a Unix time column
+DAY = "date(TASK.{0}, 'unixepoch', 'localtime')"
+
+# Rows of to-dos that count for statistics
+TODOS = f"TASK.type = {TODO} AND TASK.rt1_recurrenceRule IS NULL"
+OPEN = f"TASK.status = {INCOMPLETE} AND TASK.trashed = 0"
+
+
+def in_range(column):
+    """Return the condition that a Unix time column lies in the date range."""
+    return f"TASK.{column} >= :since AND TASK.{column} < :until"
+
+
+def days(column, where):
+    """Return the query of the days with most tasks by a Unix time column."""
+    return f"""
+        SELECT {DAY.format(column)} AS date, COUNT(*) AS count
+        FROM TMTask TASK
+        WHERE {TODOS} AND {where} AND {in_range(column)}
+        GROUP BY date
+        """
+
+
+# Columns and query of each command, with the ORDER BY clause of its rows
+STATISTICS = {
+    "stat": (
+        ["statistic", "count"],
+        f"""
+        SELECT STATISTIC.column2 AS statistic, CASE STATISTIC.column2
+            WHEN 'created' THEN created WHEN 'completed' THEN completed
+            WHEN 'canceled' THEN canceled WHEN 'trashed' THEN trashed
+            WHEN 'open' THEN open WHEN 'inbox' THEN inbox
+            WHEN 'anytime' THEN anytime WHEN 'someday' THEN someday
+            WHEN 'projects' THEN projects
+        END AS count, STATISTIC.column1 AS position
+        FROM (
+            SELECT
+                SUM({TODOS} AND {in_range("creationDate")}) AS created,
+                SUM({TODOS} AND TASK.status = {COMPLETED} AND {in_range("stopDate")})
+                AS completed,
+                SUM({TODOS} AND TASK.status = {CANCELED} AND {in_range("stopDate")})
+                AS canceled,
+                SUM({TODOS} AND TASK.trashed = 1
+                    AND {in_range("userModificationDate")}) AS trashed,
+                SUM({TODOS} AND {OPEN} AND {in_range("creationDate")}) AS open,
+                SUM({TODOS} AND {OPEN} AND TASK.start = 0
+                    AND {in_range("creationDate")}) AS inbox,
+                SUM({TODOS} AND {OPEN} AND TASK.start = 1
+                    AND {in_range("creationDate")}) AS anytime,
+                SUM({TODOS} AND {OPEN} AND TASK.start = 2
+                    AND {in_range("creationDate")}) AS someday,
+                SUM(TASK.type = {PROJECT} AND {OPEN}
+                    AND {in_range("creationDate")}) AS projects
+            FROM TMTask TASK
+        ), (
+            VALUES (1, 'created'), (2, 'completed'), (3, 'canceled'),
+                (4, 'trashed'), (5, 'open'), (6, 'inbox'), (7, 'anytime'),
+                (8, 'someday'), (9, 'projects')
+        ) AS STATISTIC
+        """,
+        "position",
+    ),
+    "statcsv": (
+        ["date", "created", "completed", "canceled", "trashed"],
+        f"""
+        SELECT date, SUM(created) AS created, SUM(completed) AS completed,
+            SUM(canceled) AS canceled, SUM(trashed) AS trashed
+        FROM (
+            SELECT {DAY.format("creationDate")} AS date,
+                1 AS created, 0 AS completed, 0 AS canceled, 0 AS trashed
+            FROM TMTask TASK WHERE {TODOS} AND {in_range("creationDate")}
+            UNION ALL
+            SELECT {DAY.format("stopDate")}, 0, TASK.status = {COMPLETED},
+                TASK.status = {CANCELED}, 0
+            FROM TMTask TASK
+            WHERE {TODOS} AND TASK.status IN ({COMPLETED}, {CANCELED})
+            AND {in_range("stopDate")}
+            UNION ALL
+            SELECT {DAY.format("userModificationDate")}, 0, 0, 0, 1
+            FROM TMTask TASK
+            WHERE {TODOS} AND TASK.trashed = 1 AND {in_range("userModificationDate")}
+        )
+        GROUP BY date
+        """,
+        '"date"',
+    ),
+    "mostClosed": (
+        ["date", "count"],
+        days("stopDate", f"TASK.status = {COMPLETED}"),
+        '"count" DESC, "date" DESC',
+    ),
+    "mostCancelled": (
+        ["date", "count"],
+        days("stopDate", f"TASK.status = {CANCELED}"),
+        '"count" DESC, "date" DESC',
+    ),
+    "mostTrashed": (
+        ["date", "count"],
+        days("userModificationDate", "TASK.trashed = 1"),
+        '"count" DESC, "date" DESC',
+    ),
+    "mostCreated": (
+        ["date", "count"],
+        days("creationDate", "TRUE"),
+        '"count" DESC, "date" DESC',
+    ),
+    "mostTasks": (
+        ["uuid", "title", "open", "total"],
+        f"""
+        SELECT PROJECT.uuid, PROJECT.title,
+            SUM(TASK.status = {INCOMPLETE}) AS open, COUNT(*) AS total
+        FROM TMTask TASK
+        LEFT JOIN TMTask HEADING ON HEADING.uuid = TASK.heading
+        JOIN TMTask PROJECT ON PROJECT.uuid = IFNULL(TASK.project, HEADING.project)
+        WHERE {TODOS} AND TASK.trashed = 0 AND PROJECT.trashed = 0
+        AND {in_range("creationDate")}
+        GROUP BY PROJECT.uuid
+        """,
+        '"open" DESC, "total" DESC',
+    ),
+    "mostCharacters": (
+        ["uuid", "title", "characters"],
+        f"""
+        SELECT TASK.uuid, TASK.title,
+            LENGTH(IFNULL(TASK.title, '')) + LENGTH(IFNULL(TASK.notes, ''))
+            AS characters
+        FROM TMTask TASK
+        WHERE {TODOS} AND TASK.trashed = 0 AND {in_range("creationDate")}
+        """,
+        '"characters" DESC, "title"',
+    ),
+    "hours": (
+        ["tasks", "estimated", "minutes", "hours"],
+        """
+        SELECT COUNT(*) AS tasks, COUNT(minutes) AS estimated,
+            IFNULL(SUM(minutes), 0) AS minutes,
+            ROUND(IFNULL(SUM(minutes), 0) / 60.0, 2) AS hours
+        FROM (
+            SELECT TODAY.value AS uuid, SUM(
+                CASE
+                    WHEN TAG.title GLOB '[0-9]*min' THEN CAST(TAG.title AS INTEGER)
+                    WHEN TAG.title GLOB '[0-9]*h' THEN CAST(TAG.title AS REAL) * 60
+                END
+            ) AS minutes
+            FROM json_each(:today) TODAY
+            LEFT JOIN TMTaskTag TASK_TAG ON TASK_TAG.tasks = TODAY.value
+            LEFT JOIN TMTag TAG ON TAG.uuid = TASK_TAG.tags
+            GROUP BY TODAY.value
+        )
+        """,
+        None,
+    ),
+    "empty": (
+        ["uuid", "title", "area_title", "created"],
+        f"""
+        SELECT TASK.uuid, TASK.title, AREA.title AS area_title,
+            datetime(TASK.creationDate, 'unixepoch', 'localtime') AS created
+        FROM TMTask TASK
+        LEFT JOIN TMArea AREA ON AREA.uuid = TASK.area
+        WHERE TASK.type = {PROJECT} AND TASK.status = {INCOMPLETE}
+        AND TASK.trashed = 0 AND {in_range("creationDate")}
+        AND NOT EXISTS (
+            SELECT 1 FROM TMTask ITEM
+            LEFT JOIN TMTask HEADING ON HEADING.uuid = ITEM.heading
+            WHERE ITEM.type = {TODO} AND ITEM.status = {INCOMPLETE}
+            AND ITEM.trashed = 0
+            AND (ITEM.project = TASK.uuid OR HEADING.project = TASK.uuid)
+        )
+        """,
+        '"created"',
+    ),
+}
+
+# Commands whose default output format is CSV
+CSV_COMMANDS = ["statcsv"]
+
+
+def parse_day(things_cli, option, value):
+    """Return the datetime of a YYYY-MM-DD day of `--since` or `--until`."""
+    from datetime import datetime
+
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return things_cli.error(f"{option}: invalid day {value!r}")
+
+
+def row_factory(cursor, row):
+    """Return a row as a dict of all its columns."""
+    # Unlike the rows of things.py, None values are kept and columns such as
+    # `trashed` are not turned into booleans.
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def order(sort, columns):
+    """Return the ORDER BY clause of a `--sort` field, or None if it is no column."""
+    # Rows without a value come last in both directions, like tasks.
+    column = sort.lstrip("-")
+    if column not in columns:
+        return None
+    direction = "DESC" if sort.startswith("-") else "ASC"
+    return f'"{column}" IS NULL, "{column}" {direction}'
+
+
+def query(things_cli, command, since=None, until=None):
+    """Return the columns and rows of a statistic."""
+    from datetime import timedelta
+    import json
+
+    import things as api
+
+    database = things_cli.open_database()
+    columns, sql, default_order = STATISTICS[command]
+    parameters = {
+        "since": since.timestamp() if since else 0,
+        "until": (until + timedelta(days=1)).timestamp() if until else 2**40,
+        "limit": -1 if things_cli.limit is None else things_cli.limit,
+        "offset": things_cli.offset or 0,
+    }
+    if command == "hours":
+        tasks = api.today(database=database)
+        parameters["today"] = json.dumps([task["uuid"] for task in tasks])
+
+    clauses = [default_order] if default_order else []
+    if things_cli.sort:
+        clause = order(things_cli.sort, columns)
+        if clause is None:
+            things_cli.error(
+                f"--sort: {command} has no column {things_cli.sort.lstrip('-')!r}"
+            )
+        # The default order is kept for ties
+        clauses.insert(0, clause)
+    sql = f"SELECT * FROM ({sql})"
+    if clauses:
+        sql += f" ORDER BY {', '.join(clauses)}"
+    sql += " LIMIT :limit OFFSET :offset"
+    return columns, database.execute_query(sql, parameters, row_factory=row_factory)
+
+
+def stats(things_cli, args):
+    """Print a statistic for one of the statistics commands."""
+    filters = [things_cli.filter_project, things_cli.filter_area, things_cli.filter_tag]
+    if any(filters):
+        things_cli.error(f"{args.command}: -p, -a and -t do not apply to statistics")
+    since = parse_day(things_cli, "--since", getattr(args, "since", None))
+    until = parse_day(things_cli, "--until", getattr(args, "until", None))
+    columns, rows = query(things_cli, args.command, since, until)
+    show(things_cli, args.command, columns, rows)
+
+
+def show(things_cli, command, columns, rows):
+    """Print the rows of a statistic in the selected output format."""
+    # Tables have no GANTT chart, they are shown as text or CSV instead
+    if command in CSV_COMMANDS and things_cli.selected_format() in [
+        None,
+        "print_gantt",
+    ]:
+        things_cli.print_csv = True
+    things_cli.print_table(columns, rows)
@@ -0,0 +1,274 @@
+"""Stream long lists from the database to the output in chunks."""
+
+# Lists that things.py reads with one query, or with two merged in a fixed order
+# like the Logbook, are read from the SQLite cursor `--chunk-size` rows at a
+# time instead of all at once. The tags of a chunk are resolved in one query and
+# its tasks are rendered before the next chunk is read, so the memory of a run
+# does not grow with the list. The output is the one of things.py. Lists are not
+# streamed where the output needs all of them first: with `-r`, `--sort`, `-e`
+# and Gantt charts, and for lists merged in Python (Today, Upcoming).
+#
+# With `--max-memory MB` the resident memory is checked after each chunk. Above
+# the ceiling the following chunks are half as large, and if it is still
+# exceeded with one row at a time the run fails. The resident memory is read
+# from /proc on Linux and from the Mach kernel on macOS, elsewhere the option
+# is rejected.
+
+import ctypes
+import itertools
+import json
+import os
+import sys
+
+import things.database
+
+from things_cli.snapshot import list_rows
+from things_cli.tree import TAGS_SQL, tuple_factory
+
+
+# Order of the rows of a list in things.py, for lists sorted in Python
+INDEX = '(SELECT "index" FROM TMTask WHERE uuid = TASK.uuid)'
+
+# Arguments of `things.tasks` for the queries of each list (see the
+# functions of `things.api`) and the ORDER BY of their merged rows
+STREAMS = {
+    "inbox": ([{"start": "Inbox"}], None),
+    "anytime": ([{"start": "Anytime"}], None),
+    "someday": ([{"start_date": False, "start": "Someday"}], None),
+    "trash": ([{"trashed": True, "context_trashed": None, "status": None}], None),
+    "todos": ([{"type": "to-do"}], None),
+    "projects": ([{"type": "project"}], None),
+    "completed": ([{"status": "completed"}], None),
+    "canceled": ([{"status": "canceled"}], None),
+    # Canceled before completed tasks of a day, like the stable sort of things.py
+    "logbook": (
+        [{"status": "canceled"}, {"status": "completed"}],
+        f'"stop_date" DESC, "status" = \'completed\', {INDEX}',
+    ),
+    "deadlines": ([{"deadline": True}], f'"deadline", {INDEX}'),
+}
+
+
+def streamed(things_cli, name):
+    """Return whether the list `name` can be streamed to the output."""
+    return (
+        name in STREAMS
+        and not things_cli.print_gantt
+        and not (things_cli.recursive or things_cli.sort or things_cli.only_projects)
+    )
+
+
+def query(name, filters):
+    """Return the query of the tasks of a list."""
+    arguments, order = STREAMS[name]
+    queries = [
+        tasks_query({"status": "incomplete", **filters, **list_arguments})
+        for list_arguments in arguments
+    ]
+    if order is None:
+        return queries[0]
+    rows = " UNION ALL ".join(f"SELECT * FROM ({sql})" for sql in queries)
+    return f"SELECT * FROM ({rows}) AS TASK ORDER BY {order}"
+
+
+def tasks_query(arguments):
+    """Return the query of `things.tasks` with the arguments of a list."""
+    # The predicate is the one `Database.get_tasks` of things.py builds for the
+    # arguments used by `STREAMS` and the filters.
+    project = arguments.get("project")
+    project_filter = things.database.make_or_filter(
+        things.database.make_filter("TASK.project", project),
+        things.database.make_filter("PROJECT_OF_HEADING.uuid", project),
+    )
+    context_trashed = arguments.get("context_trashed", False)
+    start_date = things.database.make_thingsdate_filter(
+        f"TASK.{things.database.DATE_START}", arguments.get("start_date")
+    )
+    deadline = things.database.make_thingsdate_filter(
+        f"TASK.{things.database.DATE_DEADLINE}", arguments.get("deadline")
+    )
+    predicate = f"""
+        TASK.{things.database.IS_NOT_RECURRING}
+        {task_filter(things.database.TRASHED_TO_FILTER, arguments.get("trashed", False))}
+        {things.database.make_truthy_filter("PROJECT.trashed", context_trashed)}
+        {things.database.make_truthy_filter("PROJECT_OF_HEADING.trashed", context_trashed)}
+        {task_filter(things.database.TYPE_TO_FILTER, arguments.get("type"))}
+        {task_filter(things.database.START_TO_FILTER, arguments.get("start"))}
+        {task_filter(things.database.STATUS_TO_FILTER, arguments.get("status"))}
+        {things.database.make_filter("TASK.area", arguments.get("area"))}
+        {project_filter}
+        {things.database.make_filter("TAG.title", arguments.get("tag"))}
+        {start_date}
+        {deadline}
+        """
+    return things.database.make_tasks_sql_query(predicate, 'TASK."index"')
+
+
+def task_filter(filters, value):
+    """Return the condition on a column of the task for a value, if any."""
+    condition = filters.get(value, "")
+    return condition and f"AND TASK.{condition}"
+
+
+def tasks(things_cli, name, defaults):
+    """Return an iterator over the tasks of a list, or None if it is not streamed."""
+    # The iterator is paged by `--offset` and `--limit`.
+    if not streamed(things_cli, name):
+        return None
+    filters = {key: defaults.get(key) for key in ["project", "area", "tag"]}
+    if not any(filters.values()) and things_cli.is_snapshot():
+        snapshot = list_rows(things_cli.database, name)
+        if snapshot is not None:
+            return page(things_cli, read_snapshot(things_cli, snapshot))
+    database = things_cli.open_database()
+    if filters["tag"] is not None:
+        things.database.validate(
+            "tag", filters["tag"], [None, *database.get_tags(titles_only=True)]
+        )
+    return page(things_cli, read(things_cli, database, query(name, filters)))
+
+
+def page(things_cli, chunks):
+    """Return the tasks of the chunks on the requested page, counting them."""
+    rows = itertools.islice(
+        itertools.chain.from_iterable(chunks),
+        things_cli.offset or 0,
+        things_cli.bound(),
+    )
+    if things_cli.timings:
+        rows = counted(things_cli.timings, rows)
+    return rows
+
+
+def counted(timings, rows):
+    """Yield the rows, counting them as the tasks shown."""
+    timings.tasks = 0
+    for row in rows:
+        timings.tasks += 1
+        yield row
+
+
+def read(things_cli, database, sql):
+    """Yield the rows of a query of tasks in chunks, with their tags."""
+    # The query keeps a connection of the pool of the database while it is read.
+    count = 0
+    with database.pool.connection(database.filepath) as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.row_factory = things.database.dict_factory
+            cursor.execute(sql)
+            for rows in chunked(things_cli, cursor):
+                count += len(rows)
+                resolve_tags(connection, things_cli, rows)
+                yield rows
+        finally:
+            # An unfinished query would keep its read transaction open
+            cursor.close()
+            if things_cli.timings:
+                things_cli.timings.count_query(count)
+
+
+def read_snapshot(things_cli, rows):
+    """Yield the tasks of a list of a snapshot in chunks."""
+    try:
+        for chunk in chunked(things_cli, rows):
+            yield [json.loads(data) for (data,) in chunk]
+    finally:
+        rows.connection.close()
+
+
+def chunked(things_cli, cursor):
+    """Yield the rows of a cursor in chunks of the current size."""
+    if things_cli.max_memory and rss() is None:
+        things_cli.error("--max-memory: the resident memory of this system is unknown")
+    size = max(1, things_cli.chunk_size)
+    stop = things_cli.bound()
+    if stop is not None:
+        size = max(1, min(size, stop))
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+        del rows
+        size = shrink(things_cli, size)
+
+
+def shrink(things_cli, size):
+    """Return the size of the next chunk under the `--max-memory` ceiling."""
+    if not things_cli.max_memory or rss() <= things_cli.max_memory * 2**20:
+        return size
+    if size == 1:
+        print(
+            f"things-cli: --max-memory: exceeded {things_cli.max_memory} MB",
+            file=things_cli.error_stream,
+        )
+        sys.exit(1)
+    return size // 2
+
+
+def resolve_tags(connection, things_cli, rows):
+    """Replace the `tags` flag of the tasks of a chunk by their tag titles."""
+    tagged = {}
+    for row in rows:
+        if row.get("tags"):
+            row["tags"] = []
+            tagged.setdefault(row["uuid"], []).append(row)
+    if not tagged:
+        return
+    cursor = connection.cursor()
+    cursor.row_factory = tuple_factory
+    tags = cursor.execute(TAGS_SQL["task"], (json.dumps(list(tagged)),)).fetchall()
+    for uuid, title in tags:
+        for row in tagged[uuid]:
+            row["tags"].append(title)
+    if things_cli.timings:
+        things_cli.timings.count_query(len(tags))
+
+
+def rss():
+    """Return the current resident set size of the process in bytes, or None."""
+    # The peak of `resource` never drops, so it cannot tell whether the
+    # smaller chunks helped.
+    if sys.platform == "darwin":
+        return mach_rss()
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MachTaskBasicInfo(ctypes.Structure):  # pylint: disable=too-few-public-methods
+    """The `mach_task_basic_info` of `task_info` on macOS."""
+
+    _pack_ = 4
+    _fields_ = [
+        ("virtual_size", ctypes.c_uint64),
+        ("resident_size", ctypes.c_uint64),
+        ("resident_size_max", ctypes.c_uint64),
+        ("user_time", ctypes.c_int32 * 2),
+        ("system_time", ctypes.c_int32 * 2),
+        ("policy", ctypes.c_int32),
+        ("suspend_count", ctypes.c_int32),
+    ]
+
+
+# Flavor of `task_info` filling a `MachTaskBasicInfo`
+MACH_TASK_BASIC_INFO = 20
+
+
+def mach_rss():
+    """Return the current resident set size from the Mach kernel, or None."""
+    try:
+        libc = ctypes.CDLL(None)
+        task = ctypes.c_uint32.in_dll(libc, "mach_task_self_")
+    except (OSError, ValueError):
+        return None
+    info = MachTaskBasicInfo()
+    # The size of the structure in `natural_t` (32-bit) units
+    count = ctypes.c_uint32(ctypes.sizeof(info) // 4)
+    status = libc.task_info(
+        task, MACH_TASK_BASIC_INFO, ctypes.byref(info), ctypes.byref(count)
+    )
+    return info.resident_size if status == 0 else None
@@ -0,0 +1,201 @@
+"""Report where the time of a run went."""
+
+# With `--timings` (or the environment variable THINGS_CLI_TIMINGS) a JSON
+# object with the wall time per phase, the number of queries and of rows they
+# returned, the number of tasks shown and the peak memory of the process is
+# written to stderr (the error stream of the command in server and batch mode)
+# after the run, for example:
+#
+#     {"command": "today", "seconds": 0.0123,
+#      "phases": {"parse": ..., "query": ..., "render": ..., "write": ...},
+#      "queries": 2, "rows": 14, "tasks": 14, "cached": false,
+#      "peak_rss_bytes": 31457280}
+#
+# If THINGS_CLI_TIMINGS is set to anything else than `1`, it is a file the
+# reports are appended to as JSON lines instead. With `--profile FILE` (or
+# THINGS_CLI_PROFILE) a cProfile dump of the run is written for pstats; a
+# directory gets one `things-cli-<pid>.prof` per process.
+
+# This module is imported on every run, its other imports are deferred.
+# pylint: disable=import-outside-toplevel
+
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+
+ENVIRONMENT_VARIABLE_WITH_TIMINGS = "THINGS_CLI_TIMINGS"
+ENVIRONMENT_VARIABLE_WITH_PROFILE = "THINGS_CLI_PROFILE"
+
+
+def requested(args):
+    """Return whether timings or a profile were asked for."""
+    return bool(
+        args.timings
+        or args.profile
+        or os.getenv(ENVIRONMENT_VARIABLE_WITH_TIMINGS)
+        or os.getenv(ENVIRONMENT_VARIABLE_WITH_PROFILE)
+    )
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes, or None."""
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def count_tasks(tasks):
+    """Return the number of tasks, including nested items and checklists."""
+    if not isinstance(tasks, list):
+        return 0
+    count = 0
+    for task in tasks:
+        if "type" in task:
+            count += 1
+        count += count_tasks(task.get("items")) + count_tasks(task.get("checklist"))
+    return count
+
+
+class Timings:  # pylint: disable=too-many-instance-attributes
+    """Attribute the wall time of a run to consecutive phases."""
+
+    # `mark(phase)` adds the time since the previous mark to `phase`. Time spent
+    # writing to the output stream is counted as `write` instead.
+
+    def __init__(self, started=None):
+        """Start timing at `started` (a `time.perf_counter()`) or now."""
+        import threading
+
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+        self.phases = {}
+        self.writing = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.tasks = None
+        self.cached = False
+        self.lock = threading.Lock()
+
+    def mark(self, phase):
+        """Add the time since the last mark, less writing, to a phase."""
+        now = time.perf_counter()
+        elapsed = now - self.last - self.writing
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        if self.writing:
+            self.phases["write"] = self.phases.get("write", 0.0) + self.writing
+        self.last = now
+        self.writing = 0.0
+
+    def count_query(self, rows):
+        """Count a query and the rows it returned."""
+        with self.lock:
+            self.queries += 1
+            self.rows += rows
+
+    def report(self, command):
+        """Return the report of the run as a dict."""
+        return {
+            "command": command,
+            "seconds": round(self.last - self.started, 6),
+            "phases": {name: round(value, 6) for name, value in self.phases.items()},
+            "queries": self.queries,
+            "rows": self.rows,
+            "tasks": self.tasks,
+            "cached": self.cached,
+            "peak_rss_bytes": peak_rss(),
+        }
+
+
+class TimedStream:
+    """Output stream counting the time spent writing."""
+
+    def __init__(self, stream, timings):
+        """Wrap a stream."""
+        self.wrapped = stream
+        self.timings = timings
+
+    def write(self, data):
+        """Write data."""
+        start = time.perf_counter()
+        try:
+            return self.wrapped.write(data)
+        finally:
+            self.timings.writing += time.perf_counter() - start
+
+    def writelines(self, lines):
+        """Write lines, counting only the writes and not producing the lines."""
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Flush the wrapped stream."""
+        start = time.perf_counter()
+        try:
+            self.wrapped.flush()
+        finally:
+            self.timings.writing += time.perf_counter() - start
+
+
+def profile_path(path):
+    """Return the file of a profile, one per process inside a directory."""
+    if os.path.isdir(path):
+        return os.path.join(path, f"things-cli-{os.getpid()}.prof")
+    return path
+
+
+def write_report(report, target, stream):
+    """Write a report to a stream (`target` is True or "1") or append it to a file."""
+    import json
+
+    line = json.dumps(report)
+    if target is True or target == "1":
+        print(line, file=stream)
+    else:
+        with open(target, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+@contextmanager
+def instrument(things_cli, args, started=None):
+    """Time and/or profile the run of a command as requested."""
+    # `started` is when the command line started to be parsed, if it was.
+    target = args.timings or os.getenv(ENVIRONMENT_VARIABLE_WITH_TIMINGS)
+    path = args.profile or os.getenv(ENVIRONMENT_VARIABLE_WITH_PROFILE)
+
+    timings = Timings(started)
+    if started is not None:
+        timings.mark("parse")
+    profiler = None
+    if path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    output = things_cli.output
+    # Queries are counted by the database of the run (see `open_database`)
+    database = things_cli.things_database
+    things_cli.output = TimedStream(things_cli.stream, timings)
+    things_cli.timings = timings
+    try:
+        if profiler:
+            profiler.enable()
+        try:
+            yield timings
+        finally:
+            if profiler:
+                profiler.disable()
+    finally:
+        timings.mark("other")
+        things_cli.output = output
+        things_cli.timings = None
+        things_cli.things_database = database
+        if profiler:
+            profiler.dump_stats(profile_path(path))
+        if target:
+            write_report(timings.report(args.command), target, things_cli.error_stream)
@@ -0,0 +1,329 @@
+"""Load the recursive output (`-r`) with a constant number of queries."""
+
+# With `include_items`, things.py fetches the items of every area, project and
+# heading, the checklist of every to-do and the tags of every task in separate
+# queries. Here the top-level tasks are fetched by things.py without items, then
+# each level of the tree is fetched in one query per kind of parent and
+# assembled by parent uuid. The filters and the order of the queries are those
+# of things.py, so the tree is the one things.py returns, including its quirks
+# (to-dos of a heading are items of the heading and of its project). Tags are
+# collected while the rows are built and resolved in one query per level.
+#
+# With `-e` (`--only-projects`) only areas and projects are fetched below the
+# top level: areas get their projects, projects and headings no items, so no
+# to-dos or checklists are loaded beyond the rows of the list itself.
+#
+# Rows are fetched as the compact records of `model`, also those of the queries
+# of things.py, so the tree never holds the dicts of things.py.
+
+# pylint: disable=import-outside-toplevel
+
+import json
+
+import things.database
+
+from things_cli.connection import ReadOnlyDatabase
+from things_cli.model import Record, from_dict
+
+
+# Items of a project, heading and area (see `things.api.tasks` and `areas`)
+ITEMS = f"""
+    TASK.{things.database.IS_NOT_RECURRING}
+    AND TASK.{things.database.TRASHED_TO_FILTER[False]}
+    AND TASK.{things.database.STATUS_TO_FILTER["incomplete"]}
+    """
+IN_JSON = "IN (SELECT value FROM json_each(?))"
+PROJECT_ITEMS = f"""{ITEMS}
+    AND (TASK.project {IN_JSON} OR PROJECT_OF_HEADING.uuid {IN_JSON})
+    """
+HEADING_ITEMS = f"""{ITEMS}
+    AND TASK.{things.database.IS_TODO}
+    AND TASK.heading {IN_JSON}
+    """
+# Areas and tags only show tasks outside of trashed projects
+CONTEXT = f"""
+    {things.database.make_truthy_filter("PROJECT.trashed", False)}
+    {things.database.make_truthy_filter("PROJECT_OF_HEADING.trashed", False)}
+    """
+AREA_ITEMS = f"""{ITEMS}{CONTEXT}
+    AND TASK.area {IN_JSON}
+    """
+# Items of a tag are not expanded any further (see `things.api.tags`)
+TAG_ITEMS = f"""{ITEMS}{CONTEXT}
+    AND TAG.title {IN_JSON}
+    """
+# Restriction of the items of areas and tags with `--only-projects`
+PROJECTS = f"AND TASK.{things.database.IS_PROJECT}"
+
+HEADING_PROJECTS_SQL = f"SELECT uuid, project FROM TMTask WHERE uuid {IN_JSON}"
+
+CHECKLIST_SQL = f"""
+    SELECT
+        CHECKLIST_ITEM.task AS parent,
+        CHECKLIST_ITEM.title,
+        CASE
+            WHEN CHECKLIST_ITEM.{things.database.STATUS_TO_FILTER["incomplete"]}
+                THEN 'incomplete'
+            WHEN CHECKLIST_ITEM.{things.database.STATUS_TO_FILTER["canceled"]}
+                THEN 'canceled'
+            WHEN CHECKLIST_ITEM.{things.database.STATUS_TO_FILTER["completed"]}
+                THEN 'completed'
+        END AS status,
+        date(CHECKLIST_ITEM.stopDate, "unixepoch", "localtime") AS stop_date,
+        'checklist-item' as type,
+        CHECKLIST_ITEM.uuid,
+        datetime(
+            CHECKLIST_ITEM.userModificationDate, "unixepoch", "localtime"
+        ) AS created,
+        datetime(
+            CHECKLIST_ITEM.userModificationDate, "unixepoch", "localtime"
+        ) AS modified
+    FROM TMChecklistItem AS CHECKLIST_ITEM
+    WHERE CHECKLIST_ITEM.task {IN_JSON}
+    ORDER BY CHECKLIST_ITEM."index"
+    """
+
+TAGGED_AREAS_SQL = f"""
+    SELECT DISTINCT
+        TAG.title AS parent,
+        AREA.uuid,
+        'area' as type,
+        AREA.title,
+        1 AS tags
+    FROM TMArea AS AREA
+    JOIN TMAreaTag AREA_TAG ON AREA_TAG.areas = AREA.uuid
+    JOIN TMTag TAG ON TAG.uuid = AREA_TAG.tags
+    WHERE TAG.title {IN_JSON}
+    ORDER BY AREA."index"
+    """
+
+TAGS_SQL = {
+    "task": f"""
+        SELECT TASK_TAG.tasks, TAG.title
+        FROM TMTaskTag AS TASK_TAG
+        LEFT OUTER JOIN TMTag TAG ON TAG.uuid = TASK_TAG.tags
+        WHERE TASK_TAG.tasks {IN_JSON}
+        ORDER BY TAG."index"
+        """,
+    "area": f"""
+        SELECT AREA_TAG.areas, TAG.title
+        FROM TMAreaTag AS AREA_TAG
+        LEFT OUTER JOIN TMTag TAG ON TAG.uuid = AREA_TAG.tags
+        WHERE AREA_TAG.areas {IN_JSON}
+        ORDER BY TAG."index"
+        """,
+}
+
+
+class TreeDatabase(ReadOnlyDatabase):
+    """Database of things.py whose tags of tasks and areas are resolved in bulk."""
+
+    # `get_tags(task=...)` and `get_tags(area=...)` return a list that is only
+    # filled by `resolve_tags`. Rows are records instead of dicts.
+
+    def __init__(self, filepath=None, pool=None, timings=None):
+        """Open the database."""
+        super().__init__(filepath=filepath, pool=pool, timings=timings)
+        self.pending = {"task": {}, "area": {}}
+
+    def execute_query(self, sql_query, parameters=(), row_factory=None):
+        """Run a query, returning its rows as records by default."""
+        return super().execute_query(
+            sql_query, parameters, row_factory or record_factory
+        )
+
+    def get_tags(self, title=None, area=None, task=None, titles_only=False):
+        """Return tags, deferring the tags of a task or an area."""
+        if task:
+            return self.pending["task"].setdefault(task, [])
+        if area:
+            return self.pending["area"].setdefault(area, [])
+        return super().get_tags(title=title, titles_only=titles_only)
+
+    def resolve_tags(self):
+        """Fill in the deferred tags with one query per kind of owner."""
+        for kind, pending in self.pending.items():
+            if not pending:
+                continue
+            rows = self.execute_query(
+                TAGS_SQL[kind], (json.dumps(list(pending)),), row_factory=tuple_factory
+            )
+            for owner, title in rows:
+                pending[owner].append(title)
+            pending.clear()
+
+    def query_tasks(self, where, uuids):
+        """Return the tasks of a where clause with one `IN_JSON` per parameter."""
+        # Their tags are deferred like those of the tasks of things.py.
+        parameters = (json.dumps(uuids),) * where.count(IN_JSON)
+        tasks = self.execute_query(
+            things.database.make_tasks_sql_query(where), parameters
+        )
+        for task in tasks:
+            if task.get("tags"):
+                task["tags"] = self.get_tags(task=task["uuid"])
+        return tasks
+
+
+def tuple_factory(_cursor, row):
+    """Return rows as tuples."""
+    return row
+
+
+def record_factory(cursor, row):
+    """Return rows as records, with the values of `dict_factory` of things.py."""
+    return from_dict(things.database.dict_factory(cursor, row))
+
+
+def group(rows, keys):
+    """Group rows by the parent keys returned by `keys(row)`, keeping their order."""
+    groups = {}
+    for row in rows:
+        for key in keys(row):
+            groups.setdefault(key, []).append(row)
+    return groups
+
+
+class TreeLoader:
+    """Add the items of a list of tasks, areas or tags, level by level."""
+
+    def __init__(self, database, only_projects=False):
+        """Use a `TreeDatabase`, loading only areas and projects if asked to."""
+        self.database = database
+        self.only_projects = only_projects
+
+    def load(self, rows):
+        """Add items, checklists and tags to the rows like `include_items`."""
+        level = rows
+        while level:
+            self.database.resolve_tags()
+            level = self.expand(level)
+        self.database.resolve_tags()
+        return rows
+
+    def expand(self, rows):
+        """Add the items of one level of rows, return the rows of the next."""
+        parents = {}
+        for row in rows:
+            if isinstance(row, (dict, Record)):
+                parents.setdefault(row["type"], []).append(row)
+        children = []
+        if self.only_projects:
+            # Projects and headings only have to-dos and headings as items
+            for parent in parents.get("project", []) + parents.get("heading", []):
+                parent["items"] = []
+        elif "project" in parents:
+            children += self.expand_projects(parents["project"])
+        if "heading" in parents and not self.only_projects:
+            uuids = [heading["uuid"] for heading in parents["heading"]]
+            groups = group(
+                self.database.query_tasks(HEADING_ITEMS, uuids),
+                lambda row: [row.get("heading")],
+            )
+            children += self.assign(parents["heading"], groups, "items")
+        if "area" in parents:
+            uuids = [area["uuid"] for area in parents["area"]]
+            groups = group(
+                self.database.query_tasks(AREA_ITEMS + self.restriction(), uuids),
+                lambda row: [row.get("area")],
+            )
+            children += self.assign(parents["area"], groups, "items")
+        if "to-do" in parents:
+            self.expand_checklists(parents["to-do"])
+        if "tag" in parents:
+            self.expand_tags(parents["tag"])
+        return children
+
+    def restriction(self):
+        """Return the condition added to the items of areas and tags."""
+        return PROJECTS if self.only_projects else ""
+
+    @staticmethod
+    def assign(parents, groups, key):
+        """Set the groups as items of their parents, return all new items."""
+        # Parents listed twice get their own copies of the rows, like they would
+        # from separate queries.
+        children = []
+        assigned = set()
+        for parent in parents:
+            items = groups.get(parent["uuid"], [])
+            if parent["uuid"] in assigned:
+                items = [item.copy() for item in items]
+            assigned.add(parent["uuid"])
+            parent[key] = items
+            children += items
+        return children
+
+    def expand_projects(self, projects):
+        """Add the items of projects, to-dos before headings like the app."""
+        uuids = [project["uuid"] for project in projects]
+        rows = self.database.query_tasks(PROJECT_ITEMS, uuids)
+        headings = list({row["heading"] for row in rows if row.get("heading")})
+        heading_projects = {}
+        if headings:
+            heading_projects = dict(
+                self.database.execute_query(
+                    HEADING_PROJECTS_SQL,
+                    (json.dumps(headings),),
+                    row_factory=tuple_factory,
+                )
+            )
+        wanted = set(uuids)
+
+        def keys(row):
+            candidates = [row.get("project"), heading_projects.get(row.get("heading"))]
+            return [key for key in dict.fromkeys(candidates) if key in wanted]
+
+        groups = group(rows, keys)
+        for items in groups.values():
+            items.sort(key=lambda item: item["type"], reverse=True)
+        return self.assign(projects, groups, "items")
+
+    def expand_checklists(self, todos):
+        """Add the checklist items of to-dos that have a checklist."""
+        todos = [todo for todo in todos if todo.get("checklist")]
+        if not todos:
+            return
+        rows = self.database.execute_query(
+            CHECKLIST_SQL, (json.dumps([todo["uuid"] for todo in todos]),)
+        )
+        groups = group(rows, lambda row: [row.pop("parent")])
+        self.assign(todos, groups, "checklist")
+
+    def expand_tags(self, tags):
+        """Add the areas and tasks of tags, without their own items."""
+        titles = json.dumps([tag["title"] for tag in tags])
+        areas = self.database.execute_query(TAGGED_AREAS_SQL, (titles,))
+        for area in areas:
+            area["tags"] = self.database.get_tags(area=area["uuid"])
+        tasks = self.database.query_tasks(
+            TAG_ITEMS + self.restriction(), [tag["title"] for tag in tags]
+        )
+        self.database.resolve_tags()
+        area_groups = group(areas, lambda row: [row.pop("parent")])
+        task_groups = group(tasks, lambda row: row["tags"])
+        for tag in tags:
+            # Tasks with several of the tags get a copy per tag
+            tag["items"] = [
+                item.copy()
+                for item in [
+                    *area_groups.get(tag["title"], []),
+                    *task_groups.get(tag["title"], []),
+                ]
+            ]
+
+
+def load(things_cli, name, defaults, nested=False):
+    """Return the result of the API function `name` with its items."""
+    # `nested` rows are shown as items, so with `--only-projects` only their
+    # areas and projects are kept and expanded.
+    import things as api
+
+    shared = things_cli.open_database()
+    database = TreeDatabase(shared.filepath, shared.pool, shared.timings)
+    arguments = dict(defaults, include_items=False, database=database)
+    rows = getattr(api, name)(**arguments)
+    if nested and things_cli.only_projects:
+        rows = [row for row in rows if row["type"] in ["area", "project"]]
+    loader = TreeLoader(database, only_projects=bool(things_cli.only_projects))
+    return loader.load(rows)
@@ -0,0 +1,197 @@
+"""Emit the changes to the result of a command whenever Things writes."""
+
+# The last result is kept indexed by uuid. After a write to the database (and a
+# quiet period to debounce bursts of writes) the command is run again and only
+# added, modified and removed tasks are written as JSON lines `{"event": ...,
+# "uuid": ..., "task": ...}`.
+
+from copy import copy
+import io
+import json
+import os
+import select
+import sqlite3
+import time
+
+from things_cli.cache import database_path
+from things_cli.connection import Pool, ReadOnlyDatabase
+
+
+DEFAULT_INTERVAL = 1.0
+
+
+class PollingWatcher:
+    """Detect writes by polling `PRAGMA data_version` of a read-only connection."""
+
+    def __init__(self, filepath, interval=DEFAULT_INTERVAL):
+        """Open the database to watch."""
+        self.interval = interval
+        self.connection = sqlite3.connect(f"file:{filepath}?mode=ro", uri=True)
+        self.version = self.data_version()
+
+    def data_version(self):
+        """Return the data version, which changes with every external commit."""
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def wait(self, timeout=None):
+        """Wait for a write, return False if there was none within `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            version = self.data_version()
+            if version != self.version:
+                self.version = version
+                return True
+            if deadline is None:
+                time.sleep(self.interval)
+            elif time.monotonic() >= deadline:
+                return False
+            else:
+                time.sleep(min(self.interval, deadline - time.monotonic()))
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+
+class KqueueWatcher:  # pragma: no cover
+    """Detect writes to the database, its write-ahead log and its directory."""
+
+    # pylint: disable=no-member
+
+    def __init__(self, filepath):
+        """Register the files to watch."""
+        self.kqueue = select.kqueue()
+        self.descriptors = []
+        for path in [filepath, filepath + "-wal", os.path.dirname(filepath)]:
+            try:
+                self.descriptors.append(os.open(path, os.O_RDONLY))
+            except OSError:
+                continue
+        self.events = [
+            select.kevent(  # pylint: disable=no-member
+                descriptor,
+                filter=select.KQ_FILTER_VNODE,  # pylint: disable=no-member
+                flags=select.KQ_EV_ADD
+                | select.KQ_EV_CLEAR,  # pylint: disable=no-member
+                fflags=select.KQ_NOTE_WRITE  # pylint: disable=no-member
+                | select.KQ_NOTE_EXTEND,  # pylint: disable=no-member
+            )
+            for descriptor in self.descriptors
+        ]
+        self.kqueue.control(self.events, 0, 0)
+
+    def wait(self, timeout=None):
+        """Wait for a write, return False if there was none within `timeout`."""
+        return bool(self.kqueue.control(None, len(self.events), timeout))
+
+    def close(self):
+        """Close the queue and the watched files."""
+        self.kqueue.close()
+        for descriptor in self.descriptors:
+            os.close(descriptor)
+
+
+def make_watcher(filepath, interval=DEFAULT_INTERVAL):
+    """Return the cheapest available watcher for a database."""
+    if hasattr(select, "kqueue"):  # pragma: no cover
+        return KqueueWatcher(filepath)
+    return PollingWatcher(filepath, interval)
+
+
+def index_tasks(tasks, index=None):
+    """Index the tasks, their items and checklist items by uuid."""
+    # Nested items are indexed on their own and left out of their parent's
+    # record, so a change only shows up once.
+    index = {} if index is None else index
+    if not isinstance(tasks, list):
+        return index
+    for task in tasks:
+        if not isinstance(task, dict):
+            continue
+        record = {
+            key: value
+            for key, value in task.items()
+            if key not in ["items", "checklist"] or not isinstance(value, list)
+        }
+        if "uuid" in task:
+            index[task["uuid"]] = record
+        index_tasks(task.get("items"), index)
+        index_tasks(task.get("checklist"), index)
+    return index
+
+
+def diff(old, new):
+    """Return the events turning the `old` index into the `new` one."""
+    events = []
+    for uuid, task in new.items():
+        if uuid not in old:
+            events.append({"event": "added", "uuid": uuid, "task": task})
+        elif old[uuid] != task:
+            events.append({"event": "modified", "uuid": uuid, "task": task})
+    for uuid, task in old.items():
+        if uuid not in new:
+            events.append({"event": "removed", "uuid": uuid, "task": task})
+    return events
+
+
+def watched_arguments(things_cli, args):
+    """Return the parsed arguments of the watched command line."""
+    # Global options given before `watch` apply to the watched command, the
+    # output is always JSON.
+    argv = args.watched[1:] if args.watched[:1] == ["--"] else args.watched
+    if not argv:
+        things_cli.error("watch: a command to watch is required")
+    watched = things_cli.get_parser().parse_args(argv, namespace=copy(args))
+    for option in ["jsonl", "csv", "opml", "gantt"]:
+        setattr(watched, option, False)
+    watched.json = True
+    watched.no_cache = True
+    return watched
+
+
+def query(things_cli, watched, database):
+    """Run the watched command and return the indexed result."""
+    # pylint: disable=import-outside-toplevel
+    from things_cli.cli import ThingsCLI
+
+    output = io.StringIO()
+    runner = ThingsCLI(database=things_cli.database, output=output)
+    runner.things_database = database
+    runner.main(watched)
+    return index_tasks(json.loads(output.getvalue()))
+
+
+def changes(things_cli, args, watcher=None):
+    """Yield the events of each write, starting with the current result."""
+    # The list of events is empty if a write did not change the result.
+    watched = watched_arguments(things_cli, args)
+    filepath = database_path(watched.database or things_cli.database)
+    database = ReadOnlyDatabase(
+        filepath, Pool(things_cli.mmap_size, things_cli.page_cache)
+    )
+    watcher = watcher or make_watcher(filepath, args.interval)
+    index = {}
+    try:
+        while True:
+            new = query(things_cli, watched, database)
+            events = diff(index, new)
+            index = new
+            yield events
+            watcher.wait()
+            while watcher.wait(args.debounce):
+                pass
+    finally:
+        watcher.close()
+        database.pool.close()
+
+
+def watch(things_cli, args):
+    """Write change events as JSON lines for the `watch` command."""
+    stream = things_cli.stream
+    try:
+        for number, events in enumerate(changes(things_cli, args)):
+            if events and (number or not args.skip_initial):
+                stream.writelines(json.dumps(event) + "\n" for event in events)
+                stream.flush()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass